@@ -0,0 +1,206 @@
+"""
+This module contains the in-memory indexes over the accounts of the vault.
+
+The vault stores one entry per account, keyed by (website, email). The indexes answer in constant time which accounts
+are stored for a website, which websites use an email and which websites share a domain, and they are updated one
+account at a time when an entry is saved or deleted, so nothing scans the vault.
+
+Most websites have a single account and most domains a single website, so these map to the name itself and only
+grow into a tuple when a second one is added, which keeps the index small for vaults of millions of entries. The
+email and domain indexes are only built the first time they are queried.
+
+Classes:
+
+AccountIndex:
+    This class maps websites to their accounts, emails to their websites and domains to their websites.
+Methods:
+
+AccountIndex.add():
+    This method adds an account to the indexes.
+AccountIndex.remove():
+    This method removes an account from the indexes.
+AccountIndex.emails():
+    This method returns the emails of the accounts stored for a website.
+AccountIndex.websites_for_email():
+    This method returns the websites with an account using an email.
+AccountIndex.websites_for_domain():
+    This method returns the websites sharing the normalised domain of a website name.
+Functions:
+
+normalise_domain():
+    This function reduces a website name or address to the name of its domain.
+
+Constants:
+
+SECOND_LEVEL_LABELS: Labels that are part of a country suffix (as in co.uk) rather than the name of the domain.
+"""
+
+SECOND_LEVEL_LABELS = frozenset(("ac", "co", "com", "edu", "gov", "net", "org"))
+
+
+class AccountIndex:
+    """Class keeping the indexes over the accounts of the vault
+
+    Attributes:
+        sites (dict)
+            website name mapped to the email of its account, or to a sorted tuple of emails if it has several
+    """
+
+    def __init__(self, accounts=()):
+        """
+        Constructor of the AccountIndex class
+        :param accounts: iterable with the tuples (website, email) of the stored accounts
+        """
+        self.sites = {}
+        self._emails = None
+        self._domains = None
+        for website, email in accounts:
+            _insert(self.sites, website, email)
+
+    def add(self, website: str, email: str) -> None:
+        """
+        Add an account to the indexes, accounts already indexed are ignored
+        :param website: website name as stored in the vault
+        :param email: email or username of the account
+        """
+        new_website = website not in self.sites
+        if not _insert(self.sites, website, email):
+            return
+        if self._emails is not None:
+            self._emails.setdefault(email.lower(), set()).add(website)
+        if new_website and self._domains is not None:
+            _insert(self._domains, normalise_domain(website), website)
+
+    def remove(self, website: str, email: str) -> None:
+        """
+        Remove an account from the indexes, unknown accounts are ignored
+        :param website: website name as stored in the vault
+        :param email: email or username of the account
+        """
+        if not _discard(self.sites, website, email):
+            return
+        if self._emails is not None:
+            websites = self._emails.get(email.lower())
+            if websites is not None:
+                websites.discard(website)
+                if not websites:
+                    del self._emails[email.lower()]
+        if website not in self.sites and self._domains is not None:
+            _discard(self._domains, normalise_domain(website), website)
+
+    def emails(self, website: str) -> tuple:
+        """
+        Get the emails of the accounts stored for a website
+        :param website: website name as stored in the vault
+        :return: sorted tuple of emails, empty if the website is not stored
+        """
+        return _values(self.sites.get(website))
+
+    def websites_for_email(self, email: str) -> list:
+        """
+        Get the websites with an account using an email
+        :param email: email or username, in any case
+        :return: sorted list of website names
+        """
+        if self._emails is None:
+            emails = {}
+            for website, values in self.sites.items():
+                for stored_email in _values(values):
+                    emails.setdefault(stored_email.lower(), set()).add(website)
+            self._emails = emails
+        return sorted(self._emails.get(email.lower(), ()))
+
+    def websites_for_domain(self, website: str) -> list:
+        """
+        Get the websites sharing the normalised domain of a website name, so "Github", "Github.com" and
+        "Https://www.github.com/login" are found together
+        :param website: website name or address, in any case
+        :return: sorted list of website names
+        """
+        if self._domains is None:
+            domains = {}
+            for stored_website in self.sites:
+                _insert(domains, normalise_domain(stored_website), stored_website)
+            self._domains = domains
+        return list(_values(self._domains.get(normalise_domain(website))))
+
+    def __len__(self) -> int:
+        return len(self.sites)
+
+    def __contains__(self, website: str) -> bool:
+        return website in self.sites
+
+
+def normalise_domain(website: str) -> str:
+    """
+    Reduce a website name or address to the name of its domain: the scheme, the path, the port, "www." and the
+    top-level domain are dropped, as is a subdomain in front of the name ("accounts.google.com" becomes "google",
+    "bbc.co.uk" becomes "bbc"). Names without a dot are only lower-cased.
+    :param website: website name or address
+    :return: lower-cased name of the domain
+    """
+    host = website.strip().lower()
+    if "://" in host:
+        host = host.split("://", 1)[1]
+    for separator in "/?#":
+        host = host.split(separator, 1)[0]
+    host = host.rsplit("@", 1)[-1].split(":", 1)[0].strip(".")
+    labels = host.split(".")
+    if len(labels) == 1:
+        return host
+    labels.pop()
+    if len(labels) > 1 and labels[-1] in SECOND_LEVEL_LABELS:
+        labels.pop()
+    return labels[-1]
+
+
+def _insert(mapping: dict, key: str, value: str) -> bool:
+    """
+    Add a value under a key holding a single value or a sorted tuple of values
+    :param mapping: index to update
+    :param key: key of the index
+    :param value: value to add
+    :return: True if the value was added, False if it was already there
+    """
+    values = mapping.get(key)
+    if values is None:
+        mapping[key] = value
+    elif isinstance(values, str):
+        if values == value:
+            return False
+        mapping[key] = tuple(sorted((values, value)))
+    else:
+        if value in values:
+            return False
+        mapping[key] = tuple(sorted(values + (value,)))
+    return True
+
+
+def _discard(mapping: dict, key: str, value: str) -> bool:
+    """
+    Remove a value from under a key holding a single value or a sorted tuple of values
+    :param mapping: index to update
+    :param key: key of the index
+    :param value: value to remove
+    :return: True if the value was removed, False if it was not there
+    """
+    values = mapping.get(key)
+    if values is None or value not in _values(values):
+        return False
+    remaining = tuple(other for other in _values(values) if other != value)
+    if not remaining:
+        del mapping[key]
+    else:
+        mapping[key] = remaining[0] if len(remaining) == 1 else remaining
+    return True
+
+
+def _values(values) -> tuple:
+    """
+    Get the values stored under a key of an index
+    :param values: single value, tuple of values or None
+    :return: tuple of values, empty for None
+    """
+    if values is None:
+        return ()
+    return (values,) if isinstance(values, str) else values
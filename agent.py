@@ -0,0 +1,560 @@
+"""
+This module contains the unlock agent of the password manager, a background process that keeps one vault unlocked.
+
+The agent asks for the passphrase once, derives the key, loads the vault into memory and answers get, add, delete,
+search, list and audit requests over a Unix domain socket, so the GUI and the command line interface opened afterwards
+do not run the key derivation or decrypt the vault again. The socket is created with 0600 permissions in a directory
+other users cannot write to, and connections from other users are refused. After an idle timeout without any request the
+agent locks itself: it syncs the journal, removes the socket and exits, taking the key with it.
+
+The protocol is one JSON object per line in both directions: a request {"op": ..., ...} is answered with
+{"ok": true, "result": ...} or {"ok": false, "error": ...}.
+
+Usage:
+
+    python -m agent start [--directory DIR] [--idle-timeout SECONDS] [--detach]
+    python -m agent status [--directory DIR]
+    python -m agent stop [--directory DIR]
+
+Classes:
+
+AgentServer:
+    This class serves the requests of the clients from an opened vault.
+AgentClient:
+    This class sends requests to a running agent, with the same methods as the vault for the operations it serves.
+Methods:
+
+AgentServer.serve():
+    This method answers requests until the agent is stopped or locks itself after the idle timeout.
+AgentServer.stop():
+    This method stops the agent.
+AgentClient.get():
+    This method returns the email and password of one account of a website.
+AgentClient.accounts():
+    This method returns all the accounts stored for a website.
+AgentClient.matching_accounts():
+    This method returns the accounts of all the websites sharing the domain of a website name.
+AgentClient.accounts_for_email():
+    This method returns the accounts using an email, on every website.
+AgentClient.add():
+    This method saves an email and password for a website.
+AgentClient.delete():
+    This method deletes one account of a website.
+AgentClient.websites():
+    This method returns the names of all the stored websites.
+AgentClient.search():
+    This method returns the stored website names matching a prefix.
+AgentClient.suggest():
+    This method returns the stored website names matching a prefix, for the GUI thread.
+AgentClient.audit():
+    This method returns the reused and breached passwords of the vault, checked by the agent.
+AgentClient.warnings():
+    This method describes the damage the agent found in the record log.
+AgentClient.status():
+    This method returns the state of the agent.
+AgentClient.stop():
+    This method asks the agent to lock itself and exit.
+Functions:
+
+socket_path():
+    This function returns the path of the agent socket of a vault directory.
+connect():
+    This function connects to the agent of a vault directory if one is running.
+main():
+    This function parses the command line arguments and starts, checks or stops the agent.
+
+Constants:
+
+SOCKET_VARIABLE: Environment variable overriding the path of the agent socket.
+IDLE_TIMEOUT: Number of seconds without requests after which the agent locks itself.
+"""
+
+# argparse and tempfile are imported only where they are used, the GUI imports this module at startup
+import hashlib
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+SOCKET_VARIABLE = "PASSWORD_MANAGER_AGENT_SOCKET"
+IDLE_TIMEOUT = 15 * 60
+
+
+class AgentServer:
+    """Class serving the requests of the clients from an opened vault
+
+    Every client connection is handled on its own thread. The vault cache holds a lock, so
+    requests from several clients can run at the same time.
+
+    Attributes:
+        vault (Vault)
+            opened vault, loaded into memory
+        path (string)
+            path of the Unix domain socket
+        idle_timeout (float)
+            number of seconds without requests after which the agent locks itself, 0 to never lock
+        last_request (float)
+            time.monotonic() of the last request
+    """
+
+    def __init__(self, vault, path: str, idle_timeout: float = IDLE_TIMEOUT):
+        """
+        Constructor of the AgentServer class, it binds the socket with permissions for the current user only
+        :param vault: opened vault
+        :param path: path of the Unix domain socket
+        :param idle_timeout: number of seconds without requests after which the agent locks itself, 0 to never lock
+        :raises RuntimeError: if another agent is already serving the socket
+        :raises PermissionError: if other users could replace the socket in its directory
+        """
+        self.vault = vault
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.last_request = time.monotonic()
+        self._stopped = threading.Event()
+
+        _private_directory(os.path.dirname(os.path.abspath(path)))
+        if os.path.exists(path):
+            if _is_alive(path):
+                raise RuntimeError(f"An agent is already running on {path}")
+            # Left behind by an agent that was killed
+            os.remove(path)
+
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            self._socket.bind(path)
+        finally:
+            os.umask(old_umask)
+        self._socket.listen()
+        self._socket.settimeout(1.0)
+
+    def serve(self) -> None:
+        """
+        Accept connections until the agent is stopped or the idle timeout expires, then lock the vault
+        """
+        try:
+            while not self._stopped.is_set():
+                if self.idle_timeout and time.monotonic() - self.last_request > self.idle_timeout:
+                    break
+                try:
+                    connection, _ = self._socket.accept()
+                except socket.timeout:
+                    continue
+                if _peer_uid(connection) not in (None, os.getuid()):
+                    connection.close()
+                    continue
+                threading.Thread(target=self._handle, args=(connection,), daemon=True).start()
+        finally:
+            self._socket.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.vault.close()
+
+    def stop(self) -> None:
+        """
+        Stop the agent, serve returns within a second
+        """
+        self._stopped.set()
+
+    def _handle(self, connection: socket.socket) -> None:
+        """
+        Answer the requests of one client until it disconnects
+        :param connection: connected client socket
+        """
+        with connection, connection.makefile("rwb") as stream:
+            for line in stream:
+                self.last_request = time.monotonic()
+                try:
+                    response = {"ok": True, "result": self._dispatch(json.loads(line))}
+                except Exception as error:
+                    response = {"ok": False, "error": str(error), "type": type(error).__name__}
+                stream.write(json.dumps(response).encode("utf-8") + b"\n")
+                stream.flush()
+
+    def _dispatch(self, request: dict):
+        """
+        Run one request on the vault
+        :param request: decoded request {"op": ..., ...}
+        :return: result of the operation, serializable as JSON
+        :raises ValueError: if the operation is unknown
+        """
+        operation = request.get("op")
+        if operation == "get":
+            entry = self.vault.get(request["website"], request.get("email"))
+            return entry.to_dict() if entry is not None else None
+        if operation == "accounts":
+            return [entry.to_dict() for entry in self.vault.accounts(request["website"])]
+        if operation == "matching":
+            return [(website, entry.to_dict()) for website, entry in self.vault.matching_accounts(request["website"])]
+        if operation == "by_email":
+            return [(website, entry.to_dict()) for website, entry in self.vault.accounts_for_email(request["email"])]
+        if operation == "add":
+            self.vault.add(request["website"], request["email"], request["password"])
+            return None
+        if operation == "delete":
+            return self.vault.delete(request["website"], request["email"])
+        if operation == "search":
+            return self.vault.search(request["prefix"], request.get("limit", 10))
+        if operation == "websites":
+            return self.vault.websites()
+        if operation == "audit":
+            return self.vault.audit(request.get("breach_file"))
+        if operation == "warnings":
+            return self.vault.warnings()
+        if operation == "status":
+            return {"pid": os.getpid(), "directory": os.path.abspath(self.vault.directory),
+                    "idle_seconds": time.monotonic() - self.last_request, "idle_timeout": self.idle_timeout}
+        if operation == "stop":
+            self.stop()
+            return None
+        raise ValueError(f"Unknown operation: {operation}")
+
+
+class AgentClient:
+    """Class sending requests to a running agent
+
+    It has the same get, accounts, matching_accounts, accounts_for_email, add, delete,
+    websites, search, suggest, audit, warnings and close methods as the vault, so the GUI and the command line
+    interface can use either of them. Entries are returned as dictionaries.
+
+    Attributes:
+        path (string)
+            path of the Unix domain socket
+        cache (None)
+            the agent keeps the cache, there is none on the client side
+        recovery (None)
+            the journal was recovered by the agent
+    """
+
+    def __init__(self, path: str):
+        """
+        Constructor of the AgentClient class, it connects to the agent
+        :param path: path of the Unix domain socket
+        :raises OSError: if no agent is listening on the socket
+        """
+        self.path = path
+        self.cache = None
+        self.recovery = None
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(path)
+        self._stream = self._socket.makefile("rwb")
+        self._lock = threading.Lock()
+
+    def get(self, website: str, email: str = None):
+        """
+        Find the details of one account of a website
+        :param website: website name as typed by the user
+        :param email: email or username of the account. If None, the first account by email is returned.
+        :return: dictionary with "email" and "password", or None if no such account is stored for the website
+        :raises FileNotFoundError: if there is no data file yet
+        """
+        return self._request({"op": "get", "website": website, "email": email})
+
+    def accounts(self, website: str) -> list:
+        """
+        Find all the accounts stored for a website
+        :param website: website name as typed by the user
+        :return: list of dictionaries with "email" and "password", sorted by email
+        :raises FileNotFoundError: if there is no data file yet
+        """
+        return self._request({"op": "accounts", "website": website})
+
+    def matching_accounts(self, website: str) -> list:
+        """
+        Find the accounts of all the websites sharing the domain of a website name
+        :param website: website name or address as typed by the user
+        :return: list of pairs [website, {"email": ..., "password": ...}], the accounts of the website as typed first
+        :raises FileNotFoundError: if there is no data file yet
+        """
+        return self._request({"op": "matching", "website": website})
+
+    def accounts_for_email(self, email: str) -> list:
+        """
+        Find the accounts using an email, on every website
+        :param email: email or username, in any case
+        :return: list of pairs [website, {"email": ..., "password": ...}] sorted by website
+        :raises FileNotFoundError: if there is no data file yet
+        """
+        return self._request({"op": "by_email", "email": email})
+
+    def add(self, website: str, email: str, password: str) -> None:
+        """
+        Save an email and password for a website
+        :param website: website name
+        :param email: email or username
+        :param password: password
+        """
+        self._request({"op": "add", "website": website, "email": email, "password": password})
+
+    def delete(self, website: str, email: str) -> bool:
+        """
+        Delete one account of a website
+        :param website: website name
+        :param email: email or username of the account
+        :return: True if the account was deleted, False if it is not stored
+        :raises FileNotFoundError: if there is no data file yet
+        """
+        return self._request({"op": "delete", "website": website, "email": email})
+
+    def websites(self) -> list:
+        """
+        Get the names of all the stored websites
+        :return: list of website names
+        """
+        return self._request({"op": "websites"})
+
+    def search(self, prefix: str, limit: int = 10) -> list:
+        """
+        Find the stored website names matching the typed text
+        :param prefix: text typed by the user
+        :param limit: maximum number of names returned
+        :return: list of website names, best matches first
+        """
+        return self._request({"op": "search", "prefix": prefix, "limit": limit})
+
+    def suggest(self, prefix: str, limit: int = 10) -> list:
+        """
+        Find the stored website names matching the typed text. The agent keeps its vault loaded, so this is the same
+        as search.
+        :param prefix: text typed by the user
+        :param limit: maximum number of names returned
+        :return: list of website names, best matches first
+        """
+        return self.search(prefix, limit)
+
+    def audit(self, breach_file: str = None) -> dict:
+        """
+        Find the reused passwords and the passwords found in a breach list, the agent reads the breach list itself
+        :param breach_file: name of a local breach list in the "ordered by hash" format, None to only look for reuse
+        :return: report of audit.audit_entries, with lists instead of tuples
+        :raises FileNotFoundError: if the breach list does not exist
+        """
+        if breach_file is not None:
+            breach_file = os.path.abspath(breach_file)
+        return self._request({"op": "audit", "breach_file": breach_file})
+
+    def warnings(self) -> list:
+        """
+        Describe the damage the agent found in the record log
+        :return: list of messages, empty if the record log is intact
+        """
+        return self._request({"op": "warnings"})
+
+    def status(self) -> dict:
+        """
+        Get the state of the agent
+        :return: dictionary with the pid, the vault directory, the idle time and the idle timeout
+        """
+        return self._request({"op": "status"})
+
+    def stop(self) -> None:
+        """
+        Ask the agent to lock itself and exit
+        """
+        self._request({"op": "stop"})
+
+    def close(self) -> None:
+        """
+        Close the connection, the agent keeps running
+        """
+        try:
+            self._stream.close()
+        except OSError:
+            # The agent closed its end first, the request left in the buffer cannot be sent
+            pass
+        self._socket.close()
+
+    def _request(self, request: dict):
+        """
+        Send a request and wait for the response
+        :param request: request {"op": ..., ...}
+        :return: result of the operation
+        :raises FileNotFoundError: if the agent has no data file yet
+        :raises RuntimeError: if the agent reported another error
+        :raises ConnectionError: if the agent closed the connection
+        """
+        with self._lock:
+            self._stream.write(json.dumps(request).encode("utf-8") + b"\n")
+            self._stream.flush()
+            line = self._stream.readline()
+        if not line:
+            raise ConnectionError("The agent closed the connection")
+        response = json.loads(line)
+        if response["ok"]:
+            return response["result"]
+        if response.get("type") == "FileNotFoundError":
+            raise FileNotFoundError(response["error"])
+        # Some exceptions, like InvalidToken, have no message, their type is all there is to show
+        error_type = response.get("type", "Error")
+        raise RuntimeError(f"{error_type}: {response['error']}" if response["error"] else error_type)
+
+
+def socket_path(directory: str = ".") -> str:
+    """
+    Get the path of the agent socket of a vault directory. Every vault directory has its own agent.
+    :param directory: directory holding the key file and the data files
+    :return: path of the Unix domain socket
+    """
+    if os.environ.get(SOCKET_VARIABLE):
+        return os.environ[SOCKET_VARIABLE]
+    base = os.environ.get("XDG_RUNTIME_DIR") or _agent_directory()
+    name = hashlib.sha256(os.path.abspath(directory).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(base, f"password-manager-{name}.sock")
+
+
+def connect(directory: str = "."):
+    """
+    Connect to the agent of a vault directory
+    :param directory: directory holding the key file and the data files
+    :return: AgentClient, or None if no agent is running or Unix domain sockets are not available
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    path = socket_path(directory)
+    if not os.path.exists(path):
+        return None
+    try:
+        return AgentClient(path)
+    except OSError:
+        return None
+
+
+def _is_alive(path: str) -> bool:
+    """
+    Check if an agent answers on a socket
+    :param path: path of the Unix domain socket
+    :return: True if a connection could be made
+    """
+    try:
+        AgentClient(path).close()
+    except OSError:
+        return False
+    return True
+
+
+def _agent_directory() -> str:
+    """
+    Get the directory the agent creates for its sockets when there is no XDG_RUNTIME_DIR
+    :return: path of a directory of the current user under the temporary directory
+    """
+    import tempfile
+
+    return os.path.join(tempfile.gettempdir(), f"password-manager-{os.getuid()}")
+
+
+def _private_directory(directory: str) -> None:
+    """
+    Make sure other users cannot replace the socket. Only the directory of the agent under the temporary directory is
+    created and made private here, any other directory, like XDG_RUNTIME_DIR or the directory of a socket given in
+    PASSWORD_MANAGER_AGENT_SOCKET, has to be safe already and is left as it is.
+    :param directory: directory of the socket
+    :raises PermissionError: if the directory belongs to another user, or other users can write to it
+    """
+    if directory == _agent_directory():
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # A link planted by another user would send the socket to a directory of their choosing
+        if os.path.islink(directory) or os.stat(directory).st_uid != os.getuid():
+            raise PermissionError(f"{directory} belongs to another user")
+        os.chmod(directory, 0o700)
+        return
+
+    status = os.stat(directory)
+    if status.st_uid != os.getuid():
+        raise PermissionError(f"{directory} belongs to another user, choose a directory of your own for the socket")
+    if status.st_mode & 0o022:
+        raise PermissionError(f"Other users can write to {directory}, choose a private directory for the socket")
+
+
+def _peer_uid(connection: socket.socket):
+    """
+    Get the user id of the process at the other end of a connection
+    :param connection: connected socket
+    :return: user id, or None if the platform cannot tell
+    """
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    _, uid, _ = struct.unpack("3i", credentials)
+    return uid
+
+
+def main(argv=None) -> int:
+    """
+    Parse the command line arguments and start, check or stop the agent
+    :param argv: list of arguments, sys.argv is used if None
+    :return: exit status
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m agent", description="Unlock agent of the password manager")
+    parser.add_argument("--directory", default=".", help="directory holding the key file and the data files")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    start_parser = subparsers.add_parser("start", help="unlock the vault and serve it until the idle timeout")
+    start_parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT,
+                              help=f"seconds without requests before locking (default {IDLE_TIMEOUT}, 0 for never)")
+    start_parser.add_argument("--detach", action="store_true", help="run in the background once unlocked")
+    subparsers.add_parser("status", help="show if an agent is running")
+    subparsers.add_parser("stop", help="lock the vault and stop the agent")
+
+    args = parser.parse_args(argv)
+
+    if args.command in ("status", "stop"):
+        client = connect(args.directory)
+        if client is None:
+            print("No agent is running", file=sys.stderr)
+            return 1
+        if args.command == "status":
+            status = client.status()
+            print(f"Agent {status['pid']} serving {status['directory']}, idle for {status['idle_seconds']:.0f} s")
+        else:
+            client.stop()
+        client.close()
+        return 0
+
+    from cli import read_key
+    from vault import Vault
+
+    vault = Vault(args.directory)
+    if not vault.has_key():
+        print("No encryption key has been set up yet, please run python -m cli init or start the GUI first.",
+              file=sys.stderr)
+        return 1
+    key = read_key()
+    if not vault.check_key(key):
+        print("The encryption key entered is incorrect.", file=sys.stderr)
+        return 1
+    vault.open(key)
+    # The agent holds only the derived key for its whole lifetime, not the passphrase
+    del key
+    try:
+        vault.websites()
+    except FileNotFoundError:
+        pass
+    for warning in vault.warnings():
+        print(f"Warning: {warning}", file=sys.stderr)
+    # Threads do not survive a fork, so a compaction started by open has to finish first
+    vault.cache.wait_for_compaction()
+
+    try:
+        server = AgentServer(vault, socket_path(args.directory), args.idle_timeout)
+    except (RuntimeError, OSError) as error:
+        vault.close()
+        print(error, file=sys.stderr)
+        return 1
+    print(f"Agent listening on {server.path}", file=sys.stderr)
+    if args.detach and os.fork():
+        # The parent returns to the shell, the child keeps serving
+        return 0
+    if args.detach:
+        os.setsid()
+        sys.stdin.close()
+    server.serve()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
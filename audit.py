@@ -0,0 +1,218 @@
+"""
+This module contains the offline audit of the vault: passwords used by more than one account and passwords found in a
+local copy of a breach list.
+
+Reuse is found in a single pass: every password is hashed once with SHA-1 and the accounts are bucketed by digest, so
+no two passwords are ever compared. The same digests are then looked up in the Have I Been Pwned password list in its
+"ordered by hash" format, one "SHA1:COUNT" line per breached password, sorted by hash. The list is tens of GB, so it
+is memory-mapped and searched with a binary search over byte offsets, every probe moving back to the start of its
+line; only the pages touched by the search are read. The digests are searched in sorted order, so every search starts
+where the previous one ended. Nothing leaves the machine.
+
+Classes:
+
+BreachList:
+    This class looks SHA-1 digests up in a memory-mapped breach list sorted by hash.
+Methods:
+
+BreachList.count():
+    This method returns how many times a password digest appears in the breach list.
+BreachList.counts():
+    This method looks many digests up in sorted order.
+BreachList.close():
+    This method releases the memory map.
+Functions:
+
+audit_entries():
+    This function finds the reused and the breached passwords of the given entries and measures the throughput.
+report_lines():
+    This function lists the accounts flagged by an audit, one line per account or group of accounts.
+report_summary():
+    This function sums an audit up in one line.
+
+Constants:
+
+BREACH_FILE_VARIABLE: Environment variable with the path of the breach list used by default.
+HASH_LENGTH: Number of hexadecimal digits of a SHA-1 digest, at the start of every line of the breach list.
+"""
+
+import hashlib
+import mmap
+import time
+
+from metrics import measure
+
+BREACH_FILE_VARIABLE = "PASSWORD_MANAGER_BREACH_FILE"
+HASH_LENGTH = 40
+
+
+class BreachList:
+    """Class looking password digests up in a breach list sorted by hash, without reading it into memory
+
+    Attributes:
+        file_name (string)
+            name of the breach list, lines "SHA1:COUNT" sorted by hash
+    """
+
+    def __init__(self, file_name: str):
+        """
+        Constructor of the BreachList class, it maps the file
+        :param file_name: name of the breach list
+        :raises FileNotFoundError: if the file does not exist
+        :raises ValueError: if the file is empty
+        """
+        self.file_name = file_name
+        self._file = open(file_name, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"The breach list {file_name} is empty")
+        if hasattr(mmap, "MADV_RANDOM"):
+            # A binary search reads single pages far apart, read-ahead would only evict useful pages
+            self._map.madvise(mmap.MADV_RANDOM)
+        # The list is published in upper case, lower-case copies are searched in their own case
+        self._lower = self._map[:HASH_LENGTH].islower()
+
+    def count(self, digest: bytes) -> int:
+        """
+        Find how many times a password appears in the breach list
+        :param digest: SHA-1 digest of the password
+        :return: number of times the password was seen in breaches, 0 if it is not in the list
+        """
+        return self._search(self._key(digest), 0)[0]
+
+    def counts(self, digests) -> dict:
+        """
+        Look many digests up, in sorted order so that every search starts where the previous one ended
+        :param digests: iterable of SHA-1 digests
+        :return: dictionary {digest: count} of the digests found in the list
+        """
+        found = {}
+        low = 0
+        for digest in sorted(digests):
+            count, low = self._search(self._key(digest), low)
+            if count:
+                found[digest] = count
+        return found
+
+    def close(self) -> None:
+        """
+        Release the memory map and the file
+        """
+        self._map.close()
+        self._file.close()
+
+    def _key(self, digest: bytes) -> bytes:
+        """
+        Turn a digest into the form used by the lines of the list
+        :param digest: SHA-1 digest
+        :return: hexadecimal digest in the case of the list
+        """
+        key = digest.hex()
+        return (key if self._lower else key.upper()).encode("ascii")
+
+    def _search(self, key: bytes, low: int) -> tuple:
+        """
+        Binary search over the byte offsets of the list. Every probe moves back to the start of its line, so low and
+        high always stay at line boundaries.
+        :param key: hexadecimal digest in the case of the list
+        :param low: offset of a line at or before the line of the key
+        :return: tuple (count, offset of the line of the key, or of the first line after it if it is not in the list)
+        """
+        data = self._map
+        high = len(data)
+        while low < high:
+            middle = (low + high) // 2
+            start = max(data.rfind(b"\n", low, middle) + 1, low)
+            end = data.find(b"\n", start)
+            if end < 0:
+                end = len(data)
+            line_key = data[start:start + HASH_LENGTH]
+            if line_key < key:
+                low = end + 1
+            elif line_key > key:
+                high = start
+            else:
+                # Lines without a count only list the password
+                count = data[start + HASH_LENGTH + 1:end].strip()
+                return int(count) if count else 1, start
+        return 0, low
+
+
+def audit_entries(entries, breach_file: str = None) -> dict:
+    """
+    Find the passwords used by more than one account and, if a breach list is given, the passwords found in it
+    :param entries: iterable of tuples (website, Entry or {"email": ..., "password": ...})
+    :param breach_file: name of the breach list in the "ordered by hash" format, None to only look for reuse
+    :return: dictionary with the number of passwords and of distinct passwords, the groups of accounts sharing a
+             password (lists of tuples (website, email), largest first), the breached accounts (tuples (website,
+             email, count), most seen first), the elapsed time in seconds and the passwords checked per second
+    :raises FileNotFoundError: if the breach list does not exist
+    """
+    start = time.perf_counter()
+    first = {}
+    reused = {}
+    passwords = 0
+    with measure("audit_reuse"):
+        for website, entry in entries:
+            passwords += 1
+            account = (website, entry["email"])
+            digest = hashlib.sha1(entry["password"].encode("utf-8")).digest()
+            # Only the passwords seen twice get a list of accounts
+            other = first.setdefault(digest, account)
+            if other is not account:
+                reused.setdefault(digest, [other]).append(account)
+
+    breached = []
+    if breach_file is not None:
+        breach_list = BreachList(breach_file)
+        try:
+            with measure("audit_breach"):
+                found = breach_list.counts(first)
+        finally:
+            breach_list.close()
+        for digest, count in found.items():
+            breached.extend((website, email, count) for website, email in reused.get(digest, [first[digest]]))
+
+    seconds = time.perf_counter() - start
+    return {
+        "passwords": passwords,
+        "unique": len(first),
+        "reused": sorted(reused.values(), key=len, reverse=True),
+        "breached": sorted(breached, key=lambda account: (-account[2], account[0], account[1])),
+        "seconds": seconds,
+        "passwords_per_second": passwords / seconds if seconds else 0.0,
+    }
+
+
+def report_lines(report: dict) -> list:
+    """
+    List the accounts flagged by an audit, without their passwords
+    :param report: report of audit_entries
+    :return: list of lines, the groups of accounts sharing a password then the breached accounts, empty if nothing
+             was flagged
+    """
+    lines = []
+    if report["reused"]:
+        lines.append("Reused passwords:")
+        for accounts in report["reused"]:
+            lines.append("    " + ", ".join(f"{website} ({email})" for website, email in accounts))
+    if report["breached"]:
+        lines.append("Breached passwords:")
+        for website, email, count in report["breached"]:
+            lines.append(f"    {website} ({email}): seen {count} times")
+    return lines
+
+
+def report_summary(report: dict, breach_file: str = None) -> str:
+    """
+    Sum an audit up with its throughput and the number of flagged accounts
+    :param report: report of audit_entries
+    :param breach_file: name of the breach list the passwords were checked against, None if there was none
+    :return: summary line
+    """
+    checked = "checked against the breach list" if breach_file else "checked for reuse"
+    return (f"{report['passwords']} passwords {checked} in {report['seconds']:.2f} s "
+            f"({report['passwords_per_second']:.0f} passwords/s): {len(report['reused'])} reused, "
+            f"{len(report['breached'])} breached")
@@ -0,0 +1,83 @@
+"""
+Throughput benchmark of the offline password audit.
+
+A synthetic breach list in the Have I Been Pwned "ordered by hash" format (one "SHA1:COUNT" line per password, sorted
+by hash, CRLF line endings) is written once, then vaults of several sizes, where every third password is breached and
+one in a hundred is reused, are audited with and without the breach list. The passwords checked per second are
+printed. Pass --breach-file to audit against a real copy of the list instead.
+
+Usage:
+    python benchmarks/bench_audit.py [--sizes 1000 100000] [--breach-lines 5000000] [--breach-file FILE]
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from audit import audit_entries
+
+
+def write_breach_list(file_name: str, lines: int) -> None:
+    """
+    Write a synthetic breach list of the passwords "breached{i}"
+    :param file_name: name of the file to write
+    :param lines: number of passwords in the list
+    """
+    digests = sorted(hashlib.sha1(f"breached{i}".encode("utf-8")).digest() for i in range(lines))
+    with open(file_name, "wb") as file:
+        for number, digest in enumerate(digests):
+            file.write(b"%s:%d\r\n" % (digest.hex().upper().encode("ascii"), number % 1000 + 1))
+
+
+def make_entries(size: int, breach_lines: int) -> list:
+    """
+    Build synthetic entries, every third password breached and one in a hundred reused
+    :param size: number of entries
+    :param breach_lines: number of passwords in the synthetic breach list
+    :return: list of tuples (website, {"email": ..., "password": ...})
+    """
+    entries = []
+    for i in range(size):
+        if i % 100 == 0:
+            password = "reused-password"
+        elif i % 3 == 0:
+            password = f"breached{i % breach_lines}"
+        else:
+            password = f"p@ss-{i:08d}-word"
+        entries.append((f"Website{i:08d}", {"email": f"user{i % 10}@example.com", "password": password}))
+    return entries
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000])
+    parser.add_argument("--breach-lines", type=int, default=5000000)
+    parser.add_argument("--breach-file", help="real breach list to audit against instead of a synthetic one")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        breach_file = args.breach_file
+        if breach_file is None:
+            breach_file = os.path.join(directory, "breached.txt")
+            write_breach_list(breach_file, args.breach_lines)
+        print(f"breach list {os.path.getsize(breach_file) / 1e6:.0f} MB")
+
+        for size in args.sizes:
+            entries = make_entries(size, args.breach_lines)
+            reuse = audit_entries(entries)
+            breach = audit_entries(entries, breach_file)
+            print(f"{size} entries")
+            print(f"    reuse only     {reuse['passwords_per_second']:12.0f} passwords/s   "
+                  f"{len(reuse['reused'])} groups")
+            print(f"    breach list    {breach['passwords_per_second']:12.0f} passwords/s   "
+                  f"{len(breach['breached'])} breached")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Micro-benchmark of the vault serializer.
+
+It compares the legacy pipeline (str(dict) -> base64 -> Fernet and back with a quote replace and json.loads)
+with the versioned codec for vaults of different sizes and prints the throughput in MB/s of plaintext.
+
+Usage:
+    python benchmarks/bench_codec.py [--sizes 1000 10000 100000] [--repeat 5]
+"""
+
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography.fernet import Fernet
+
+from codec import FORMAT_VERSION, encode_vault, decode_vault
+
+
+def make_vault(size: int) -> dict:
+    """
+    Build a synthetic vault
+    :param size: number of entries
+    :return: dictionary {website: {"email": ..., "password": ...}}
+    """
+    return {f"Website{i:07d}": {"email": f"user{i % 10}@example.com", "password": f"p@ss-{i:07d}-word"}
+            for i in range(size)}
+
+
+def legacy_encode(cipher: Fernet, data: dict) -> bytes:
+    """Encrypt the vault the way the first version of the program did"""
+    return cipher.encrypt(base64.b64encode(str(data).encode("utf-8")))
+
+
+def legacy_decode(cipher: Fernet, token: bytes) -> dict:
+    """Decrypt the vault the way the first version of the program did"""
+    return json.loads(base64.b64decode(cipher.decrypt(token)).decode("utf-8").replace("'", "\""))
+
+
+def best_time(function, repeat: int) -> float:
+    """
+    Run the function several times
+    :param function: function without arguments
+    :param repeat: number of runs
+    :return: the shortest run time in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    cipher = Fernet(Fernet.generate_key())
+    print(f"{'entries':>8} {'format':>7} {'plain MB':>9} {'encode MB/s':>12} {'decode MB/s':>12} {'file MB':>8}")
+    for size in args.sizes:
+        data = make_vault(size)
+        plain_mb = len(encode_vault(data)) / 1e6
+
+        pipelines = {
+            "legacy": (lambda: legacy_encode(cipher, data), lambda token: legacy_decode(cipher, token)),
+            f"v{FORMAT_VERSION}": (lambda: cipher.encrypt(encode_vault(data)),
+                                   lambda token: decode_vault(cipher.decrypt(token))),
+        }
+        for name, (encode, decode) in pipelines.items():
+            token = encode()
+            encode_time = best_time(encode, args.repeat)
+            decode_time = best_time(lambda: decode(token), args.repeat)
+            print(f"{size:>8} {name:>7} {plain_mb:>9.2f} {plain_mb / encode_time:>12.1f} "
+                  f"{plain_mb / decode_time:>12.1f} {len(token) / 1e6:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
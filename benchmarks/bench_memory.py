@@ -0,0 +1,145 @@
+"""
+Memory benchmark of the decrypted vault.
+
+For every size a synthetic vault is written once, then loaded in a separate process in each of these ways:
+
+    dict      the whole vault as one Fernet token decoded into nested dictionaries, like the single-blob data file
+              of the first versions
+    entries   the chunked snapshot decoded chunk by chunk into Entry objects with interned emails
+    vault     Vault loading the snapshot and the record log, with the in-memory search index
+
+The peak RSS of the process and the memory still held once the vault is loaded are printed, both measured above the
+RSS of the process before loading. Every step runs in a fresh process, because Linux keeps the peak RSS of a parent
+in its children.
+
+Usage:
+    python benchmarks/bench_memory.py [--sizes 100000 1000000]
+"""
+
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+KEY = b"benchmark-key-of-thirty-two-byte"
+BLOB_FILE = "blob.bin"
+
+
+def make_entries(size: int) -> dict:
+    """
+    Build synthetic entries sharing ten emails, like a real vault mostly does
+    :param size: number of entries
+    :return: dictionary {website: {"email": ..., "password": ...}}
+    """
+    return {f"Website{i:08d}": {"email": f"user{i % 10}@example.com", "password": f"p@ss-{i:08d}-word"}
+            for i in range(size)}
+
+
+def rss_mb() -> float:
+    """
+    Get the current resident set size of this process
+    :return: RSS in MB, the peak RSS where the current one cannot be read
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    """
+    Get the peak resident set size of this process
+    :return: peak RSS in MB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+
+def write_vault(directory: str, size: int) -> None:
+    """
+    Write the chunked vault and the single-blob file of the same entries
+    :param directory: directory of the vault
+    :param size: number of entries
+    """
+    from codec import encode_vault
+    from vault import Vault
+
+    vault = Vault(directory)
+    vault.create_key(KEY)
+    vault.open(KEY)
+    entries = make_entries(size)
+    vault.add_many(entries)
+    vault.compact()
+    with open(os.path.join(directory, BLOB_FILE), "wb") as file:
+        file.write(vault.cipher.encrypt(encode_vault(entries)))
+    vault.close()
+
+
+def load(directory: str, mode: str) -> dict:
+    """
+    Load the vault in the current process and measure the memory
+    :param directory: directory of the vault
+    :param mode: "setup", "dict", "entries" or "vault"
+    :return: dictionary with the number of entries, the peak and the retained memory in MB
+    """
+    from codec import decode_vault
+    from vault import Vault
+
+    if mode == "setup":
+        write_vault(directory, int(os.environ["BENCH_SIZE"]))
+        return {}
+
+    vault = Vault(directory)
+    vault.open(KEY)
+    gc.collect()
+    before = rss_mb()
+
+    if mode == "dict":
+        with open(os.path.join(directory, BLOB_FILE), "rb") as file:
+            data = decode_vault(vault.cipher.decrypt(file.read()))
+    elif mode == "entries":
+        data = vault.cache.snapshot.load()
+    else:
+        data = vault.cache.get()
+    gc.collect()
+    return {"entries": len(data), "peak_mb": peak_rss_mb() - before, "retained_mb": rss_mb() - before}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--worker", nargs=2, metavar=("DIRECTORY", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        json.dump(load(*args.worker), sys.stdout)
+        return 0
+
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            results = {}
+            for mode in ("setup", "dict", "entries", "vault"):
+                output = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", directory, mode],
+                                        check=True, capture_output=True, text=True, cwd=ROOT,
+                                        env=dict(os.environ, BENCH_SIZE=str(size))).stdout
+                results[mode] = json.loads(output)
+            del results["setup"]
+        print(f"{size} entries")
+        for mode, result in results.items():
+            print(f"    {mode:<8} peak {result['peak_mb']:8.1f} MB   retained {result['retained_mb']:8.1f} MB")
+        print(f"    entries use {results['entries']['retained_mb'] / results['dict']['retained_mb']:.0%} of the "
+              f"retained memory and {results['entries']['peak_mb'] / results['dict']['peak_mb']:.0%} of the peak")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
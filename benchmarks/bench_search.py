@@ -0,0 +1,63 @@
+"""
+Benchmark of the as-you-type website search.
+
+It builds a SearchIndex over synthetic website names with the usual domain suffixes (".com", ".co.uk"...), so that
+some trigrams are shared by almost every name, and measures the latency of search() for prefixes of growing length,
+as they are produced while the user is typing, and for a few queries made only of common trigrams.
+
+Usage:
+    python benchmarks/bench_search.py [--entries 100000] [--queries 2000]
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+SUFFIXES = (".com", ".com", ".com", ".co.uk", ".org", ".net", ".io", "")
+COMMON_QUERIES = ("githb.co", "xq.com", "ample.com", ".com", "co.uk")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_index import SearchIndex
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    generator = random.Random(0)
+    names = [("".join(generator.choices(string.ascii_lowercase, k=generator.randint(5, 14)))
+              + generator.choice(SUFFIXES)).capitalize() for _ in range(args.entries)]
+
+    start = time.perf_counter()
+    index = SearchIndex(names)
+    print(f"built index over {len(index.names)} names in {time.perf_counter() - start:.2f} s")
+
+    latencies = []
+    for _ in range(args.queries):
+        # Every keystroke of a name, sometimes with a typo, is one query
+        name = generator.choice(names).lower()
+        if generator.random() < 0.3:
+            name = name[:2] + generator.choice(string.ascii_lowercase) + name[3:]
+        for length in range(1, len(name) + 1):
+            start = time.perf_counter()
+            index.search(name[:length], limit=10)
+            latencies.append(time.perf_counter() - start)
+
+    latencies.sort()
+    print(f"{len(latencies)} queries: p50 {latencies[len(latencies) // 2] * 1000:.3f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.3f} ms, max {latencies[-1] * 1000:.3f} ms")
+
+    for query in COMMON_QUERIES:
+        start = time.perf_counter()
+        index.search(query, limit=10)
+        print(f"{query!r:<12} {(time.perf_counter() - start) * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
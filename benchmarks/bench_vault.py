@@ -0,0 +1,255 @@
+"""
+Benchmark suite for the vault operations across vault sizes.
+
+For every size a synthetic vault is written to a temporary directory and the following operations are timed in a
+separate process, so that the peak RSS of each size is measured on its own:
+
+    load            deriving the key, opening the vault and decrypting all the records
+    lookup          Vault.get of a random stored website, with the vault loaded in memory
+    cold_lookup     Vault.get of a random stored website right after opening, decrypting one snapshot chunk
+    cold_journal    first lookup of a newly opened vault whose journal is just under the compaction threshold, the most
+                    a cold lookup ever replays
+    domain_lookup   Vault.matching_accounts of a random stored website, through the domain index
+    delete          Vault.delete of a single account
+    add             Vault.add of a single entry
+    bulk_add        Vault.add_many of 1000 entries
+    save            rewriting the whole vault into a new chunked snapshot
+    generate        generating one random password
+    generate_batch  generating 1000 random passwords at once
+
+The mean, p50 and p99 latency of every operation and the peak RSS are written as JSON. When a baseline file is
+given, the run fails if the p50 of any operation or the peak RSS is worse than the baseline by more than the
+threshold.
+
+Usage:
+    python benchmarks/bench_vault.py [--sizes 1000 10000 100000 1000000] [--output results.json]
+                                     [--baseline baseline.json] [--threshold 0.25]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+KEY = b"benchmark-key-of-thirty-two-byte"
+BULK_SIZE = 1000
+
+
+def make_entries(size: int, offset: int = 0) -> dict:
+    """
+    Build synthetic entries
+    :param size: number of entries
+    :param offset: number of the first entry, so that different calls build different websites
+    :return: dictionary {website: {"email": ..., "password": ...}}
+    """
+    return {f"Website{i:08d}": {"email": f"user{i % 10}@example.com", "password": f"p@ss-{i:08d}-word"}
+            for i in range(offset, offset + size)}
+
+
+def summarise(samples: list) -> dict:
+    """
+    Compute the latency statistics of an operation
+    :param samples: durations in seconds
+    :return: dictionary with the mean, p50 and p99 in milliseconds and the number of samples
+    """
+    ordered = sorted(samples)
+    return {
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p99_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000,
+        "samples": len(ordered),
+    }
+
+
+def timed(function, repeat: int) -> list:
+    """
+    Time a function several times
+    :param function: function without arguments
+    :param repeat: number of runs
+    :return: list of durations in seconds
+    """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def peak_rss_mb() -> float:
+    """
+    Get the peak resident set size of this process
+    :return: peak RSS in MB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+
+def run_size(size: int) -> dict:
+    """
+    Run all the operations on a synthetic vault, in the current process
+    :param size: number of entries of the vault
+    :return: dictionary {operation: statistics} with the peak RSS
+    """
+    from generator import generate_passwords
+    from chunked_store import ChunkedVaultFile
+    from vault import COMPACTION_BYTES, Vault
+
+    generator = random.Random(size)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        vault = Vault(directory)
+        vault.create_key(KEY)
+        vault.open(KEY)
+        vault.add_many(make_entries(size))
+        vault.compact()
+        websites = vault.websites()
+
+        def load():
+            fresh = Vault(directory)
+            fresh.open(KEY)
+            fresh.websites()
+
+        results["load"] = summarise(timed(load, 3))
+
+        cold = Vault(directory)
+        cold.open(KEY)
+        cold.get(generator.choice(websites))
+        results["cold_lookup"] = summarise(timed(lambda: cold.get(generator.choice(websites)), 1000))
+
+        journal = Vault(directory)
+        journal.open(KEY)
+        journal.add_many(make_entries(1, size))
+        record_size = journal.cache.store.size()
+        journal.add_many(make_entries(COMPACTION_BYTES // record_size - 2, size + 1))
+        journal.close()
+
+        def cold_journal():
+            fresh = Vault(directory)
+            fresh.open(KEY)
+            start = time.perf_counter()
+            fresh.get(generator.choice(websites))
+            duration = time.perf_counter() - start
+            fresh.close()
+            return duration
+
+        results["cold_journal"] = summarise([cold_journal() for _ in range(20)])
+
+        vault = Vault(directory)
+        vault.open(KEY)
+        vault.websites()
+        results["lookup"] = summarise(timed(lambda: vault.get(generator.choice(websites)), 1000))
+        vault.matching_accounts(websites[0])
+        results["domain_lookup"] = summarise(timed(lambda: vault.matching_accounts(generator.choice(websites)), 1000))
+
+        counter = iter(range(size, size + 10 ** 9))
+        results["add"] = summarise(timed(lambda: vault.add(f"Added{next(counter)}", "user@example.com", "secret"), 200))
+
+        batches = iter(range(10))
+        results["bulk_add"] = summarise(timed(
+            lambda: vault.add_many(make_entries(BULK_SIZE, 2 * size + next(batches) * BULK_SIZE)), 5))
+
+        deleted = iter(generator.sample(websites, 200))
+
+        def delete():
+            website = next(deleted)
+            # make_entries gives Website{i} the email user{i % 10}
+            vault.delete(website, f"user{int(website[len('Website'):]) % 10}@example.com")
+
+        results["delete"] = summarise(timed(delete, 200))
+
+        data = vault.cache.get()
+
+        def save():
+            ChunkedVaultFile(os.path.join(directory, "copy.pmv"), vault.cipher).write(data)
+
+        results["save"] = summarise(timed(save, 3))
+        results["generate"] = summarise(timed(lambda: generate_passwords(1), 10000))
+        results["generate_batch"] = summarise(timed(lambda: generate_passwords(BULK_SIZE), 20))
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Find the operations slower than the baseline by more than the threshold
+    :param results: results of this run
+    :param baseline: results of the baseline run
+    :param threshold: allowed relative slowdown, for example 0.25 for 25 %
+    :return: list of messages describing the regressions
+    """
+    regressions = []
+    for size, operations in results["sizes"].items():
+        base_operations = baseline.get("sizes", {}).get(size)
+        if base_operations is None:
+            continue
+        for operation, statistics in operations.items():
+            if operation not in base_operations:
+                continue
+            if operation == "peak_rss_mb":
+                new, old, unit = statistics, base_operations[operation], "MB"
+            else:
+                new, old, unit = statistics["p50_ms"], base_operations[operation]["p50_ms"], "ms"
+            if old > 0 and new > old * (1 + threshold):
+                regressions.append(f"{size} entries, {operation}: {old:.3f} {unit} -> {new:.3f} {unit} "
+                                   f"(+{(new / old - 1) * 100:.0f} %)")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--output", help="file the results are written to as JSON")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative slowdown (default 0.25)")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        json.dump(run_size(args.worker), sys.stdout)
+        return 0
+
+    results = {
+        "meta": {"python": platform.python_version(), "platform": platform.platform(), "time": time.time()},
+        "sizes": {},
+    }
+    for size in args.sizes:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", str(size)],
+                                check=True, capture_output=True, text=True, cwd=ROOT).stdout
+        operations = json.loads(output)
+        results["sizes"][str(size)] = operations
+        print(f"{size} entries, peak RSS {operations['peak_rss_mb']:.1f} MB")
+        for operation, statistics in operations.items():
+            if operation != "peak_rss_mb":
+                print(f"    {operation:<14} mean {statistics['mean_ms']:10.3f} ms   p50 {statistics['p50_ms']:10.3f} ms"
+                      f"   p99 {statistics['p99_ms']:10.3f} ms")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        if regressions:
+            print("Regressions against the baseline:", file=sys.stderr)
+            for regression in regressions:
+                print(f"    {regression}", file=sys.stderr)
+            return 1
+        print("No regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""
+This module contains the chunked vault file, a snapshot of the vault in which a lookup decrypts only one chunk.
+
+The entries are spread over buckets by a keyed hash (HMAC-SHA256) of the website name, so all the accounts of a website
+are in the same bucket, and every bucket is encrypted on its own. The file is opened with mmap, so a lookup reads the
+small encrypted header once per session, one slot of the offset table and the chunk of its bucket. With about
+CHUNK_ENTRIES entries per bucket the cost of a lookup does not grow with the size of the vault.
+
+File layout:
+
+    MAGIC (4 bytes), version (1 byte), 3 reserved bytes
+    length of the header (4 bytes), header: Fernet token with the HMAC key and the number of buckets
+    offset table: offset (8 bytes) and length (4 bytes) of the chunk of every bucket
+    chunks: Fernet tokens with the accounts of one bucket, serialized with the versioned codec
+
+Classes:
+
+ChunkedVaultFile:
+    This class writes the vault as a chunked file and answers lookups from it through mmap.
+Methods:
+
+ChunkedVaultFile.write():
+    This method writes all the entries to a new chunked file and renames it into place.
+ChunkedVaultFile.write_temp():
+    This method writes all the entries to a new chunked file under a temporary name.
+ChunkedVaultFile.install():
+    This method renames a file written by write_temp into place.
+ChunkedVaultFile.lookup():
+    This method finds the accounts of a website by decrypting only the header and one chunk.
+ChunkedVaultFile.load():
+    This method decrypts all the chunks and returns the vault as a dictionary.
+ChunkedVaultFile.close():
+    This method releases the memory map.
+
+Constants:
+
+MAGIC: Bytes starting every chunked file.
+CHUNK_ENTRIES: Number of entries aimed for in every chunk.
+"""
+
+import hashlib
+import hmac
+import mmap
+import os
+import struct
+
+from codec import encode_vault, decode_vault, encode_entries, decode_entries
+from metrics import measure
+from record_store import fsync_directory
+
+MAGIC = b"PMCV"
+VERSION = 1
+CHUNK_ENTRIES = 256
+PREAMBLE = struct.Struct(">4sB3xI")
+SLOT = struct.Struct(">QI")
+
+
+class ChunkedVaultFile:
+    """Class storing a snapshot of the vault as independently encrypted chunks
+
+    Attributes:
+        file_name (string)
+            name of the chunked file
+        cipher (Fernet or MultiFernet)
+            cipher used to encrypt and decrypt the header and the chunks
+    """
+
+    def __init__(self, file_name: str, cipher):
+        """
+        Constructor of the ChunkedVaultFile class
+        :param file_name: name of the chunked file
+        :param cipher: Fernet object used to encrypt and decrypt the header and the chunks
+        """
+        self.file_name = file_name
+        self.cipher = cipher
+        self._file = None
+        self._map = None
+        self._mapped_signature = None
+        self._hmac_key = None
+        self._buckets = 0
+        self._table_offset = 0
+
+    def exists(self) -> bool:
+        """
+        Check if the chunked file has been written
+        :return: True if the file exists
+        """
+        return os.path.exists(self.file_name)
+
+    def write(self, entries: dict, chunk_entries: int = CHUNK_ENTRIES) -> None:
+        """
+        Write all the entries to a new chunked file with a new HMAC key. The file is written under a temporary name
+        and renamed into place, so readers never see a half written file.
+        :param entries: dictionary {(website, email): Entry}
+        :param chunk_entries: number of entries aimed for in every chunk
+        """
+        self.install(self.write_temp(entries, chunk_entries))
+
+    def write_temp(self, entries: dict, chunk_entries: int = CHUNK_ENTRIES) -> str:
+        """
+        Write all the entries to a new chunked file with a new HMAC key, under a temporary name. The current file
+        can still be read while the new one is written.
+        :param entries: dictionary {(website, email): Entry}
+        :param chunk_entries: number of entries aimed for in every chunk
+        :return: name of the temporary file, to be passed to install
+        """
+        hmac_key = os.urandom(32)
+        buckets = max(1, -(-len(entries) // chunk_entries))
+        grouped = [{} for _ in range(buckets)]
+        for account, entry in entries.items():
+            grouped[_bucket(hmac_key, account[0], buckets)][account] = entry
+
+        header = self.cipher.encrypt(encode_vault({"hmac_key": hmac_key.hex(), "buckets": buckets}))
+        chunks = [self.cipher.encrypt(encode_entries(group)) if group else b"" for group in grouped]
+
+        table = bytearray()
+        offset = PREAMBLE.size + len(header) + SLOT.size * buckets
+        for chunk in chunks:
+            table += SLOT.pack(offset, len(chunk))
+            offset += len(chunk)
+
+        temp_file_name = f"{self.file_name}.tmp"
+        with measure("snapshot_write", offset), open(temp_file_name, "wb") as file:
+            file.write(PREAMBLE.pack(MAGIC, VERSION, len(header)))
+            file.write(header)
+            file.write(table)
+            for chunk in chunks:
+                file.write(chunk)
+            file.flush()
+            os.fsync(file.fileno())
+        return temp_file_name
+
+    def install(self, temp_file_name: str) -> None:
+        """
+        Rename a file written by write_temp into place and sync the directory, the next lookup maps the new file
+        :param temp_file_name: name of the temporary file
+        """
+        self.close()
+        os.replace(temp_file_name, self.file_name)
+        fsync_directory(self.file_name)
+
+    def lookup(self, website: str):
+        """
+        Find the accounts stored for a website, decrypting only the header (once) and the chunk of its bucket
+        :param website: website name as stored in the vault
+        :return: dictionary {(website, email): Entry}, empty if the website is not stored
+        :raises FileNotFoundError: if the chunked file does not exist
+        """
+        self._open()
+        bucket = _bucket(self._hmac_key, website, self._buckets)
+        offset, length = SLOT.unpack_from(self._map, self._table_offset + SLOT.size * bucket)
+        if not length:
+            return {}
+        return {account: entry for account, entry in self._chunk(offset, length).items() if account[0] == website}
+
+    def load(self) -> dict:
+        """
+        Decrypt all the chunks
+        :return: decrypted data as a dictionary {(website, email): Entry}
+        :raises FileNotFoundError: if the chunked file does not exist
+        """
+        self._open()
+        data = {}
+        for bucket in range(self._buckets):
+            offset, length = SLOT.unpack_from(self._map, self._table_offset + SLOT.size * bucket)
+            if length:
+                data.update(self._chunk(offset, length))
+        return data
+
+    def close(self) -> None:
+        """
+        Release the memory map and the file, they are opened again by the next lookup
+        """
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+        self._map = self._file = self._mapped_signature = None
+
+    def _open(self) -> None:
+        """
+        Map the file and decrypt its header, unless the mapped file is still the current one
+        :raises FileNotFoundError: if the chunked file does not exist
+        :raises ValueError: if the file is not a chunked vault file
+        """
+        stat = os.stat(self.file_name)
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature == self._mapped_signature:
+            return
+
+        self.close()
+        self._file = open(self.file_name, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_length = PREAMBLE.unpack_from(self._map, 0)
+        if magic != MAGIC or version > VERSION:
+            self.close()
+            raise ValueError(f"{self.file_name} is not a chunked vault file of a supported version")
+
+        header = decode_vault(self.cipher.decrypt(self._map[PREAMBLE.size:PREAMBLE.size + header_length]))
+        self._hmac_key = bytes.fromhex(header["hmac_key"])
+        self._buckets = header["buckets"]
+        self._table_offset = PREAMBLE.size + header_length
+        self._mapped_signature = signature
+
+    def _chunk(self, offset: int, length: int) -> dict:
+        """
+        Decrypt one chunk
+        :param offset: position of the chunk in the file
+        :param length: length of the chunk
+        :return: entries of the chunk as a dictionary {(website, email): Entry}
+        """
+        with measure("snapshot_read", length):
+            token = self._map[offset:offset + length]
+        with measure("decrypt", length):
+            plaintext = self.cipher.decrypt(token)
+        with measure("decode", len(plaintext)):
+            return decode_entries(plaintext)
+
+
+def _bucket(hmac_key: bytes, website: str, buckets: int) -> int:
+    """
+    Find the bucket of a website from the keyed hash of its name
+    :param hmac_key: key of the HMAC, stored in the encrypted header
+    :param website: website name as stored in the vault
+    :param buckets: number of buckets
+    :return: number of the bucket
+    """
+    digest = hmac.new(hmac_key, website.encode("utf-8"), hashlib.sha256).digest()
+    return int.from_bytes(digest[:8], "big") % buckets
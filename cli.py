@@ -0,0 +1,315 @@
+"""
+This module contains the command line interface of the password manager. It uses the headless vault engine only,
+so it starts without loading tkinter or any image.
+
+Usage:
+
+    python -m cli init [--target SECONDS]
+    python -m cli get WEBSITE [EMAIL]
+    python -m cli add WEBSITE EMAIL [PASSWORD]
+    python -m cli delete WEBSITE EMAIL
+    python -m cli list [--email EMAIL]
+    python -m cli audit [--breach-file FILE]
+    python -m cli import FILE [--format csv|json|jsonl] [--keep-existing]
+    python -m cli export FILE [--format csv|json|jsonl]
+    python -m cli generate [--count N] [--length L] [--no-symbols] [--exclude-ambiguous]
+    python -m cli calibrate [--target SECONDS] [--apply]
+
+The encryption key is read from the PASSWORD_MANAGER_KEY environment variable or asked for interactively, twice by
+init, which sets up the key of a new vault with a key derivation cost calibrated for the current machine. If an
+unlock agent is running for the vault directory (see the agent module), get, add, delete, list and audit are sent to
+it instead and no key is needed, while import, export and calibrate --apply, which work on the files of the vault,
+are refused until the agent is stopped.
+audit looks for passwords used by several accounts and, with a breach list (a local copy of the Have I Been Pwned
+SHA-1 list "ordered by hash", also read from the PASSWORD_MANAGER_BREACH_FILE environment variable), for breached
+passwords. The passwords themselves are never printed.
+With --stats the timings of the instrumented stages are printed to the standard error at the end, with --trace FILE
+every measurement is also appended to FILE as JSON lines.
+
+Functions:
+
+main():
+    This function parses the command line arguments and runs the selected subcommand.
+run():
+    This function runs the selected subcommand.
+print_stats():
+    This function prints the timings of the instrumented stages.
+read_key():
+    This function reads the encryption key from the environment or asks for it, twice for a new key.
+"""
+
+import argparse
+import getpass
+import os
+import sys
+import time
+
+import metrics
+from agent import AgentClient, connect
+from audit import BREACH_FILE_VARIABLE, report_lines, report_summary
+from generator import PasswordPolicy, generate_passwords
+from key_manager import calibrate
+from transfer import import_file, export_file
+from vault import Vault
+
+KEY_VARIABLE = "PASSWORD_MANAGER_KEY"
+AGENT_COMMANDS = ("get", "add", "delete", "list", "audit")
+
+
+def main(argv=None) -> int:
+    """
+    Parse the command line arguments and run the selected subcommand
+    :param argv: list of arguments, sys.argv is used if None
+    :return: exit status
+    """
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Headless password manager")
+    parser.add_argument("--directory", default=".", help="directory holding the key file and the data files")
+    parser.add_argument("--stats", action="store_true", help="print the timings of the vault operations at the end")
+    parser.add_argument("--trace", help="append every timing to this file as JSON lines")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    init_parser = subparsers.add_parser("init", help="set up the encryption key of a new vault")
+    init_parser.add_argument("--target", type=float, default=0.5,
+                             help="unlock time in seconds of the key derivation (default 0.5)")
+
+    get_parser = subparsers.add_parser("get", help="show the accounts stored for a website")
+    get_parser.add_argument("website")
+    get_parser.add_argument("email", nargs="?", help="show only the account with this email or username")
+
+    add_parser = subparsers.add_parser("add", help="save the details of an account of a website")
+    add_parser.add_argument("website")
+    add_parser.add_argument("email")
+    add_parser.add_argument("password", nargs="?", help="asked for interactively if omitted")
+
+    delete_parser = subparsers.add_parser("delete", help="delete an account of a website")
+    delete_parser.add_argument("website")
+    delete_parser.add_argument("email")
+
+    list_parser = subparsers.add_parser("list", help="list the stored websites")
+    list_parser.add_argument("--email", help="list only the websites with an account using this email or username")
+
+    audit_parser = subparsers.add_parser("audit", help="find reused and breached passwords, offline")
+    audit_parser.add_argument("--breach-file", default=os.environ.get(BREACH_FILE_VARIABLE),
+                              help="Have I Been Pwned SHA-1 list ordered by hash "
+                                   "(default $PASSWORD_MANAGER_BREACH_FILE)")
+
+    import_parser = subparsers.add_parser("import", help="add the entries of a browser CSV, JSON or JSON Lines export")
+    import_parser.add_argument("file")
+    import_parser.add_argument("--format", choices=("csv", "json", "jsonl"),
+                               help="guessed from the extension if omitted")
+    import_parser.add_argument("--keep-existing", action="store_true",
+                               help="keep the stored details when an imported entry conflicts with them")
+
+    export_parser = subparsers.add_parser("export", help="write all the entries to a CSV, JSON or JSON Lines file")
+    export_parser.add_argument("file", help="'-' for the standard output")
+    export_parser.add_argument("--format", choices=("csv", "json", "jsonl"),
+                               help="guessed from the extension if omitted")
+
+    generate_parser = subparsers.add_parser("generate", help="generate random passwords, no key needed")
+    generate_parser.add_argument("--count", type=int, default=1)
+    generate_parser.add_argument("--length", type=int, default=16)
+    generate_parser.add_argument("--min-digits", type=int, default=2)
+    generate_parser.add_argument("--min-symbols", type=int, default=2)
+    generate_parser.add_argument("--no-symbols", action="store_true")
+    generate_parser.add_argument("--exclude-ambiguous", action="store_true",
+                                 help="leave out characters like l, 1, O, 0")
+
+    calibrate_parser = subparsers.add_parser("calibrate", help="pick the key derivation cost for a target unlock time")
+    calibrate_parser.add_argument("--target", type=float, default=0.5, help="unlock time in seconds (default 0.5)")
+    calibrate_parser.add_argument("--apply", action="store_true", help="re-encrypt the vault with the chosen cost")
+
+    args = parser.parse_args(argv)
+    if args.stats or args.trace:
+        metrics.enable(args.trace)
+        try:
+            return run(args)
+        finally:
+            if args.stats:
+                print_stats()
+    return run(args)
+
+
+def run(args) -> int:
+    """
+    Run the selected subcommand
+    :param args: parsed command line arguments
+    :return: exit status
+    """
+    if args.command == "generate":
+        try:
+            policy = PasswordPolicy(length=args.length, digits=args.min_digits,
+                                    symbols=None if args.no_symbols else args.min_symbols,
+                                    exclude_ambiguous=args.exclude_ambiguous)
+        except ValueError as error:
+            print(error, file=sys.stderr)
+            return 1
+        start = time.perf_counter()
+        passwords = generate_passwords(args.count, policy)
+        elapsed = time.perf_counter() - start
+        sys.stdout.write("\n".join(passwords) + "\n")
+        print(f"Generated {args.count} passwords in {elapsed:.3f} s ({args.count / elapsed:.0f} passwords/s)",
+              file=sys.stderr)
+        return 0
+
+    if args.command == "init":
+        vault = Vault(args.directory)
+        if vault.has_key():
+            print("An encryption key has already been set up for this vault.", file=sys.stderr)
+            return 1
+        try:
+            key = read_key(confirm=True)
+        except ValueError as error:
+            print(error, file=sys.stderr)
+            return 1
+        if not key:
+            print("Please enter an encryption key.", file=sys.stderr)
+            return 1
+        parameters, seconds = calibrate(args.target)
+        os.makedirs(args.directory, exist_ok=True)
+        vault.create_key(key, parameters)
+        print(f"The encryption key has been set up, unlock takes {seconds:.3f} s", file=sys.stderr)
+        return 0
+
+    if args.command == "add":
+        # Checked before the key is asked for, the vault refuses them too
+        if not args.website or not args.email or args.password == "":
+            print("The website, the email and the password cannot be empty.", file=sys.stderr)
+            return 1
+
+    if args.command == "calibrate":
+        parameters, seconds = calibrate(args.target)
+        print(f"scrypt n={parameters['n']} r={parameters['r']} p={parameters['p']}: unlock takes {seconds:.3f} s")
+        if not args.apply:
+            return 0
+
+    # A running agent answers without asking for the key or decrypting the vault again
+    vault = connect(args.directory)
+    if vault is not None and args.command not in AGENT_COMMANDS:
+        # The agent keeps its own cache and cipher, changing the files under it would leave them stale
+        vault.close()
+        print(f"An unlock agent is running for this vault, stop it first with python -m agent stop "
+              f"before running {args.command}.", file=sys.stderr)
+        return 1
+    if vault is None:
+        vault = Vault(args.directory)
+        if not vault.has_key():
+            print("No encryption key has been set up yet, please run python -m cli init first.", file=sys.stderr)
+            return 1
+        key = read_key()
+        if not vault.check_key(key):
+            print("The encryption key entered is incorrect.", file=sys.stderr)
+            return 1
+        vault.open(key)
+
+    try:
+        if args.command == "get":
+            try:
+                accounts = vault.accounts(args.website)
+            except FileNotFoundError:
+                accounts = []
+            if args.email is not None:
+                accounts = [entry for entry in accounts if entry["email"].lower() == args.email.lower()]
+            if not accounts:
+                print(f"There are no details for {args.website} yet", file=sys.stderr)
+                return 1
+            print("\n\n".join(f"Username: {entry['email']}\nPassword: {entry['password']}" for entry in accounts))
+
+        elif args.command == "add":
+            password = args.password or getpass.getpass("Password: ")
+            if not password:
+                print("The password cannot be empty.", file=sys.stderr)
+                return 1
+            vault.add(args.website, args.email, password)
+
+        elif args.command == "delete":
+            try:
+                deleted = vault.delete(args.website, args.email)
+            except FileNotFoundError:
+                deleted = False
+            if not deleted:
+                print(f"There is no account {args.email} for {args.website}", file=sys.stderr)
+                return 1
+
+        elif args.command == "list":
+            if args.email is not None:
+                try:
+                    accounts = vault.accounts_for_email(args.email)
+                except FileNotFoundError:
+                    accounts = []
+                for website, _ in accounts:
+                    print(website)
+            else:
+                for website in vault.websites():
+                    print(website)
+
+        elif args.command == "audit":
+            try:
+                report = vault.audit(args.breach_file)
+            except FileNotFoundError:
+                print(f"The breach list {args.breach_file} does not exist", file=sys.stderr)
+                return 1
+            for line in report_lines(report):
+                print(line)
+            print(report_summary(report, args.breach_file), file=sys.stderr)
+
+        elif args.command == "import":
+            report = import_file(vault, args.file, args.format, overwrite=not args.keep_existing)
+            print(f"Imported {report['imported']} of {report['rows']} rows in {report['seconds']:.2f} s "
+                  f"({report['rows_per_second']:.0f} rows/s): {report['duplicates']} duplicates, "
+                  f"{report['conflicts']} conflicts, {report['skipped']} skipped", file=sys.stderr)
+
+        elif args.command == "calibrate":
+            vault.change_key_parameters(key, parameters)
+            print("The vault has been re-encrypted with the new key derivation cost", file=sys.stderr)
+
+        elif args.command == "export":
+            count = export_file(vault, args.file, args.format)
+            print(f"Exported {count} entries", file=sys.stderr)
+    except (ConnectionError, RuntimeError) as error:
+        if not isinstance(vault, AgentClient):
+            raise
+        if isinstance(error, ConnectionError):
+            print("The unlock agent closed the connection, it may have locked itself. Please run the command again.",
+                  file=sys.stderr)
+        else:
+            print(f"The unlock agent failed: {error}", file=sys.stderr)
+        return 1
+    finally:
+        # Damage found in the journal is reported whatever the outcome of the command
+        try:
+            warnings = vault.warnings()
+        except (ConnectionError, RuntimeError):
+            warnings = []
+        for warning in warnings:
+            print(f"Warning: {warning}", file=sys.stderr)
+        # Sync the records still waiting for fsync and let a running compaction finish
+        vault.close()
+
+    return 0
+
+
+def print_stats() -> None:
+    """
+    Print the timings of the instrumented stages to the standard error
+    """
+    for line in metrics.table_lines():
+        print(line, file=sys.stderr)
+
+
+def read_key(confirm: bool = False) -> bytes:
+    """
+    Read the encryption key from the environment or ask for it interactively
+    :param confirm: ask for the key a second time when it is typed, for a new key
+    :return: encryption key as bytes
+    :raises ValueError: if the two keys typed do not match
+    """
+    key = os.environ.get(KEY_VARIABLE)
+    if key is None:
+        key = getpass.getpass("Encryption key: ")
+        if confirm and getpass.getpass("Please re-confirm key: ") != key:
+            raise ValueError("The two encryption keys entered do not match.")
+    return key.encode("utf-8")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""
+This module contains the serializer turning the vault into bytes before it is encrypted and back after decryption.
+
+The data is written as compact UTF-8 JSON behind a short versioned header, without the extra base64 layer of the
+first version (Fernet tokens are already base64 encoded). Data written by the first version, a base64 encoded
+str(dict), can still be read.
+
+Since version 3 the vault holds one entry per account, keyed by (website, email): a chunk is a list of
+[website, email, password] records and a record of the log with a null password deletes its account. Payloads of
+version 2 and older, keyed by website only, are read as one account per website.
+
+Functions:
+
+encode_vault():
+    This function serializes the whole vault dictionary.
+decode_vault():
+    This function deserializes the whole vault dictionary, in the current or in the legacy format.
+encode_entries():
+    This function serializes the accounts of a chunk as a list of records.
+decode_entries():
+    This function deserializes a chunk or a vault payload straight into compact Entry objects keyed by account.
+encode_entry():
+    This function serializes a single entry of the record log, or the deletion of an account.
+decode_entry():
+    This function deserializes a single entry of the record log.
+
+Constants:
+
+MAGIC: Bytes starting every payload written in the versioned format.
+FORMAT_VERSION: Version of the format written by this module.
+ACCOUNTS_VERSION: First version keying the entries by account instead of by website.
+"""
+
+import ast
+import base64
+import json
+
+from entry import Entry
+
+MAGIC = b"PMV"
+FORMAT_VERSION = 3
+ACCOUNTS_VERSION = 3
+HEADER = MAGIC + bytes([FORMAT_VERSION])
+_DECODER = json.JSONDecoder()
+
+
+def encode_vault(data: dict) -> bytes:
+    """
+    Serialize the vault into the versioned format
+    :param data: dictionary {website: {"email": ..., "password": ...}}, the details can be Entry objects
+    :return: bytes ready to be encrypted
+    """
+    return HEADER + json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=_to_json).encode("utf-8")
+
+
+def decode_vault(payload: bytes) -> dict:
+    """
+    Deserialize the vault written in the versioned or in the legacy format
+    :param payload: decrypted bytes
+    :return: dictionary {website: {"email": ..., "password": ...}}
+    :raises ValueError: if the payload was written by a newer, unknown version
+    """
+    if payload.startswith(MAGIC):
+        _check_version(payload)
+        # Decoding the text and parsing it from after the header avoids a copy of the payload without its header
+        return _DECODER.raw_decode(payload.decode("utf-8"), len(HEADER))[0]
+
+    # Legacy format: base64 encoded str(dict). It is read as a Python literal so that quotes in passwords survive.
+    return ast.literal_eval(base64.b64decode(payload).decode("utf-8"))
+
+
+def encode_entries(entries: dict) -> bytes:
+    """
+    Serialize accounts as a list of [website, email, password] records
+    :param entries: dictionary {(website, email): Entry}
+    :return: bytes ready to be encrypted
+    """
+    records = [[website, email, entry.password] for (website, email), entry in entries.items()]
+    return HEADER + json.dumps(records, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def decode_entries(payload: bytes) -> dict:
+    """
+    Deserialize a chunk written by encode_entries, or a vault payload of an older version keyed by website, into
+    Entry objects. Callers decode the vault one chunk at a time, so the intermediate lists only ever exist for a
+    single chunk.
+    :param payload: decrypted bytes
+    :return: dictionary {(website, email): Entry}
+    :raises ValueError: if the payload was written by a newer, unknown version
+    """
+    data = decode_vault(payload)
+    if isinstance(data, dict):
+        return {(website, details["email"]): Entry(details["email"], details["password"])
+                for website, details in data.items()}
+    entries = {}
+    for website, email, password in data:
+        entry = Entry(email, password)
+        entries[(website, entry.email)] = entry
+    return entries
+
+
+def encode_entry(website: str, email: str, entry) -> bytes:
+    """
+    Serialize a single entry of the record log
+    :param website: website name of the account
+    :param email: email or username of the account
+    :param entry: Entry or dictionary with "email" and "password", or None to delete the account
+    :return: bytes ready to be encrypted
+    """
+    record = [website, email, entry["password"] if entry is not None else None]
+    return HEADER + json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def decode_entry(payload: bytes) -> tuple:
+    """
+    Deserialize a single entry of the record log
+    :param payload: decrypted bytes
+    :return: tuple ((website, email), Entry), with None instead of the Entry if the account was deleted. Records
+             written before version 3 replace every account of their website and are returned as
+             tuple (website, Entry).
+    :raises ValueError: if the payload was written by a newer, unknown version
+    """
+    if payload.startswith(MAGIC):
+        _check_version(payload)
+        website, email, password = _DECODER.raw_decode(payload.decode("utf-8"), len(HEADER))[0]
+        if payload[len(MAGIC)] >= ACCOUNTS_VERSION:
+            if password is None:
+                return (website, email), None
+            entry = Entry(email, password)
+            return (website, entry.email), entry
+    else:
+        # Records written before the versioned format are plain JSON objects
+        record = json.loads(payload)
+        website, email, password = record["website"], record["email"], record["password"]
+    return website, Entry(email, password)
+
+
+def _to_json(value):
+    """
+    Turn the objects json does not know into plain data
+    :param value: object to serialize
+    :return: dictionary for an Entry
+    :raises TypeError: for any other object
+    """
+    if isinstance(value, Entry):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _check_version(payload: bytes) -> None:
+    """
+    Make sure the payload was not written by a newer version of the program
+    :param payload: decrypted bytes starting with MAGIC
+    :raises ValueError: if the version is not known
+    """
+    version = payload[len(MAGIC)]
+    if version > FORMAT_VERSION:
+        raise ValueError(f"Data format version {version} is newer than the supported version {FORMAT_VERSION}")
@@ -0,0 +1,80 @@
+"""
+This module contains the in-memory representation of the entries of the vault.
+
+A nested dictionary {"email": ..., "password": ...} per entry costs about four times the memory of an object with
+two slots, which matters for vaults of millions of entries. Most entries share a handful of emails, so the emails
+are interned and every entry with the same email points to the same string.
+
+Classes:
+
+Entry:
+    This class holds the email and password of one website.
+Methods:
+
+Entry.from_dict():
+    This method builds an entry from a dictionary with "email" and "password", or returns an entry unchanged.
+Entry.to_dict():
+    This method returns the entry as a dictionary, for JSON and other plain data formats.
+"""
+
+from sys import intern
+
+
+class Entry:
+    """Class holding the email and password stored for one website
+
+    The fields can also be read as entry["email"] and entry["password"], like the
+    dictionaries used by older versions, so code written for those keeps working.
+
+    Attributes:
+        email (string)
+            email or username, interned
+        password (string)
+            password
+    """
+
+    __slots__ = ("email", "password")
+
+    def __init__(self, email: str, password: str):
+        """
+        Constructor of the Entry class
+        :param email: email or username
+        :param password: password
+        """
+        self.email = intern(email)
+        self.password = password
+
+    @classmethod
+    def from_dict(cls, details):
+        """
+        Build an entry from a dictionary, entries are returned unchanged
+        :param details: dictionary with "email" and "password", or an Entry
+        :return: Entry
+        """
+        if isinstance(details, cls):
+            return details
+        return cls(details["email"], details["password"])
+
+    def to_dict(self) -> dict:
+        """
+        Get the entry as a dictionary
+        :return: dictionary with "email" and "password"
+        """
+        return {"email": self.email, "password": self.password}
+
+    def __getitem__(self, key: str) -> str:
+        if key == "email":
+            return self.email
+        if key == "password":
+            return self.password
+        raise KeyError(key)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Entry):
+            return self.email == other.email and self.password == other.password
+        if isinstance(other, dict):
+            return other == self.to_dict()
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"Entry(email={self.email!r}, password='***')"
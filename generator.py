@@ -0,0 +1,178 @@
+"""
+This module contains the password generator of the password manager.
+
+Passwords are drawn from the operating system CSPRNG through the secrets module. Random bytes are requested in
+batches and mapped onto the precomputed alphabets with bytes.translate, rejecting the bytes that would make some
+characters more likely than others, so generating thousands of passwords at once stays cheap.
+
+Classes:
+
+PasswordPolicy:
+    This class describes the length and the character classes of the generated passwords.
+Functions:
+
+generate_passwords():
+    This function generates a batch of passwords following a policy.
+
+Constants:
+
+LOWERCASE: Lowercase letters.
+UPPERCASE: Uppercase letters.
+DIGITS: Digits.
+SYMBOLS: Symbols used by default.
+AMBIGUOUS: Characters easily confused with each other, left out if the policy asks for it.
+DEFAULT_POLICY: Policy used by the GUI, 16 characters with at least 2 digits and 2 symbols.
+"""
+
+import secrets
+from functools import lru_cache
+
+LOWERCASE = "abcdefghijklmnopqrstuvwxyz"
+UPPERCASE = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+DIGITS = "0123456789"
+SYMBOLS = "!#$%&()*+"
+AMBIGUOUS = "Il1O0o"
+
+
+class PasswordPolicy:
+    """Class describing the passwords to generate
+
+    Attributes:
+        length (int)
+            number of characters of every password
+        classes (list)
+            tuples (alphabet, minimum count) of the character classes in use
+        alphabet (string)
+            all the characters allowed in the password
+    """
+
+    def __init__(self, length: int = 16, lowercase: int = 1, uppercase: int = 1, digits: int = 2, symbols: int = 2,
+                 symbol_set: str = SYMBOLS, exclude_ambiguous: bool = False):
+        """
+        Constructor of the PasswordPolicy class. Every character class takes the minimum number of its characters
+        in a password, None leaves the class out completely.
+        :param length: number of characters of every password
+        :param lowercase: minimum number of lowercase letters, or None
+        :param uppercase: minimum number of uppercase letters, or None
+        :param digits: minimum number of digits, or None
+        :param symbols: minimum number of symbols, or None
+        :param symbol_set: symbols that can be used
+        :param exclude_ambiguous: if True, characters like "l", "1", "O" and "0" are never used
+        :raises ValueError: if the policy cannot be satisfied
+        """
+        self.length = length
+        self.classes = []
+        for alphabet, minimum in ((LOWERCASE, lowercase), (UPPERCASE, uppercase), (DIGITS, digits),
+                                  (symbol_set, symbols)):
+            if minimum is None:
+                continue
+            if exclude_ambiguous:
+                alphabet = "".join(character for character in alphabet if character not in AMBIGUOUS)
+            if not alphabet or not alphabet.isascii() or len(alphabet) > 256:
+                raise ValueError(f"Invalid alphabet for a character class: {alphabet!r}")
+            self.classes.append((alphabet, minimum))
+
+        self.alphabet = "".join(dict.fromkeys("".join(alphabet for alphabet, _ in self.classes)))
+        if not self.alphabet:
+            raise ValueError("The policy does not allow any character")
+        if sum(minimum for _, minimum in self.classes) > length:
+            raise ValueError("The minimum counts of the character classes are longer than the password")
+        if length > 256:
+            raise ValueError("Passwords longer than 256 characters are not supported")
+
+
+DEFAULT_POLICY = PasswordPolicy()
+
+
+def generate_passwords(count: int, policy: PasswordPolicy = DEFAULT_POLICY) -> list:
+    """
+    Generate a batch of passwords
+    :param count: number of passwords
+    :param policy: policy the passwords follow
+    :return: list of passwords
+    """
+    # Draw the characters of all the passwords at once, class by class, and cut them into one part per password
+    parts = []
+    for alphabet, minimum in policy.classes:
+        if minimum:
+            parts.append(_slices(_draw(alphabet, minimum * count), minimum))
+    rest = policy.length - sum(minimum for _, minimum in policy.classes)
+    if rest:
+        parts.append(_slices(_draw(policy.alphabet, rest * count), rest))
+
+    # Every password is shuffled so that the required characters are not always at the start
+    positions = _draw_positions(policy.length, count)
+    passwords = []
+    for number, characters in enumerate(zip(*parts)):
+        password = list("".join(characters))
+        for i, j in zip(range(policy.length - 1, 0, -1), positions[number]):
+            password[i], password[j] = password[j], password[i]
+        passwords.append("".join(password))
+    return passwords
+
+
+def _draw(alphabet: str, count: int) -> str:
+    """
+    Draw uniformly distributed characters of an alphabet from the CSPRNG
+    :param alphabet: ASCII characters to choose from, at most 256
+    :param count: number of characters
+    :return: string of random characters
+    """
+    table, rejected = _translation(alphabet)
+    limit = 256 - len(rejected)
+    characters = b""
+    while len(characters) < count:
+        needed = count - len(characters)
+        raw = secrets.token_bytes(needed + needed * (256 - limit) // limit + 16)
+        characters += raw.translate(table, rejected)
+    return characters[:count].decode("ascii")
+
+
+@lru_cache(maxsize=None)
+def _translation(alphabet: str) -> tuple:
+    """
+    Precompute the tables mapping random bytes onto an alphabet
+    :param alphabet: ASCII characters to choose from, at most 256
+    :return: tuple (translation table for bytes.translate, bytes to reject)
+    """
+    size = len(alphabet)
+    # Bytes above the largest multiple of the alphabet size are rejected, the others are mapped with a modulo
+    limit = 256 - 256 % size
+    table = bytes(ord(alphabet[byte % size]) for byte in range(256))
+    return table, bytes(range(limit, 256))
+
+
+def _draw_positions(length: int, count: int) -> list:
+    """
+    Draw the swap positions of a Fisher-Yates shuffle for every password
+    :param length: length of the passwords
+    :param count: number of passwords
+    :return: list with one list of positions per password, the position for step i is in range(i + 1)
+    """
+    raw = secrets.token_bytes(max(length - 1, 0) * count * 2 + 64)
+    offset = 0
+    positions = []
+    for _ in range(count):
+        steps = []
+        for i in range(length - 1, 0, -1):
+            limit = 256 - 256 % (i + 1)
+            while True:
+                if offset == len(raw):
+                    raw, offset = secrets.token_bytes(len(raw)), 0
+                byte = raw[offset]
+                offset += 1
+                if byte < limit:
+                    steps.append(byte % (i + 1))
+                    break
+        positions.append(steps)
+    return positions
+
+
+def _slices(characters: str, size: int) -> list:
+    """
+    Cut a string into parts of the same size
+    :param characters: string to cut
+    :param size: size of every part
+    :return: list of parts
+    """
+    return [characters[i:i + size] for i in range(0, len(characters), size)]
@@ -0,0 +1,257 @@
+"""
+This module contains the key manager deriving the data encryption key from the user's passphrase.
+
+The passphrase, of any length, goes through scrypt with a random salt. The salt, the scrypt cost parameters and a
+check token encrypted with the derived key are stored in a small JSON header next to the data files, so the
+passphrase can be verified without bcrypt and the key is derived only once per session. The Fernet object built
+from the derived key is kept for the whole session, the passphrase itself is not: only an HMAC of it, keyed with a
+random key of the session, is kept to recognise it.
+
+When the key material changes (a vault created by an older version, which used the raw 32 byte passphrase as the
+key, or new cost parameters) the header also keeps the previous key material until all the data has been
+re-encrypted, so a crash in the middle of the re-encryption never makes the vault unreadable.
+
+Classes:
+
+KeyManager:
+    This class creates, reads and updates the key header and derives the session cipher.
+Methods:
+
+KeyManager.exists():
+    This method checks if the key header has been created.
+KeyManager.create():
+    This method creates the header for a passphrase and returns the session cipher.
+KeyManager.unlock():
+    This method derives the session cipher from a passphrase, or returns None if the passphrase is wrong.
+KeyManager.finish_migration():
+    This method forgets the previous key material once all the data is encrypted with the current one.
+KeyManager.parameters():
+    This method returns the key parameters the data is encrypted with.
+KeyManager.remember():
+    This method remembers that a passphrase was verified, without keeping the passphrase.
+KeyManager.remembers():
+    This method checks if a passphrase is the one last verified.
+Functions:
+
+derive_cipher():
+    This function derives a Fernet cipher from a passphrase and key parameters.
+calibrate():
+    This function picks the scrypt cost giving a target unlock time on the current machine.
+
+Constants:
+
+DEFAULT_PARAMETERS: scrypt cost parameters used when none are given.
+LEGACY_PARAMETERS: Key parameters of vaults created by older versions, using the raw passphrase as the key.
+CHECK_TEXT: Plaintext of the check token.
+MAX_SCRYPT_N: Largest scrypt cost picked by the calibration (1 GiB of memory with r=8).
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+
+from metrics import measure
+
+DEFAULT_PARAMETERS = {"kdf": "scrypt", "n": 2 ** 15, "r": 8, "p": 1}
+LEGACY_PARAMETERS = {"kdf": "raw"}
+CHECK_TEXT = b"password-manager-key-check"
+MAX_SCRYPT_N = 2 ** 20
+
+
+class KeyManager:
+    """Class deriving the session cipher from the passphrase and keeping the key header
+
+    Attributes:
+        file_name (string)
+            name of the JSON key header
+        cipher (Fernet or MultiFernet)
+            session cipher, set by create or unlock
+        migrating (bool)
+            True if some data may still be encrypted with the previous key material
+    """
+
+    def __init__(self, file_name: str):
+        """
+        Constructor of the KeyManager class
+        :param file_name: name of the JSON key header
+        """
+        self.file_name = file_name
+        self.cipher = None
+        self.migrating = False
+        self._current_cipher = None
+        self._session_key = os.urandom(32)
+        self._verified = None
+
+    def exists(self) -> bool:
+        """
+        Check if the key header has been created
+        :return: True if the header file exists
+        """
+        return os.path.exists(self.file_name)
+
+    def create(self, passphrase: bytes, parameters: dict = None, previous: dict = None):
+        """
+        Create the key header with a new random salt and return the session cipher
+        :param passphrase: passphrase entered by the user
+        :param parameters: scrypt cost parameters, DEFAULT_PARAMETERS if None
+        :param previous: key parameters the existing data is encrypted with, if it has to be re-encrypted
+        :return: session cipher
+        """
+        current = dict(parameters or DEFAULT_PARAMETERS)
+        current["salt"] = base64.b64encode(os.urandom(16)).decode("ascii")
+        cipher = derive_cipher(passphrase, current)
+        header = {"version": 1, "current": current, "check": cipher.encrypt(CHECK_TEXT).decode("ascii")}
+        previous_cipher = None
+        if previous is not None:
+            header["previous"] = previous
+            # Derived before the header is written, so a passphrase that does not fit the old key material leaves
+            # no header behind
+            previous_cipher = derive_cipher(passphrase, previous)
+        self._write(header)
+        return self._use(passphrase, header, cipher, previous_cipher)
+
+    def unlock(self, passphrase: bytes):
+        """
+        Derive the session cipher from the passphrase and the header. The cipher is cached, so calling this again
+        with the same passphrase does not run the key derivation again.
+        :param passphrase: passphrase entered by the user
+        :return: session cipher, or None if the passphrase is wrong
+        """
+        if self.cipher is not None and self.remembers(passphrase):
+            return self.cipher
+
+        from cryptography.fernet import InvalidToken
+
+        with open(self.file_name) as file:
+            header = json.load(file)
+        cipher = derive_cipher(passphrase, header["current"])
+        try:
+            cipher.decrypt(header["check"].encode("ascii"))
+        except InvalidToken:
+            return None
+        return self._use(passphrase, header, cipher)
+
+    def finish_migration(self) -> None:
+        """
+        Forget the previous key material once all the data is encrypted with the current one
+        """
+        with open(self.file_name) as file:
+            header = json.load(file)
+        header.pop("previous", None)
+        self._write(header)
+        self.cipher = self._current_cipher
+        self.migrating = False
+
+    def parameters(self) -> dict:
+        """
+        Get the key parameters the data is encrypted with
+        :return: dictionary with the KDF name, its cost parameters and the salt
+        """
+        with open(self.file_name) as file:
+            return json.load(file)["current"]
+
+    def remember(self, passphrase: bytes) -> None:
+        """
+        Remember that a passphrase was verified. Only an HMAC of it, keyed with a random key of the session, is kept.
+        :param passphrase: passphrase entered by the user, already verified
+        """
+        self._verified = self._digest(passphrase)
+
+    def remembers(self, passphrase: bytes) -> bool:
+        """
+        Check if a passphrase is the one last verified, without running the key derivation or bcrypt again
+        :param passphrase: passphrase entered by the user
+        :return: True if it is the passphrase given to remember, unlock or create last
+        """
+        return self._verified is not None and hmac.compare_digest(self._verified, self._digest(passphrase))
+
+    def _digest(self, passphrase: bytes) -> bytes:
+        """
+        Compute the keyed digest a verified passphrase is remembered by
+        :param passphrase: passphrase entered by the user
+        :return: HMAC-SHA256 of the passphrase with the session key
+        """
+        return hmac.new(self._session_key, passphrase, hashlib.sha256).digest()
+
+    def _use(self, passphrase: bytes, header: dict, cipher, previous_cipher=None):
+        """
+        Remember the session cipher, combined with the previous key material if the data is being migrated
+        :param passphrase: passphrase entered by the user
+        :param header: key header
+        :param cipher: cipher derived with the current parameters
+        :param previous_cipher: cipher derived with the previous parameters, derived here if None
+        :return: session cipher
+        """
+        from cryptography.fernet import MultiFernet
+
+        self._current_cipher = cipher
+        self.migrating = "previous" in header
+        if self.migrating:
+            # New data is encrypted with the current key, old data can still be decrypted with the previous one
+            if previous_cipher is None:
+                previous_cipher = derive_cipher(passphrase, header["previous"])
+            cipher = MultiFernet([cipher, previous_cipher])
+        self.cipher = cipher
+        self.remember(passphrase)
+        return cipher
+
+    def _write(self, header: dict) -> None:
+        """
+        Write the header to a temporary file and rename it into place, so it is never half written
+        :param header: key header
+        """
+        temp_file_name = f"{self.file_name}.tmp"
+        with open(temp_file_name, "w") as file:
+            json.dump(header, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_file_name, self.file_name)
+
+
+def derive_cipher(passphrase: bytes, parameters: dict):
+    """
+    Derive a Fernet cipher from a passphrase
+    :param passphrase: passphrase entered by the user
+    :param parameters: key parameters, scrypt cost and salt or LEGACY_PARAMETERS
+    :return: Fernet cipher
+    :raises ValueError: if the parameters cannot be used with the passphrase
+    """
+    from cryptography.fernet import Fernet
+
+    if parameters["kdf"] == "raw":
+        # Vaults created by older versions used the 32 byte passphrase itself as the key
+        if len(passphrase) != 32:
+            raise ValueError("The data was encrypted with a 32 byte key, please enter the original key")
+        return Fernet(base64.b64encode(passphrase))
+
+    from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+    with measure("kdf"):
+        key = Scrypt(salt=base64.b64decode(parameters["salt"]), length=32,
+                     n=parameters["n"], r=parameters["r"], p=parameters["p"]).derive(passphrase)
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+def calibrate(target_seconds: float = 0.5, r: int = 8, p: int = 1) -> tuple:
+    """
+    Pick the scrypt cost giving an unlock time close to the target on the current machine. The cost is doubled
+    for as long as the doubled cost gets closer to the target.
+    :param target_seconds: wanted unlock time in seconds
+    :param r: scrypt block size
+    :param p: scrypt parallelism
+    :return: tuple (key parameters with the chosen cost, measured unlock time in seconds)
+    """
+    from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+    n = 2 ** 12
+    while True:
+        start = time.perf_counter()
+        Scrypt(salt=os.urandom(16), length=32, n=n, r=r, p=p).derive(b"calibration")
+        seconds = time.perf_counter() - start
+        # The time grows linearly with n, so from 2/3 of the target on doubling n would overshoot by more than it gains
+        if seconds * 1.5 >= target_seconds or n >= MAX_SCRYPT_N:
+            return {"kdf": "scrypt", "n": n, "r": r, "p": p}, seconds
+        n *= 2
@@ -1,4 +1,65 @@
-from ui import ManagerInterface
+"""
+This module starts the password manager.
+
+Usage:
+
+    python main.py [--profile-startup]
+
+With --profile-startup the time spent importing every part of the program and building the first window is printed,
+and the program exits as soon as the first window is drawn.
+
+Functions:
+
+profile_startup():
+    This function starts the GUI once, measuring the imports and the construction of the first window.
+"""
+
+import sys
+import time
+
+START = time.perf_counter()
+
+# Imported in this order by profile_startup, so that every module is charged for the dependencies it brings first
+PROFILED_MODULES = ("tkinter", "metrics", "codec", "key_manager", "vault", "agent", "generator", "ui")
+# Modules that should not be imported before the login window is on screen
+LAZY_MODULES = ("cryptography", "bcrypt", "pyperclip", "concurrent.futures")
+
+
+def profile_startup() -> None:
+    """
+    Start the GUI once and print how long every import and every construction step took before the first window
+    was drawn
+    """
+    import importlib
+
+    steps = []
+    previous = START
+    for name in PROFILED_MODULES:
+        importlib.import_module(name)
+        now = time.perf_counter()
+        steps.append((f"import {name}", now - previous))
+        previous = now
+
+    from ui import ManagerInterface
+
+    marks = []
+    ManagerInterface(profile=marks)
+    for stage, now in marks:
+        steps.append((stage, now - previous))
+        previous = now
+
+    print(f"{'step':<28}{'ms':>10}")
+    for step, seconds in steps:
+        print(f"{step:<28}{seconds * 1000:>10.1f}")
+    print(f"{'total':<28}{(previous - START) * 1000:>10.1f}")
+    loaded = [name for name in LAZY_MODULES if name in sys.modules]
+    print(f"Modules loaded before the first window that should not be: {', '.join(loaded) or 'none'}")
+
 
 if __name__ == "__main__":
-    manager_interface = ManagerInterface()
+    if "--profile-startup" in sys.argv[1:]:
+        profile_startup()
+    else:
+        from ui import ManagerInterface
+
+        manager_interface = ManagerInterface()
@@ -0,0 +1,248 @@
+"""
+This module contains the instrumentation of the hot paths of the password manager.
+
+Every instrumented stage (key derivation, bcrypt check, file reads, Fernet decryption, JSON decoding, journal appends,
+fsync, snapshot writes, lookups...) is wrapped in measure(). When the metrics are disabled, which is the default,
+measure() returns a shared context manager doing nothing, so the cost is one function call. When they are enabled,
+the call count, the cumulative duration, the bytes processed and a bounded window of recent durations (for the
+p50 and p99) are kept for every stage, and every measurement can also be written to a JSON lines trace file.
+
+The metrics are enabled by setting the PASSWORD_MANAGER_METRICS environment variable to 1, or
+PASSWORD_MANAGER_TRACE to the name of a trace file, or by calling enable().
+
+Classes:
+
+Metrics:
+    This class collects the measurements of the instrumented stages.
+Methods:
+
+Metrics.enable():
+    This method starts collecting measurements, optionally writing them to a trace file.
+Metrics.disable():
+    This method stops collecting measurements and closes the trace file.
+Metrics.measure():
+    This method returns a context manager timing one run of a stage.
+Metrics.record():
+    This method adds one measurement of a stage.
+Metrics.snapshot():
+    This method returns the statistics of every stage.
+Metrics.reset():
+    This method forgets all the measurements.
+Functions:
+
+measure():
+    This function times one run of a stage with the shared metrics.
+enable():
+    This function enables the shared metrics.
+snapshot():
+    This function returns the statistics of the shared metrics.
+table_lines():
+    This function formats the statistics of the shared metrics as the lines of a table.
+
+Constants:
+
+WINDOW: Number of recent durations kept per stage for the percentiles.
+METRICS_VARIABLE: Environment variable enabling the metrics.
+TRACE_VARIABLE: Environment variable with the name of the trace file.
+METRICS: Metrics shared by the whole program.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+WINDOW = 4096
+METRICS_VARIABLE = "PASSWORD_MANAGER_METRICS"
+TRACE_VARIABLE = "PASSWORD_MANAGER_TRACE"
+
+
+class _NoMeasure:
+    """Context manager doing nothing, returned by measure() while the metrics are disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_MEASURE = _NoMeasure()
+
+
+class _Measure:
+    """Context manager timing one run of a stage
+
+    Attributes:
+        nbytes (int)
+            bytes processed by the run, can be set inside the with block when only known at the end
+    """
+
+    __slots__ = ("_metrics", "_stage", "_start", "nbytes")
+
+    def __init__(self, metrics, stage: str, nbytes: int):
+        self._metrics = metrics
+        self._stage = stage
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._metrics.record(self._stage, time.perf_counter() - self._start, self.nbytes)
+        return False
+
+
+class Metrics:
+    """Class collecting the measurements of the instrumented stages
+
+    Attributes:
+        enabled (bool)
+            True while measurements are collected
+        trace_file_name (string)
+            name of the JSON lines trace file, or None
+    """
+
+    def __init__(self):
+        """
+        Constructor of the Metrics class, the metrics start disabled
+        """
+        self.enabled = False
+        self.trace_file_name = None
+        self._stages = {}
+        self._trace = None
+        self._lock = threading.Lock()
+
+    def enable(self, trace_file_name: str = None) -> None:
+        """
+        Start collecting measurements
+        :param trace_file_name: name of a JSON lines file every measurement is appended to, or None
+        """
+        with self._lock:
+            if trace_file_name and trace_file_name != self.trace_file_name:
+                if self._trace is not None:
+                    self._trace.close()
+                self._trace = open(trace_file_name, "a", buffering=1)
+                self.trace_file_name = trace_file_name
+            self.enabled = True
+
+    def disable(self) -> None:
+        """
+        Stop collecting measurements and close the trace file, the statistics collected so far are kept
+        """
+        with self._lock:
+            self.enabled = False
+            if self._trace is not None:
+                self._trace.close()
+            self._trace = self.trace_file_name = None
+
+    def measure(self, stage: str, nbytes: int = 0):
+        """
+        Time one run of a stage, to be used in a with statement
+        :param stage: name of the stage
+        :param nbytes: bytes processed by the run, if known before it
+        :return: context manager
+        """
+        if not self.enabled:
+            return _NO_MEASURE
+        return _Measure(self, stage, nbytes)
+
+    def record(self, stage: str, seconds: float, nbytes: int = 0) -> None:
+        """
+        Add one measurement of a stage
+        :param stage: name of the stage
+        :param seconds: duration of the run
+        :param nbytes: bytes processed by the run
+        """
+        with self._lock:
+            statistics = self._stages.get(stage)
+            if statistics is None:
+                statistics = self._stages[stage] = {"count": 0, "seconds": 0.0, "bytes": 0,
+                                                    "recent": deque(maxlen=WINDOW)}
+            statistics["count"] += 1
+            statistics["seconds"] += seconds
+            statistics["bytes"] += nbytes
+            statistics["recent"].append(seconds)
+            if self._trace is not None:
+                self._trace.write(json.dumps({"time": time.time(), "stage": stage, "ms": seconds * 1000,
+                                              "bytes": nbytes, "thread": threading.current_thread().name}) + "\n")
+
+    def snapshot(self) -> dict:
+        """
+        Get the statistics of every stage
+        :return: dictionary {stage: {"count", "total_ms", "p50_ms", "p99_ms", "bytes"}}, p50 and p99 are computed
+                 over the last WINDOW runs
+        """
+        with self._lock:
+            stages = {stage: (statistics["count"], statistics["seconds"], statistics["bytes"],
+                              sorted(statistics["recent"]))
+                      for stage, statistics in self._stages.items()}
+
+        result = {}
+        for stage, (count, seconds, nbytes, recent) in sorted(stages.items()):
+            result[stage] = {
+                "count": count,
+                "total_ms": seconds * 1000,
+                "p50_ms": recent[len(recent) // 2] * 1000,
+                "p99_ms": recent[min(len(recent) - 1, int(len(recent) * 0.99))] * 1000,
+                "bytes": nbytes,
+            }
+        return result
+
+    def reset(self) -> None:
+        """
+        Forget all the measurements
+        """
+        with self._lock:
+            self._stages.clear()
+
+
+METRICS = Metrics()
+
+
+def measure(stage: str, nbytes: int = 0):
+    """
+    Time one run of a stage with the shared metrics, to be used in a with statement
+    :param stage: name of the stage
+    :param nbytes: bytes processed by the run, if known before it
+    :return: context manager
+    """
+    if not METRICS.enabled:
+        return _NO_MEASURE
+    return _Measure(METRICS, stage, nbytes)
+
+
+def enable(trace_file_name: str = None) -> None:
+    """
+    Enable the shared metrics
+    :param trace_file_name: name of a JSON lines file every measurement is appended to, or None
+    """
+    METRICS.enable(trace_file_name)
+
+
+def snapshot() -> dict:
+    """
+    Get the statistics of the shared metrics
+    :return: dictionary {stage: {"count", "total_ms", "p50_ms", "p99_ms", "bytes"}}
+    """
+    return METRICS.snapshot()
+
+
+def table_lines() -> list:
+    """
+    Format the statistics of the shared metrics as a table, one stage per line
+    :return: list with the header line and one line per stage
+    """
+    lines = [f"{'stage':<16}{'count':>8}{'total ms':>12}{'p50 ms':>10}{'p99 ms':>10}{'MB':>9}"]
+    for stage, statistics in snapshot().items():
+        lines.append(f"{stage:<16}{statistics['count']:>8}{statistics['total_ms']:>12.1f}"
+                     f"{statistics['p50_ms']:>10.3f}{statistics['p99_ms']:>10.3f}{statistics['bytes'] / 1e6:>9.2f}")
+    return lines
+
+
+if os.environ.get(TRACE_VARIABLE):
+    enable(os.environ[TRACE_VARIABLE])
+elif os.environ.get(METRICS_VARIABLE, "") not in ("", "0"):
+    enable()
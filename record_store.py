@@ -0,0 +1,430 @@
+"""
+This module contains the journal of the password manager, an append-only log in which every entry is encrypted on
+its own.
+
+Appends are written to the operating system at once, so they survive a crash of the program, and fsync is grouped:
+it runs when SYNC_RECORDS records are waiting or at most SYNC_INTERVAL seconds after the first waiting record, so
+a burst of adds does not pay for one fsync each. A record cut short by a crash is detected by its length prefix, and
+a tail that does not decrypt (after a power loss the end of the file is often zero-filled or garbage) is detected by
+its Fernet token; both are dropped when the journal is recovered. Files are swapped in with a rename followed by an
+fsync of their directory, so the swap survives a power loss too.
+
+Several processes can write the same journal (the GUI, the command line interface, the unlock agent). Appends, the
+recovery and the replacement of the log hold an exclusive flock on a lock file next to the log, so a recovery never
+cuts a write of another process in half and no append is lost while the log is being replaced. The lock file is
+used rather than the log itself because the log is replaced by renames. Systems without fcntl (Windows) only lock
+between the threads of one process.
+
+Classes:
+
+RecordStore:
+    This class stores the entries as an append-only log of individually encrypted records.
+Methods:
+
+RecordStore.load():
+    This method reads and decrypts all the records and returns the accounts they save or delete.
+RecordStore.read_from():
+    This method reads and decrypts the records from an offset on, to follow the records appended since a previous read.
+RecordStore.put():
+    This method encrypts a single entry, or the deletion of an account, and appends it to the end of the log.
+RecordStore.put_many():
+    This method encrypts many entries and appends them to the end of the log in a single write.
+RecordStore.sync():
+    This method forces the records waiting for fsync to disk.
+RecordStore.close():
+    This method syncs the waiting records and closes the log.
+RecordStore.recover():
+    This method scans the log after a start, drops a record cut short by a crash and measures the time it took.
+RecordStore.size():
+    This method returns the size of the log.
+RecordStore.drop_head():
+    This method removes the records before an offset, once they have been folded into a snapshot.
+RecordStore.rewrite():
+    This method replaces the whole log with the given entries, writing a new file and renaming it into place.
+RecordStore.migrate():
+    This method converts the old single-blob data file into the record log.
+Functions:
+
+fsync_directory():
+    This function syncs a directory, so that a file renamed into it survives a power loss.
+
+Constants:
+
+LENGTH_PREFIX: Struct used to write the length of every record in front of its ciphertext.
+SYNC_INTERVAL: Longest time in seconds a record waits for fsync.
+SYNC_RECORDS: Number of waiting records that triggers fsync at once.
+LOCK_SUFFIX: Suffix of the lock file shared by the processes writing the log.
+"""
+
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from codec import encode_entry, decode_entry
+from metrics import measure
+
+LENGTH_PREFIX = struct.Struct(">I")
+SYNC_INTERVAL = 0.05
+SYNC_RECORDS = 64
+LOCK_SUFFIX = ".lock"
+
+
+class RecordStore:
+    """Class storing the vault as an append-only log of individually encrypted records
+
+    Every record is the length of the ciphertext followed by a Fernet token containing one entry. Adding,
+    updating or deleting an account appends a single record, so the cost does not depend on the size of the
+    vault. Deleted accounts are written as tombstones, records without a password. When the log is read the last
+    record of every account wins.
+
+    The log stays open for appending between writes. It is opened again if the file was replaced, for example
+    by a compaction in another process. Writes hold a lock shared with the other processes, see _locked.
+
+    Attributes:
+        file_name (string)
+            name of the record log file
+        cipher (Fernet or MultiFernet)
+            cipher used to encrypt and decrypt the records
+        sync_interval (float)
+            longest time in seconds a record waits for fsync
+        sync_records (int)
+            number of waiting records that triggers fsync at once
+        syncs (int)
+            number of fsync calls made for appended records
+        invalid_records (int)
+            number of records that did not decrypt and were skipped by the last full read and the reads following
+            it
+    """
+
+    def __init__(self, file_name: str, cipher, sync_interval: float = SYNC_INTERVAL, sync_records: int = SYNC_RECORDS):
+        """
+        Constructor of the RecordStore class
+        :param file_name: name of the record log file
+        :param cipher: Fernet object used to encrypt and decrypt the records
+        :param sync_interval: longest time in seconds a record waits for fsync, 0 to sync every append
+        :param sync_records: number of waiting records that triggers fsync at once
+        """
+        self.file_name = file_name
+        self.cipher = cipher
+        self.sync_interval = sync_interval
+        self.sync_records = sync_records
+        self.syncs = 0
+        self.invalid_records = 0
+        self._file = None
+        self._pending = 0
+        self._timer = None
+        self._lock = threading.Lock()
+        self._lock_file = None
+
+    def load(self) -> dict:
+        """
+        Read and decrypt all the records of the log. A record that does not decrypt is skipped, so that one damaged
+        record does not make the whole vault unreadable.
+        :return: dictionary {(website, email): Entry, or None for a deleted account}, in the order the accounts were
+                 first written. Records of older versions replace every account of their website and are returned
+                 as {website: Entry}.
+        :raises FileNotFoundError: if the log does not exist yet
+        """
+        return self.read_from(0)[0]
+
+    def read_from(self, offset: int) -> tuple:
+        """
+        Read and decrypt the records of the log from an offset on. The records that do not decrypt are skipped and
+        counted in invalid_records.
+        :param offset: offset of a record, 0 or the offset returned by an earlier read of the same file
+        :return: tuple (records as returned by load, position), the position being a tuple (device and inode of the
+                 file, offset after the last complete record) from which the records appended since can be read
+        :raises FileNotFoundError: if the log does not exist yet
+        """
+        from cryptography.fernet import InvalidToken
+
+        data = {}
+        with measure("journal_read") as measurement, open(self.file_name, "rb") as file:
+            stat = os.fstat(file.fileno())
+            file.seek(offset)
+            content = file.read()
+            measurement.nbytes = len(content)
+
+        if not offset:
+            self.invalid_records = 0
+        complete = 0
+        for start, end in _records(content):
+            complete = end
+            try:
+                with measure("decrypt", end - start):
+                    plaintext = self.cipher.decrypt(content[start:end])
+            except InvalidToken:
+                self.invalid_records += 1
+                continue
+            with measure("decode", len(plaintext)):
+                key, entry = decode_entry(plaintext)
+            data[key] = entry
+        return data, (stat.st_dev, stat.st_ino, offset + complete)
+
+    def put(self, account: tuple, entry) -> None:
+        """
+        Encrypt a single entry and append it to the log
+        :param account: tuple (website, email) used as the key of the entry
+        :param entry: Entry or dictionary with "email" and "password", None to delete the account
+        """
+        self._append(self._encode(account, entry), 1)
+
+    def put_many(self, entries: dict) -> None:
+        """
+        Encrypt many entries and append them to the log in a single write
+        :param entries: dictionary {(website, email): Entry, or None to delete the account}
+        """
+        records = b"".join(self._encode(account, entry) for account, entry in entries.items())
+        self._append(records, len(entries))
+
+    def sync(self) -> None:
+        """
+        Force the records waiting for fsync to disk
+        """
+        with self._lock:
+            self._sync()
+
+    def close(self) -> None:
+        """
+        Sync the waiting records and close the log, it is opened again by the next append
+        """
+        with self._lock:
+            self._sync()
+            self._close()
+            if self._lock_file is not None:
+                os.close(self._lock_file)
+                self._lock_file = None
+
+    def recover(self) -> dict:
+        """
+        Scan the log after a start and cut off the records left incomplete or damaged by a crash, so that new records
+        are appended after the last good one. The records are walked by their length prefix, then the ones at the end
+        are decrypted from the last one backwards until one is valid, so an intact log costs a single decryption.
+        :return: dictionary with the number of good records, the number of dropped bytes and the time taken
+        """
+        from cryptography.fernet import InvalidToken
+
+        start_time = time.perf_counter()
+        # Another process may be appending, its write is either complete or not started while the lock is held
+        with self._locked():
+            try:
+                with open(self.file_name, "rb") as file:
+                    content = file.read()
+            except FileNotFoundError:
+                content = b""
+
+            records = list(_records(content))
+            while records:
+                start, end = records[-1]
+                try:
+                    self.cipher.decrypt(content[start:end])
+                except InvalidToken:
+                    records.pop()
+                else:
+                    break
+
+            valid_size = records[-1][1] if records else 0
+            if valid_size < len(content):
+                self._close()
+                os.truncate(self.file_name, valid_size)
+                with open(self.file_name, "rb+") as file:
+                    os.fsync(file.fileno())
+        return {"records": len(records), "dropped_bytes": len(content) - valid_size,
+                "seconds": time.perf_counter() - start_time}
+
+    def size(self) -> int:
+        """
+        Get the size of the log
+        :return: size in bytes, 0 if the log does not exist
+        """
+        try:
+            return os.path.getsize(self.file_name)
+        except FileNotFoundError:
+            return 0
+
+    def drop_head(self, offset: int) -> None:
+        """
+        Remove the records before an offset, once they have been folded into a snapshot. The remaining records are
+        copied to a temporary file that is renamed into place.
+        :param offset: size the log had when the snapshot was taken
+        """
+        with self._locked():
+            self._sync()
+            self._close()
+            try:
+                with open(self.file_name, "rb") as file:
+                    file.seek(offset)
+                    tail = file.read()
+            except FileNotFoundError:
+                tail = b""
+            self._replace(tail)
+
+    def migrate(self, legacy_file_name: str, decrypt) -> bool:
+        """
+        Convert the old single-blob data file into the record log if the log does not exist yet.
+        The old file is kept with a ".bak" suffix.
+        :param legacy_file_name: name of the old data file
+        :param decrypt: function decrypting the old file content into a dictionary
+        :return: True if the data was migrated, False if there was nothing to migrate
+        """
+        if os.path.exists(self.file_name) or not os.path.exists(legacy_file_name):
+            return False
+
+        with open(legacy_file_name, "rb") as file:
+            data = decrypt(file.read())
+
+        self.rewrite({(website, details["email"]): details for website, details in data.items()})
+        os.replace(legacy_file_name, f"{legacy_file_name}.bak")
+        fsync_directory(legacy_file_name)
+        return True
+
+    def rewrite(self, entries: dict) -> None:
+        """
+        Replace the whole log with the given entries, encrypted with the current cipher. The records are written to
+        a temporary file that is renamed into place, so the log is never half written.
+        :param entries: dictionary {(website, email): Entry or {"email": ..., "password": ...}}
+        """
+        records = b"".join(self._encode(account, entry) for account, entry in entries.items())
+        with self._locked():
+            self._sync()
+            self._close()
+            self._replace(records)
+
+    def _encode(self, account: tuple, entry) -> bytes:
+        """
+        Encrypt one entry into a length-prefixed record
+        :param account: tuple (website, email) used as the key of the entry
+        :param entry: Entry or dictionary with "email" and "password", None to delete the account
+        :return: record ready to be written to the log
+        """
+        token = self.cipher.encrypt(encode_entry(*account, entry))
+        return LENGTH_PREFIX.pack(len(token)) + token
+
+    def _append(self, records: bytes, count: int) -> None:
+        """
+        Write records at the end of the log and sync them now or later, following the sync policy
+        :param records: encoded records
+        :param count: number of records
+        """
+        with self._locked():
+            if self._file is not None and os.fstat(self._file.fileno()).st_ino != _inode(self.file_name):
+                # The log was replaced since it was opened, records written to the old file would be lost
+                self._close()
+            if self._file is None:
+                self._file = open(self.file_name, "ab")
+            with measure("journal_append", len(records)):
+                self._file.write(records)
+                self._file.flush()
+            self._pending += count
+
+            if self._pending >= self.sync_records or self.sync_interval <= 0:
+                self._sync()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.sync_interval, self.sync)
+                self._timer.daemon = True
+                self._timer.start()
+
+    @contextmanager
+    def _locked(self):
+        """
+        Hold the lock of the threads of this process and the lock file shared with the other processes writing the
+        log. The lock file stays open until the log is closed.
+        """
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            if self._lock_file is None:
+                self._lock_file = os.open(self.file_name + LOCK_SUFFIX, os.O_RDWR | os.O_CREAT, 0o600)
+            with measure("journal_lock"):
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _sync(self) -> None:
+        """
+        Run fsync for the waiting records, the lock has to be held
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._pending and self._file is not None:
+            with measure("fsync"):
+                os.fsync(self._file.fileno())
+            self.syncs += 1
+        self._pending = 0
+
+    def _close(self) -> None:
+        """
+        Close the log file, the lock has to be held and the records synced
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _replace(self, records: bytes) -> None:
+        """
+        Replace the log with the given records, writing a temporary file and renaming it into place
+        :param records: encoded records
+        """
+        temp_file_name = f"{self.file_name}.tmp"
+        with open(temp_file_name, "wb") as file:
+            file.write(records)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_file_name, self.file_name)
+        fsync_directory(self.file_name)
+
+
+def fsync_directory(file_name: str) -> None:
+    """
+    Sync the directory of a file, so that the rename that put the file in place survives a power loss. Systems
+    that cannot open a directory (Windows) are skipped.
+    :param file_name: name of a file in the directory
+    """
+    try:
+        descriptor = os.open(os.path.dirname(file_name) or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def _records(content: bytes):
+    """
+    Iterate over the complete records of a log, stopping at a record cut short by a crash. A length of zero never
+    belongs to a real record (a Fernet token is never empty), it is read from a zero-filled tail and stops the walk too.
+    :param content: content of the log
+    :return: iterator of tuples (start, end) of the ciphertext of every record
+    """
+    position = 0
+    while position + LENGTH_PREFIX.size <= len(content):
+        (length,) = LENGTH_PREFIX.unpack_from(content, position)
+        start = position + LENGTH_PREFIX.size
+        if not length or start + length > len(content):
+            return
+        position = start + length
+        yield start, position
+
+
+def _inode(file_name: str):
+    """
+    Get the inode number of a file
+    :param file_name: name of the file
+    :return: inode number, or None if the file does not exist
+    """
+    try:
+        return os.stat(file_name).st_ino
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,159 @@
+"""
+This module contains the in-memory index used to suggest website names while the user is typing.
+
+Classes:
+
+SearchIndex:
+    This class keeps a sorted prefix index and a trigram index over the website names of the vault.
+Methods:
+
+SearchIndex.add():
+    This method adds a website name to both indexes.
+SearchIndex.remove():
+    This method stops suggesting a website name whose last account was deleted.
+SearchIndex.search():
+    This method returns website names ranked by how well they match the typed text.
+
+Constants:
+
+SCAN_POSTINGS: Largest number of postings read by one trigram search, so that trigrams found in almost every name
+(like "com" or ".co") do not make a keystroke scan the whole index.
+"""
+
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+from heapq import nlargest, nsmallest
+
+SCAN_POSTINGS = 4000
+
+
+class SearchIndex:
+    """Class keeping a prefix index and a trigram index over the website names
+
+    Prefix matches are found with a binary search in the sorted list of lower-cased names. If there are not
+    enough of them, names sharing the most trigrams with the typed text are added, so that typos and matches in
+    the middle of a name are suggested too.
+
+    The trigram search reads the posting arrays from the rarest trigram up and stops before
+    SCAN_POSTINGS numbers, so the very common trigrams of domain suffixes are left out of the
+    score and a keystroke costs a bounded amount of work whatever the size of the vault.
+
+    Removed names are only dropped from the name map and the sorted list, their numbers stay in the trigram index
+    and are skipped by the search, and they get the same number back if they are added again.
+
+    Every name gets a number, and the trigram index maps every trigram to a compact array of the numbers of the
+    names containing it, which takes a tenth of the memory of sets of names for vaults of millions of entries.
+
+    Attributes:
+        names (dict)
+            lower-cased name mapped to the website name as stored in the vault
+    """
+
+    def __init__(self, websites=()):
+        """
+        Constructor of the SearchIndex class
+        :param websites: iterable with the website names to index
+        """
+        self.names = {}
+        self._ids = []
+        self._trigrams = {}
+        self._removed = set()
+        for website in websites:
+            self._index(website)
+        self._sorted = sorted(self.names)
+
+    def add(self, website: str) -> None:
+        """
+        Add a website name to the index, names already indexed are ignored
+        :param website: website name as stored in the vault
+        """
+        if website.lower() not in self.names:
+            self._index(website)
+            insort(self._sorted, website.lower())
+
+    def remove(self, website: str) -> None:
+        """
+        Remove a website name from the index, names not indexed are ignored
+        :param website: website name as stored in the vault
+        """
+        name = website.lower()
+        if name not in self.names:
+            return
+        del self.names[name]
+        del self._sorted[bisect_left(self._sorted, name)]
+        self._removed.add(name)
+
+    def search(self, prefix: str, limit: int = 10) -> list:
+        """
+        Find the website names matching the typed text
+        :param prefix: text typed by the user
+        :param limit: maximum number of names returned
+        :return: list of website names, prefix matches first and then the closest trigram matches
+        """
+        query = prefix.strip().lower()
+        if not query or limit <= 0:
+            return []
+
+        matches = []
+        position = bisect_left(self._sorted, query)
+        while position < len(self._sorted) and len(matches) < limit:
+            name = self._sorted[position]
+            if not name.startswith(query):
+                break
+            matches.append(name)
+            position += 1
+
+        if len(matches) < limit:
+            scores = Counter()
+            budget = SCAN_POSTINGS
+            postings = sorted((self._trigrams[trigram] for trigram in _trigrams(query) if trigram in self._trigrams),
+                              key=len)
+            for numbers in postings:
+                if len(numbers) > budget:
+                    break
+                scores.update(numbers)
+                budget -= len(numbers)
+            if postings and not scores:
+                # Every trigram of the query is very common, a few names of the rarest one are taken in index order
+                scores.update(postings[0][:limit * 32])
+            found = set(matches)
+            ids = self._ids
+            names = self.names
+            # Only the names scoring as high as the best few can be ranked, the others are not looked at
+            wanted = limit - len(matches)
+            threshold = min(nlargest(wanted + len(found), scores.values()), default=0)
+            ranked = nsmallest(wanted, (number for number, score in scores.items() if score >= threshold
+                                        and ids[number] not in found and ids[number] in names),
+                               key=lambda number: (-scores[number], len(ids[number]), ids[number]))
+            matches.extend(ids[number] for number in ranked)
+
+        return [self.names[name] for name in matches]
+
+    def _index(self, website: str) -> None:
+        """
+        Add a website name to the name map and the trigram index
+        :param website: website name as stored in the vault
+        """
+        name = website.lower()
+        known = name in self.names or name in self._removed
+        self.names[name] = website
+        if known:
+            self._removed.discard(name)
+            return
+        number = len(self._ids)
+        self._ids.append(name)
+        for trigram in _trigrams(name):
+            postings = self._trigrams.get(trigram)
+            if postings is None:
+                postings = self._trigrams[trigram] = array("I")
+            postings.append(number)
+
+
+def _trigrams(text: str) -> set:
+    """
+    Split the text into overlapping groups of three characters
+    :param text: lower-cased text
+    :return: set of trigrams, empty if the text is shorter than three characters
+    """
+    return {text[i:i + 3] for i in range(len(text) - 2)}
@@ -0,0 +1,74 @@
+"""
+Tests of the account index: accounts by website, websites by email and by domain, kept up to date by add and remove.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from account_index import AccountIndex, normalise_domain
+
+ACCOUNTS = [("Github", "a@x.com"), ("Github", "b@x.com"), ("Github.com", "a@x.com"), ("Gitlab", "B@x.com"),
+            ("Https://accounts.google.com/login", "a@x.com"), ("Bbc.co.uk", "c@x.com")]
+
+
+def test_lookups_by_website_email_and_domain():
+    index = AccountIndex(ACCOUNTS)
+
+    assert index.emails("Github") == ("a@x.com", "b@x.com")
+    assert index.emails("Gitlab") == ("B@x.com",)
+    assert index.emails("Unknown") == ()
+    assert index.websites_for_email("A@X.COM") == ["Github", "Github.com", "Https://accounts.google.com/login"]
+    assert index.websites_for_email("b@x.com") == ["Github", "Gitlab"]
+    assert index.websites_for_domain("https://www.github.com/") == ["Github", "Github.com"]
+    assert index.websites_for_domain("google") == ["Https://accounts.google.com/login"]
+    assert index.websites_for_domain("bbc") == ["Bbc.co.uk"]
+
+
+def test_indexes_follow_deletes():
+    index = AccountIndex(ACCOUNTS)
+    index.websites_for_email("a@x.com")
+    index.websites_for_domain("github")
+
+    index.remove("Github", "a@x.com")
+    assert index.emails("Github") == ("b@x.com",)
+    assert index.websites_for_email("a@x.com") == ["Github.com", "Https://accounts.google.com/login"]
+    assert index.websites_for_domain("github") == ["Github", "Github.com"]
+
+    index.remove("Github", "b@x.com")
+    assert "Github" not in index
+    assert index.websites_for_email("b@x.com") == ["Gitlab"]
+    assert index.websites_for_domain("github") == ["Github.com"]
+
+    # Unknown accounts are ignored
+    index.remove("Github", "b@x.com")
+    assert len(index) == 4
+
+
+def test_indexes_follow_a_rename():
+    index = AccountIndex(ACCOUNTS)
+    index.websites_for_email("c@x.com")
+    index.websites_for_domain("bbc")
+
+    # A website is renamed by saving its account under the new name and deleting the old one
+    index.add("Bbc", "c@x.com")
+    index.remove("Bbc.co.uk", "c@x.com")
+
+    assert index.emails("Bbc") == ("c@x.com",) and index.emails("Bbc.co.uk") == ()
+    assert index.websites_for_email("c@x.com") == ["Bbc"]
+    assert index.websites_for_domain("bbc.co.uk") == ["Bbc"]
+
+
+def test_adding_an_indexed_account_changes_nothing():
+    index = AccountIndex(ACCOUNTS)
+    index.add("Github", "a@x.com")
+
+    assert index.emails("Github") == ("a@x.com", "b@x.com") and len(index) == 5
+
+
+def test_normalise_domain():
+    assert normalise_domain("Https://www.Github.com:443/login?next=/") == "github"
+    assert normalise_domain("user@mail.example.org") == "example"
+    assert normalise_domain("bbc.co.uk") == "bbc"
+    assert normalise_domain("Localhost") == "localhost"
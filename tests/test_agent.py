@@ -0,0 +1,69 @@
+"""
+Tests of the unlock agent: the directory of its socket and the requests it answers.
+"""
+
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import agent
+from agent import AgentServer, AgentClient
+from vault import Vault
+
+FAST_PARAMETERS = {"kdf": "scrypt", "n": 1024, "r": 8, "p": 1}
+
+
+@pytest.fixture
+def vault(tmp_path):
+    vault = Vault(str(tmp_path))
+    vault.create_key(b"passphrase", FAST_PARAMETERS)
+    vault.open(b"passphrase")
+    vault.add("Github", "user@example.com", "secret")
+    yield vault
+    vault.close()
+
+
+def test_agent_directory_is_created_private(tmp_path, monkeypatch):
+    directory = tmp_path / "agent"
+    monkeypatch.setattr(agent, "_agent_directory", lambda: str(directory))
+    agent._private_directory(str(directory))
+    assert os.stat(directory).st_mode & 0o777 == 0o700
+
+
+def test_other_directory_is_left_alone(tmp_path):
+    os.chmod(tmp_path, 0o755)
+    agent._private_directory(str(tmp_path))
+    assert os.stat(tmp_path).st_mode & 0o777 == 0o755
+
+
+def test_writable_directory_is_refused(tmp_path):
+    os.chmod(tmp_path, 0o777)
+    try:
+        with pytest.raises(PermissionError):
+            agent._private_directory(str(tmp_path))
+        assert os.stat(tmp_path).st_mode & 0o777 == 0o777
+    finally:
+        os.chmod(tmp_path, 0o700)
+
+
+@pytest.mark.skipif(not hasattr(agent.socket, "AF_UNIX"), reason="Unix domain sockets are not available")
+def test_requests(vault, tmp_path):
+    path = str(tmp_path / "agent.sock")
+    server = AgentServer(vault, path, idle_timeout=0)
+    thread = threading.Thread(target=server.serve)
+    thread.start()
+    client = AgentClient(path)
+    try:
+        assert client.get("Github")["password"] == "secret"
+        assert client.search("git") == ["Github"]
+        with pytest.raises(RuntimeError, match="ValueError"):
+            client._request({"op": "unknown"})
+    finally:
+        client.stop()
+        client.close()
+        thread.join()
+    assert not os.path.exists(path)
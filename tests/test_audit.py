@@ -0,0 +1,93 @@
+"""
+Tests of the audit: binary search of a breach list in the "ordered by hash" format and reused passwords.
+"""
+
+import hashlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audit import BreachList, audit_entries, report_lines, report_summary
+from entry import Entry
+
+PASSWORDS = [f"password{i}" for i in range(9)]
+
+
+def digest(password: str) -> bytes:
+    return hashlib.sha1(password.encode("utf-8")).digest()
+
+
+@pytest.fixture
+def breach_file(tmp_path):
+    """
+    Breach list of every password but the middle one by hash, written like the published list: upper-case digests
+    sorted by hash and CRLF line endings. The count of every password is its position in the list plus one.
+    """
+    ordered = sorted(PASSWORDS, key=digest)
+    missing = ordered.pop(len(ordered) // 2)
+    lines = [f"{digest(password).hex().upper()}:{count}\r\n" for count, password in enumerate(ordered, 1)]
+    path = tmp_path / "pwned-passwords-sha1-ordered-by-hash.txt"
+    path.write_bytes("".join(lines).encode("ascii"))
+    return str(path), ordered, missing
+
+
+def test_first_and_last_lines_and_a_miss(breach_file):
+    file_name, ordered, missing = breach_file
+    breach_list = BreachList(file_name)
+    try:
+        assert breach_list.count(digest(ordered[0])) == 1
+        assert breach_list.count(digest(ordered[-1])) == len(ordered)
+        assert breach_list.count(digest(missing)) == 0
+        assert breach_list.count(digest("not in the list")) == 0
+    finally:
+        breach_list.close()
+
+
+def test_sorted_lookups_find_every_listed_digest(breach_file):
+    file_name, ordered, missing = breach_file
+    breach_list = BreachList(file_name)
+    try:
+        found = breach_list.counts(digest(password) for password in PASSWORDS)
+    finally:
+        breach_list.close()
+
+    assert found == {digest(password): count for count, password in enumerate(ordered, 1)}
+
+
+def test_empty_breach_list_is_refused(tmp_path):
+    path = tmp_path / "empty.txt"
+    path.write_bytes(b"")
+
+    with pytest.raises(ValueError):
+        BreachList(str(path))
+
+
+def test_audit_finds_reused_and_breached_passwords(breach_file):
+    file_name, ordered, missing = breach_file
+    entries = [("Github", Entry("a@x.com", ordered[-1])), ("Gitlab", Entry("a@x.com", ordered[-1])),
+               ("Bbc", Entry("b@x.com", missing)), ("Mail", {"email": "c@x.com", "password": ordered[0]})]
+
+    report = audit_entries(entries, file_name)
+
+    assert report["passwords"] == 4 and report["unique"] == 3
+    assert report["reused"] == [[("Github", "a@x.com"), ("Gitlab", "a@x.com")]]
+    assert report["breached"] == [("Github", "a@x.com", len(ordered)), ("Gitlab", "a@x.com", len(ordered)),
+                                  ("Mail", "c@x.com", 1)]
+    assert audit_entries(entries)["breached"] == []
+
+    assert report_lines(report) == ["Reused passwords:", "    Github (a@x.com), Gitlab (a@x.com)",
+                                    "Breached passwords:", f"    Github (a@x.com): seen {len(ordered)} times",
+                                    f"    Gitlab (a@x.com): seen {len(ordered)} times",
+                                    "    Mail (c@x.com): seen 1 times"]
+    assert report_summary(report, file_name).startswith("4 passwords checked against the breach list in ")
+    assert report_summary(report, file_name).endswith(": 1 reused, 3 breached")
+
+
+def test_clean_audit_has_no_lines():
+    report = audit_entries([("Github", Entry("a@x.com", "one")), ("Gitlab", Entry("a@x.com", "two"))])
+
+    assert report_lines(report) == []
+    assert report_summary(report).startswith("2 passwords checked for reuse in ")
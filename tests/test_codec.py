@@ -0,0 +1,79 @@
+"""
+Tests of the serializer: round trips of the current format, payloads of older versions read by the current codec,
+and compact entries sharing their emails.
+"""
+
+import base64
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from codec import FORMAT_VERSION, HEADER, MAGIC, decode_entries, decode_entry, decode_vault, encode_entries, \
+    encode_entry
+from entry import Entry
+
+
+def version_2(data) -> bytes:
+    return MAGIC + bytes([2]) + json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+
+def test_version_2_snapshot_is_read_as_one_account_per_website():
+    payload = version_2({"Github": {"email": "user@example.com", "password": "secret"},
+                         "Gitlab": {"email": "other@example.com", "password": "p'\"ss"}})
+
+    entries = decode_entries(payload)
+
+    assert entries == {("Github", "user@example.com"): Entry("user@example.com", "secret"),
+                       ("Gitlab", "other@example.com"): Entry("other@example.com", "p'\"ss")}
+
+
+def test_version_2_record_replaces_the_accounts_of_its_website():
+    website, entry = decode_entry(version_2(["Github", "user@example.com", "secret"]))
+
+    assert website == "Github" and entry == Entry("user@example.com", "secret")
+
+
+def test_first_version_payload_is_still_read():
+    data = {"Github": {"email": "user@example.com", "password": "it's"}}
+    payload = base64.b64encode(str(data).encode("utf-8"))
+
+    assert decode_vault(payload) == data
+    assert decode_entries(payload) == {("Github", "user@example.com"): Entry("user@example.com", "it's")}
+
+
+def test_decoded_entries_share_their_email():
+    payload = version_2({f"Site{i}": {"email": "user@" + "example.com", "password": str(i)} for i in range(3)})
+
+    emails = {id(entry.email) for entry in decode_entries(payload).values()}
+
+    assert len(emails) == 1
+
+
+def test_current_version_round_trip():
+    entries = {("Github", "a@x.com"): Entry("a@x.com", "secret"), ("Github", "b@x.com"): Entry("b@x.com", "p'\"ss"),
+               ("Übung", "ü@x.com"): Entry("ü@x.com", "pässword")}
+
+    payload = encode_entries(entries)
+
+    assert payload[:len(HEADER)] == HEADER and payload[len(MAGIC)] == FORMAT_VERSION
+    assert decode_entries(payload) == entries
+
+
+def test_current_version_record_round_trip():
+    entry = Entry("a@x.com", "secret")
+
+    assert decode_entry(encode_entry("Github", "a@x.com", entry)) == (("Github", "a@x.com"), entry)
+    assert decode_entry(encode_entry("Github", "a@x.com", None)) == (("Github", "a@x.com"), None)
+
+
+def test_newer_version_is_refused():
+    newer = MAGIC + bytes([FORMAT_VERSION + 1]) + b"[]"
+
+    with pytest.raises(ValueError):
+        decode_entries(newer)
+    with pytest.raises(ValueError):
+        decode_entry(newer)
@@ -0,0 +1,73 @@
+"""
+Tests of the password generator: policy validation, the minimum counts of the character classes and the rejection of
+the random bytes that would bias the characters.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generator
+from generator import AMBIGUOUS, DIGITS, LOWERCASE, SYMBOLS, UPPERCASE, PasswordPolicy, generate_passwords
+
+
+@pytest.mark.parametrize("arguments", [
+    {"length": 4, "digits": 3, "symbols": 2},
+    {"length": 257},
+    {"lowercase": None, "uppercase": None, "digits": None, "symbols": None},
+    {"symbol_set": ""},
+    {"symbol_set": "é"},
+])
+def test_invalid_policies_are_refused(arguments):
+    with pytest.raises(ValueError):
+        PasswordPolicy(**arguments)
+
+
+def test_every_class_reaches_its_minimum():
+    policy = PasswordPolicy(length=8, lowercase=1, uppercase=2, digits=2, symbols=3)
+
+    passwords = generate_passwords(500, policy)
+
+    assert len(passwords) == 500 and all(len(password) == 8 for password in passwords)
+    for password in passwords:
+        assert sum(character in LOWERCASE for character in password) >= 1
+        assert sum(character in UPPERCASE for character in password) >= 2
+        assert sum(character in DIGITS for character in password) >= 2
+        assert sum(character in SYMBOLS for character in password) >= 3
+
+
+def test_left_out_and_ambiguous_characters_are_never_used():
+    policy = PasswordPolicy(length=32, symbols=None, exclude_ambiguous=True)
+
+    characters = set("".join(generate_passwords(200, policy)))
+
+    assert characters <= set(policy.alphabet)
+    assert not characters & set(SYMBOLS + AMBIGUOUS)
+
+
+def test_biasing_bytes_are_rejected(monkeypatch):
+    alphabet = "0123456789"
+    table, rejected = generator._translation(alphabet)
+    # 250 is the largest multiple of 10 below 256, every character comes from 25 bytes
+    assert rejected == bytes(range(250, 256))
+    assert all(table[:250].count(ord(character)) == 25 for character in alphabet)
+
+    calls = []
+    accepted = iter(range(1000))
+
+    def token_bytes(size):
+        calls.append(size)
+        # The first batch is rejected completely, the next ones alternate rejected and accepted bytes
+        if len(calls) == 1:
+            return bytes([255] * size)
+        return bytes(250 + i % 6 if i % 2 else next(accepted) % 10 for i in range(size))
+
+    monkeypatch.setattr(generator.secrets, "token_bytes", token_bytes)
+
+    characters = generator._draw(alphabet, 20)
+
+    assert len(calls) > 1
+    assert characters == "01234567890123456789"
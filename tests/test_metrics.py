@@ -0,0 +1,38 @@
+"""
+Tests of the instrumentation: the table of timings shared by the command line interface and the GUI.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+
+
+@pytest.fixture
+def enabled():
+    was_enabled = metrics.METRICS.enabled
+    metrics.METRICS.reset()
+    metrics.enable()
+    yield metrics.METRICS
+    if not was_enabled:
+        metrics.METRICS.disable()
+    metrics.METRICS.reset()
+
+
+def test_table_lines_has_one_line_per_stage(enabled):
+    enabled.record("decrypt", 0.002, 2_000_000)
+    enabled.record("decrypt", 0.004, 2_000_000)
+
+    header, line = metrics.table_lines()
+
+    assert header.split() == ["stage", "count", "total", "ms", "p50", "ms", "p99", "ms", "MB"]
+    assert line.split()[:3] == ["decrypt", "2", "6.0"] and line.split()[-1] == "4.00"
+    assert len(header) == len(line)
+
+
+def test_table_lines_without_measurements(enabled):
+    assert len(metrics.table_lines()) == 1
@@ -0,0 +1,179 @@
+"""
+Tests of the journal: appends, grouped fsync and the recovery of a log left damaged by a crash or a power loss.
+"""
+
+import os
+import sys
+import threading
+
+import pytest
+from cryptography.fernet import Fernet
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from entry import Entry
+import record_store
+from record_store import RecordStore, LENGTH_PREFIX
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = RecordStore(str(tmp_path / "data.log"), Fernet(Fernet.generate_key()), sync_interval=0)
+    yield store
+    store.close()
+
+
+def add_accounts(store: RecordStore, count: int) -> None:
+    store.put_many({(f"Site{i}", "user@example.com"): Entry("user@example.com", f"password{i}") for i in range(count)})
+
+
+def append_raw(store: RecordStore, data: bytes) -> None:
+    store.close()
+    with open(store.file_name, "ab") as file:
+        file.write(data)
+
+
+def test_put_and_load_keep_the_last_record_of_every_account(store):
+    store.put(("Github", "a@x.com"), Entry("a@x.com", "old"))
+    store.put(("Github", "b@x.com"), Entry("b@x.com", "other"))
+    store.put(("Github", "a@x.com"), Entry("a@x.com", "new"))
+    store.put(("Github", "b@x.com"), None)
+
+    data = store.load()
+
+    assert data == {("Github", "a@x.com"): Entry("a@x.com", "new"), ("Github", "b@x.com"): None}
+
+
+def test_recover_keeps_an_intact_log(store):
+    add_accounts(store, 5)
+    size = store.size()
+
+    report = store.recover()
+
+    assert report["records"] == 5 and report["dropped_bytes"] == 0
+    assert store.size() == size
+
+
+def test_recover_drops_a_record_cut_short(store):
+    add_accounts(store, 3)
+    size = store.size()
+    append_raw(store, LENGTH_PREFIX.pack(500) + b"gAAAAA")
+
+    report = store.recover()
+
+    assert report == {"records": 3, "dropped_bytes": LENGTH_PREFIX.size + 6, "seconds": report["seconds"]}
+    assert store.size() == size
+
+
+def test_recover_drops_a_zero_filled_tail(store):
+    add_accounts(store, 3)
+    size = store.size()
+    append_raw(store, bytes(64))
+
+    report = store.recover()
+
+    assert report["records"] == 3 and report["dropped_bytes"] == 64
+    assert store.size() == size
+    assert len(store.load()) == 3
+
+
+def test_recover_drops_records_that_do_not_decrypt(store):
+    add_accounts(store, 3)
+    size = store.size()
+    garbage = os.urandom(120)
+    append_raw(store, (LENGTH_PREFIX.pack(len(garbage)) + garbage) * 2)
+
+    report = store.recover()
+
+    assert report["records"] == 3 and report["dropped_bytes"] == 2 * (LENGTH_PREFIX.size + len(garbage))
+    assert store.size() == size
+
+
+def test_appends_after_recovery_are_readable(store):
+    add_accounts(store, 2)
+    append_raw(store, bytes(64))
+    store.recover()
+
+    store.put(("Gitlab", "a@x.com"), Entry("a@x.com", "secret"))
+
+    data = store.load()
+    assert len(data) == 3 and data[("Gitlab", "a@x.com")].password == "secret"
+
+
+def test_load_skips_a_damaged_record_in_the_middle(store):
+    add_accounts(store, 2)
+    garbage = os.urandom(120)
+    append_raw(store, LENGTH_PREFIX.pack(len(garbage)) + garbage)
+    store.put(("Gitlab", "a@x.com"), Entry("a@x.com", "secret"))
+
+    data = store.load()
+
+    assert len(data) == 3 and store.invalid_records == 1
+
+
+def test_drop_head_keeps_the_records_after_the_offset(store):
+    add_accounts(store, 2)
+    offset = store.size()
+    store.put(("Gitlab", "a@x.com"), Entry("a@x.com", "secret"))
+
+    store.drop_head(offset)
+
+    assert store.load() == {("Gitlab", "a@x.com"): Entry("a@x.com", "secret")}
+
+
+def test_grouped_fsync_syncs_once_per_batch(tmp_path):
+    store = RecordStore(str(tmp_path / "data.log"), Fernet(Fernet.generate_key()), sync_interval=60, sync_records=4)
+    for i in range(8):
+        store.put((f"Site{i}", "a@x.com"), Entry("a@x.com", "p"))
+    assert store.syncs == 2
+    store.put(("Site8", "a@x.com"), Entry("a@x.com", "p"))
+    store.close()
+    assert store.syncs == 3
+
+
+@pytest.mark.skipif(record_store.fcntl is None, reason="flock is not available")
+def test_recover_waits_for_a_write_of_another_process(store):
+    add_accounts(store, 2)
+    other = RecordStore(store.file_name, store.cipher, sync_interval=0)
+    records = b"".join(store._encode((f"Site{i}", "a@x.com"), Entry("a@x.com", "p")) for i in range(2, 6))
+    reports = []
+
+    # The lock is held the way an append of another process holds it, half of its records already written
+    with store._locked():
+        with open(store.file_name, "ab") as file:
+            file.write(records[:len(records) // 2])
+        recovery = threading.Thread(target=lambda: reports.append(other.recover()))
+        recovery.start()
+        recovery.join(0.2)
+        assert recovery.is_alive()
+        with open(store.file_name, "ab") as file:
+            file.write(records[len(records) // 2:])
+    recovery.join()
+    other.close()
+
+    assert reports[0]["dropped_bytes"] == 0
+    assert len(store.load()) == 6
+
+
+@pytest.mark.skipif(record_store.fcntl is None, reason="flock is not available")
+def test_drop_head_keeps_an_append_of_another_process(store, monkeypatch):
+    add_accounts(store, 2)
+    offset = store.size()
+    other = RecordStore(store.file_name, store.cipher, sync_interval=0)
+    replace = store._replace
+    appends = []
+
+    def replace_during_an_append(records):
+        # Another process appends after the tail was read, before the new log is renamed into place
+        append = threading.Thread(target=other.put, args=(("Gitlab", "a@x.com"), Entry("a@x.com", "secret")))
+        append.start()
+        append.join(0.2)
+        appends.append(append)
+        replace(records)
+
+    monkeypatch.setattr(store, "_replace", replace_during_an_append)
+    store.drop_head(offset)
+    appends[0].join()
+    other.close()
+
+    assert store.load() == {("Gitlab", "a@x.com"): Entry("a@x.com", "secret")}
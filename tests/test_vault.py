@@ -0,0 +1,190 @@
+"""
+Tests of the vault: opening a vault set up by an older version with only a bcrypt hash of its raw key, the
+suggestions made from the search index without waiting for the vault, the checks of new entries, the cold
+lookups of a vault compacted by another process and the warnings about a damaged journal.
+"""
+
+import base64
+import os
+import sys
+import threading
+
+import bcrypt
+import pytest
+from cryptography.fernet import Fernet
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vault import Vault, KEY_FILE, HEADER_FILE, LEGACY_DATA_FILE
+
+LEGACY_KEY = b"k" * 32
+
+
+@pytest.fixture
+def legacy_directory(tmp_path):
+    with open(tmp_path / KEY_FILE, "w") as file:
+        file.write(bcrypt.hashpw(LEGACY_KEY, bcrypt.gensalt(rounds=4)).decode("utf-8"))
+    payload = base64.b64encode(str({"Github": {"email": "user@example.com", "password": "secret"}}).encode("utf-8"))
+    with open(tmp_path / LEGACY_DATA_FILE, "wb") as file:
+        file.write(Fernet(base64.b64encode(LEGACY_KEY)).encrypt(payload))
+    return tmp_path
+
+
+def test_wrong_key_leaves_no_header(legacy_directory):
+    vault = Vault(str(legacy_directory))
+    with pytest.raises(ValueError):
+        vault.open(b"wrong passphrase")
+    assert not os.path.exists(legacy_directory / HEADER_FILE)
+    assert vault.check_key(LEGACY_KEY)
+
+
+def test_right_key_migrates(legacy_directory):
+    vault = Vault(str(legacy_directory))
+    vault.open(LEGACY_KEY)
+    try:
+        assert vault.get("Github")["password"] == "secret"
+    finally:
+        vault.close()
+    assert os.path.exists(legacy_directory / HEADER_FILE)
+
+    vault = Vault(str(legacy_directory))
+    assert not vault.check_key(b"wrong passphrase")
+    assert vault.check_key(LEGACY_KEY)
+    vault.open(LEGACY_KEY)
+    try:
+        assert vault.get("Github")["password"] == "secret"
+    finally:
+        vault.close()
+
+
+def test_suggest_does_not_wait_for_the_vault(tmp_path):
+    vault = Vault(str(tmp_path))
+    vault.create_key(b"passphrase", {"kdf": "scrypt", "n": 1024, "r": 8, "p": 1})
+    vault.open(b"passphrase")
+    try:
+        # Nothing to load, so nothing to suggest
+        assert vault.suggest("git") == []
+        vault.add("Github", "user@example.com", "secret")
+        # Nothing has been loaded yet
+        assert vault.suggest("git") is None
+        assert vault.search("git") == ["Github"]
+        assert vault.suggest("git") == ["Github"]
+
+        # Another process changed the files, the index is out of date
+        other = Vault(str(tmp_path))
+        other.open(b"passphrase")
+        other.add("Gitlab", "user@example.com", "secret")
+        other.close()
+        assert vault.suggest("git") is None
+        assert vault.search("git") == ["Github", "Gitlab"]
+
+        # A compaction, or any other thread, holds the vault
+        held = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with vault.cache._lock:
+                held.set()
+                release.wait()
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        try:
+            held.wait()
+            assert vault.suggest("git") is None
+        finally:
+            release.set()
+            holder.join()
+        assert vault.suggest("git") == ["Github", "Gitlab"]
+    finally:
+        vault.close()
+
+
+def test_add_refuses_empty_fields(tmp_path):
+    vault = Vault(str(tmp_path))
+    vault.create_key(b"passphrase", {"kdf": "scrypt", "n": 1024, "r": 8, "p": 1})
+    vault.open(b"passphrase")
+    try:
+        for fields in (("", "user@example.com", "secret"), ("Github", "", "secret"),
+                       ("Github", "user@example.com", "")):
+            with pytest.raises(ValueError):
+                vault.add(*fields)
+        assert vault.websites() == []
+    finally:
+        vault.close()
+
+
+def test_cold_lookup_after_compaction_reusing_the_inode(tmp_path):
+    writer = Vault(str(tmp_path))
+    writer.create_key(b"passphrase", {"kdf": "scrypt", "n": 1024, "r": 8, "p": 1})
+    writer.open(b"passphrase")
+    writer.add("Github", "user@example.com", "old")
+
+    reader = Vault(str(tmp_path))
+    reader.open(b"passphrase")
+    try:
+        assert reader.get("Github")["password"] == "old"
+
+        # The old log is kept alive under another name, so its inode can be given back to the new log
+        log = str(tmp_path / "data.log")
+        os.link(log, str(tmp_path / "old.log"))
+        writer.add("Github", "user@example.com", "new")
+        writer.compact()
+        for i in range(20):
+            writer.add(f"Site{i}", "user@example.com", "other")
+        writer.close()
+        with open(log, "rb") as file:
+            content = file.read()
+        with open(tmp_path / "old.log", "r+b") as file:
+            file.truncate()
+            file.write(content)
+        os.replace(str(tmp_path / "old.log"), log)
+
+        assert reader.get("Github")["password"] == "new"
+    finally:
+        reader.close()
+
+
+def test_warnings_report_a_damaged_journal(tmp_path):
+    vault = Vault(str(tmp_path))
+    vault.create_key(b"passphrase", {"kdf": "scrypt", "n": 1024, "r": 8, "p": 1})
+    vault.open(b"passphrase")
+    vault.add("Github", "user@example.com", "secret")
+    vault.close()
+    assert vault.warnings() == []
+
+    garbage = os.urandom(120)
+    record = len(garbage).to_bytes(4, "big") + garbage
+    with open(tmp_path / "data.log", "r+b") as file:
+        content = file.read()
+        file.seek(0)
+        file.write(record + content + bytes(64))
+
+    vault = Vault(str(tmp_path))
+    vault.open(b"passphrase")
+    try:
+        assert vault.get("Github")["password"] == "secret"
+        warnings = vault.warnings()
+    finally:
+        vault.close()
+    assert len(warnings) == 2
+    assert "64 bytes" in warnings[0] and warnings[1].endswith(": 1.")
+
+
+def test_legacy_key_is_checked_with_bcrypt_once(legacy_directory, monkeypatch):
+    checks = []
+    checkpw = bcrypt.checkpw
+    monkeypatch.setattr(bcrypt, "checkpw", lambda key, hashed: checks.append(key) or checkpw(key, hashed))
+    vault = Vault(str(legacy_directory))
+    assert vault.check_key(LEGACY_KEY)
+    vault.open(LEGACY_KEY)
+    vault.close()
+    assert len(checks) == 1
+
+
+def test_passphrase_is_not_kept(tmp_path):
+    vault = Vault(str(tmp_path))
+    vault.create_key(b"passphrase", {"kdf": "scrypt", "n": 1024, "r": 8, "p": 1})
+    assert vault.check_key(b"passphrase")
+    assert b"passphrase" not in vars(vault.keys).values()
+    assert vault.keys.remembers(b"passphrase") and not vault.keys.remembers(b"other")
@@ -0,0 +1,253 @@
+"""
+This module contains the streaming bulk import and export of the vault.
+
+The import reads browser CSV exports (Chrome, Edge, Firefox, Safari), JSON exports (a list of entries, a Bitwarden-like
+{"items": [...]} object or the {website: {"email": ..., "password": ...}} mapping used by the program) and JSON Lines
+files row by row. Keys are normalised the same way as in the GUI, everything is merged in memory and committed to the
+vault with a single write. The export writes the entries to the file one at a time.
+
+Functions:
+
+import_file():
+    This function streams a CSV, JSON or JSON Lines file into the vault and reports the throughput and counts.
+export_file():
+    This function streams all the entries of the vault into a CSV, JSON or JSON Lines file.
+
+Constants:
+
+WEBSITE_FIELDS: Names of the fields holding the website name, in the order they are tried.
+URL_FIELDS: Names of the fields holding the website address, used when there is no name.
+EMAIL_FIELDS: Names of the fields holding the username or email.
+PASSWORD_FIELDS: Names of the fields holding the password.
+CHUNK_SIZE: Number of characters read at a time when a JSON list is streamed.
+"""
+
+import csv
+import json
+import sys
+import time
+from urllib.parse import urlsplit
+
+from entry import Entry
+from vault import Vault
+
+WEBSITE_FIELDS = ("website", "name", "title")
+URL_FIELDS = ("url", "origin", "login_uri", "uri")
+EMAIL_FIELDS = ("email", "username", "login", "login_username", "user")
+PASSWORD_FIELDS = ("password", "login_password")
+CHUNK_SIZE = 1 << 16
+
+
+def import_file(vault: Vault, file_name: str, file_format: str = None, overwrite: bool = True) -> dict:
+    """
+    Stream a CSV, JSON or JSON Lines file into the vault, committing all the entries with a single write
+    :param vault: opened vault
+    :param file_name: name of the file to import
+    :param file_format: "csv", "json" or "jsonl", guessed from the file extension if None
+    :param overwrite: if True, accounts already stored with a different password are replaced, otherwise they are
+                      kept. Accounts with another email are added next to the ones stored for the website.
+    :return: dictionary with the number of rows, imported entries, duplicates, conflicts and skipped rows,
+             the elapsed time in seconds and the rows per second
+    """
+    try:
+        existing = vault.cache.get()
+    except FileNotFoundError:
+        existing = {}
+
+    start = time.perf_counter()
+
+    report = {"rows": 0, "imported": 0, "duplicates": 0, "conflicts": 0, "skipped": 0}
+    merged = {}
+    with open(file_name, encoding="utf-8-sig", newline="") as file:
+        for record in _read_records(file, file_format or _guess_format(file_name)):
+            report["rows"] += 1
+            entry = _normalise(record)
+            if entry is None:
+                report["skipped"] += 1
+                continue
+
+            website, details = entry
+            account = (website, details.email)
+            stored = merged.get(account) or existing.get(account)
+            if stored == details:
+                report["duplicates"] += 1
+                continue
+            if stored is not None:
+                report["conflicts"] += 1
+                if not overwrite:
+                    continue
+            merged[account] = details
+
+    if merged:
+        vault.add_many((website, details) for (website, _), details in merged.items())
+    report["imported"] = len(merged)
+    report["seconds"] = time.perf_counter() - start
+    report["rows_per_second"] = report["rows"] / report["seconds"] if report["seconds"] else 0.0
+    return report
+
+
+def export_file(vault: Vault, file_name: str, file_format: str = None) -> int:
+    """
+    Stream all the entries of the vault into a CSV, JSON or JSON Lines file, one entry at a time
+    :param vault: opened vault
+    :param file_name: name of the file to write, "-" for the standard output
+    :param file_format: "csv", "json" or "jsonl", guessed from the file extension if None
+    :return: number of entries written
+    """
+    file_format = file_format or _guess_format(file_name)
+    if file_name == "-":
+        return _write_records(sys.stdout, vault.entries(), file_format)
+    with open(file_name, "w", encoding="utf-8", newline="") as file:
+        return _write_records(file, vault.entries(), file_format)
+
+
+def _guess_format(file_name: str) -> str:
+    """
+    Guess the file format from the file extension
+    :param file_name: name of the file
+    :return: "csv", "jsonl" or "json"
+    """
+    lower_name = file_name.lower()
+    if lower_name.endswith(".csv"):
+        return "csv"
+    if lower_name.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    return "json"
+
+
+def _read_records(file, file_format: str):
+    """
+    Read the records of a file one at a time
+    :param file: opened text file
+    :param file_format: "csv", "json" or "jsonl"
+    :return: iterator of dictionaries
+    """
+    if file_format == "csv":
+        for row in csv.DictReader(file):
+            yield {(name or "").strip().lower(): value for name, value in row.items()}
+    elif file_format == "jsonl":
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+    elif file_format == "json":
+        yield from _read_json(file)
+    else:
+        raise ValueError(f"Unknown file format: {file_format}")
+
+
+def _read_json(file):
+    """
+    Read the entries of a JSON export. A top-level list is decoded one item at a time so that the file does not
+    have to be loaded whole; objects are loaded at once.
+    :param file: opened text file
+    :return: iterator of dictionaries
+    """
+    decoder = json.JSONDecoder()
+    buffer = file.read(CHUNK_SIZE).lstrip()
+    if not buffer.startswith("["):
+        data = json.loads(buffer + file.read())
+        if "items" in data and isinstance(data["items"], list):
+            yield from data["items"]
+        else:
+            for website, details in data.items():
+                yield {"website": website, **details}
+        return
+
+    buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip().lstrip(",").lstrip()
+        if buffer.startswith("]"):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            # The item continues in the next chunk of the file
+            chunk = file.read(CHUNK_SIZE)
+            if not chunk:
+                raise
+            buffer += chunk
+            continue
+        yield item
+        buffer = buffer[end:]
+
+
+def _normalise(record: dict):
+    """
+    Pick the website, email and password out of an imported record and normalise them like the GUI does
+    :param record: dictionary read from the file
+    :return: tuple (website, Entry) or None if the record is not usable
+    """
+    if isinstance(record.get("login"), dict):
+        # Bitwarden-like items keep the credentials in a nested "login" object
+        login = record["login"]
+        uris = login.get("uris") or [{}]
+        record = {"name": record.get("name"), "url": uris[0].get("uri"),
+                  "username": login.get("username"), "password": login.get("password")}
+
+    website = _first(record, WEBSITE_FIELDS)
+    if not website:
+        url = _first(record, URL_FIELDS)
+        if url:
+            host = urlsplit(url if "//" in url else f"//{url}").hostname or ""
+            website = host[4:] if host.startswith("www.") else host
+    email = _first(record, EMAIL_FIELDS)
+    password = _first(record, PASSWORD_FIELDS)
+    if not website or not email or not password:
+        return None
+    return website.capitalize(), Entry(email.lower(), password)
+
+
+def _first(record: dict, fields: tuple) -> str:
+    """
+    Get the first non-empty value of the given fields
+    :param record: dictionary read from the file
+    :param fields: names of the fields to try
+    :return: value of the first non-empty field, or an empty string
+    """
+    for field in fields:
+        value = record.get(field)
+        if value:
+            return str(value).strip()
+    return ""
+
+
+def _write_records(file, entries, file_format: str) -> int:
+    """
+    Write the entries to a file one at a time
+    :param file: opened text file
+    :param entries: iterator of tuples (website, {"email": ..., "password": ...})
+    :param file_format: "csv", "json" or "jsonl"
+    :return: number of entries written
+    """
+    count = 0
+    if file_format == "csv":
+        # Same columns as the browser exports, so the file can be imported back into a browser
+        writer = csv.writer(file)
+        writer.writerow(["name", "url", "username", "password"])
+        for website, details in entries:
+            writer.writerow([website, "", details["email"], details["password"]])
+            count += 1
+    elif file_format == "jsonl":
+        for website, details in entries:
+            file.write(_json_record(website, details) + "\n")
+            count += 1
+    elif file_format == "json":
+        file.write("[")
+        for website, details in entries:
+            file.write(("," if count else "") + "\n" + _json_record(website, details))
+            count += 1
+        file.write("\n]\n")
+    else:
+        raise ValueError(f"Unknown file format: {file_format}")
+    return count
+
+
+def _json_record(website: str, details: dict) -> str:
+    """
+    Serialize one entry for the JSON and JSON Lines exports
+    :param website: website name
+    :param details: dictionary with "email" and "password"
+    :return: JSON object as a string
+    """
+    return json.dumps({"website": website, "email": details["email"], "password": details["password"]},
+                      ensure_ascii=False)
@@ -4,77 +4,238 @@ This module contains a GUI for a password manager that includes classes for mana
 Classes:
 
 ManagerInterface: 
-    This is the main interface for managing passwords. It has methods for searching, saving, generating, encrypting, and decrypting passwords.
+    This is the main interface for managing passwords. It has methods for searching, saving and generating passwords,
+    the vault itself is handled by vault.Vault.
 NewEncryptionInterface: 
-    This interface is used to set up a new encryption key and store it in a hashed file.
+    This interface is used to set up a new encryption key, writing its salt and cost parameters to key_header.json.
 CheckEncryptionInterface: 
-    This interface is used to check if an entered encryption key is the same as the one stored in the file.
+    This interface is used to check an entered encryption key against the check token of key_header.json.
+StatsInterface: 
+    This interface shows the call counts and timings of the instrumented stages of the vault.
+AuditInterface: 
+    This interface lists the accounts flagged by the password audit.
 Methods:
 
 ManagerInterface.search_password(): 
-    This method searches the data file to see if a password has already been stored for a given website.
+    This method shows all the accounts stored for a given website and for the websites sharing its domain.
+ManagerInterface.suggest_websites(): 
+    This method shows a dropdown with the stored websites matching the text typed so far.
+ManagerInterface.show_suggestions(): 
+    This method fills the dropdown under the website entry with the given website names, or hides it.
 ManagerInterface.save_password(): 
-    This method saves a username/email and password for a given website to the data file.
+    This method saves a username/email and password for a given website to the record log.
+ManagerInterface.show_main_window(): 
+    This method builds the main window the first time it is needed, after the login, and shows it.
+ManagerInterface.show_warnings(): 
+    This method warns about the damage found in the journal of the vault.
+ManagerInterface.show_login_window(): 
+    This method asks for the encryption key of the local vault, or for a new one if none has been set up.
+ManagerInterface.agent_lost(): 
+    This method goes back to the login window with a local vault once the unlock agent has locked itself.
+ManagerInterface.mark(): 
+    This method records the end of a startup stage when the startup is profiled.
+ManagerInterface.run_in_background(): 
+    This method runs slow work (key check, decryption, file I/O) on a worker thread and hands the result back to the
+    Tk loop.
 ManagerInterface.generate_password(): 
-    This method generates a random password using a combination of lowercase letters, uppercase letters, numbers, and symbols.
-ManagerInterface.encrypt_data(): 
-    This method encrypts the data in the data file using Fernet encryption from the cryptography module.
-ManagerInterface.decrypt_data(): 
-    This method decrypts the data in the data file using Fernet decryption from the cryptography module.
+    This method generates a random password with the default policy of the generator module.
+ManagerInterface.audit_passwords(): 
+    This method audits the vault for reused and breached passwords in the background and shows the flagged accounts.
 NewEncryptionInterface.encryption_key_setup(): 
-    This method sets up a new encryption key by having the user enter a 32-character alphanumeric and symbol sequence, then hashes and stores it in a file.
+    This method sets up a new encryption key from a passphrase of any length, with a key derivation cost calibrated
+    for the current machine.
 CheckEncryptionInterface.encryption_key_check(): 
-    This method checks if an entered encryption key is the same as the one stored in the hashed file.
+    This method derives the key from the entered passphrase with KeyManager.unlock and checks it against
+    key_header.json.
+StatsInterface.refresh(): 
+    This method updates the table of timings, every STATS_INTERVAL milliseconds while the window is open.
+StatsInterface.toggle(): 
+    This method enables or disables the collection of the timings.
+StatsInterface.copy_profile(): 
+    This method copies the timings and the cache statistics to the clipboard as JSON, to be sent with a bug report.
+Functions:
+
+load_image(): 
+    This function decodes an image file once and shares it between all the windows.
 
-Static Functions:
-
-save_file(): 
-    This function is used to save bytes to a file.
 Constants:
 
 BLACK: A color theme for the GUI.
 LABEL_FONT: Font settings for labels.
 ENTRY_FONT: Font settings for entry boxes.
-LETTERS_LOWER: List of lowercase letters used to generate random passwords.
-LETTERS_UPPER: List of uppercase letters used to generate random passwords.
-NUMBERS: List of numbers used to generate random passwords.
-SYMBOLS: List of symbols used to generate random passwords.
-ENCRYPTION_REQUEST_TEXT: Text displayed in the NewEncryptionInterface window to prompt the user to enter an encryption key.
+STATS_FONT: Font settings for the table of the stats window.
+ENCRYPTION_REQUEST_TEXT: Text displayed in the NewEncryptionInterface window to prompt the user to enter an
+    encryption key.
+POLL_INTERVAL: Number of milliseconds between two checks of a background task, shorter than one 60 Hz frame.
+UNLOCK_TIME: Number of seconds the key derivation of a new key is calibrated to take on the current machine.
+STATS_INTERVAL: Number of milliseconds between two refreshes of the stats window.
+LOGO_FILE: Name of the logo image shown in every window.
 """
 
+# Modules that are slow to import (concurrent.futures, pyperclip, cryptography, bcrypt) are imported only when they
+# are first needed, after the login window is on screen
+import json
+import os
+import time
+from tkinter import Tk, Toplevel, Frame, Canvas, Label, Entry, Button, Listbox, Scrollbar, PhotoImage, messagebox, END
+
+import metrics
+from agent import connect
+from audit import BREACH_FILE_VARIABLE, report_lines, report_summary
+from generator import generate_passwords
+from key_manager import calibrate
+from vault import Vault
+
+BLACK = "#1C1C1C"
+LABEL_FONT = ("Arial", 12, "bold")
+ENTRY_FONT = ("Arial", 12)
+STATS_FONT = ("Courier", 11)
+POLL_INTERVAL = 15
+UNLOCK_TIME = 0.5
+STATS_INTERVAL = 1000
+LOGO_FILE = "logo.png"
+ENCRYPTION_REQUEST_TEXT = "Please enter an encryption key. The key can be a passphrase of any length, " \
+                          "longer passphrases are harder to guess."
+
+
 class ManagerInterface(Tk):
     """ Class creating the main GUI for the password manager
 
     Attributes:
-         authorization_key (string)
-            key used for encryption
+         vault (Vault or AgentClient)
+            headless vault engine holding the key and the decrypted data, or the client of a running unlock agent
+         agent (AgentClient)
+            client of the unlock agent serving the vault, None if no agent is running
+         executor (ThreadPoolExecutor)
+            single worker thread running the vault operations off the Tk event loop, created on first use
+         profile (list)
+            tuples (stage, time.perf_counter()) marking the steps of the startup, None if the startup is not profiled
+         breach_file (str)
+            local breach list used by the audit, from PASSWORD_MANAGER_BREACH_FILE or chosen by the user
          'save_password' (function)
             function saving encrypted data to the file
     """
 
-    def __init__(self):
+    def __init__(self, profile: list = None):
         """
-        Constructor of the ManagerInterface class
+        Constructor of the ManagerInterface class. Only the login window is built at first,
+        the main window is built by show_main_window once the vault is unlocked.
+        :param profile: list receiving the startup marks, the program then exits as soon as the first window is drawn
         """
 
         super().__init__()
+        # Hide the main window, it is shown after the login
+        self.withdraw()
 
         # Set initial values for instance variables
-        self.authorization_key = ""
+        self.profile = profile
+        self.mark("Tk created")
+        # If an unlock agent is running, the vault is already unlocked and is used through the agent
+        self.agent = connect()
+        self.vault = self.agent or Vault()
+        self.executor = None
+        self.busy_tasks = 0
+        self.mainframe = None
+        self.status_label = None
+        self.breach_file = None
+        self.mark("agent checked")
 
         # Set window title, size, and background color
         self.title("Password Manager")
         self.config(pady=20, padx=20, bg=BLACK)
         self.minsize(width=500, height=450)
 
+        if self.agent is not None:
+            # The agent has already unlocked the vault
+            self.show_main_window()
+        else:
+            self.show_login_window()
+        self.mark("first window built")
+
+        if profile is not None:
+            # Idle callbacks run after the pending redraws, so the first window is on screen by then
+            self.after_idle(self._end_profile)
+
+        # Start the main event loop to display the GUI
+        self.mainloop()
+
+        # Let the passwords that are still being saved reach the file
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        self.vault.close()
+
+    def mark(self, stage: str) -> None:
+        """Record the time a startup stage ended, if the startup is profiled"""
+        if self.profile is not None:
+            self.profile.append((stage, time.perf_counter()))
+
+    def _end_profile(self) -> None:
+        """Record the time the first window was drawn and close the program"""
+        self.mark("first window drawn")
+        self.destroy()
+
+    def show_main_window(self) -> None:
+        """Build the main window the first time, then show it with the damage found in the journal, if any"""
+        if self.mainframe is None:
+            self._build_main_window()
+        self.deiconify()
+        self.show_warnings()
+
+    def show_warnings(self) -> None:
+        """Warn about a journal tail dropped after a crash or records that could not be decrypted"""
+        try:
+            warnings = self.vault.warnings()
+        except ConnectionError:
+            self.agent_lost(self.agent)
+            return
+        if warnings:
+            messagebox.showwarning(title="Damaged journal", message="\n\n".join(warnings))
+
+    def show_login_window(self) -> None:
+        """Ask for the encryption key of the local vault, or for a new key if none has been set up"""
+        if self.vault.has_key():
+            # If the key file exists, prompt the user to enter the encryption key
+            CheckEncryptionInterface(self)
+        else:
+            # If the key file doesn't exist, prompt the user to create a new encryption key
+            NewEncryptionInterface(self)
+
+    def agent_lost(self, agent) -> None:
+        """Go back to the login window with a local vault once the agent has locked itself
+
+        The agent exits after its idle timeout, and every request sent to it afterwards
+        fails with a ConnectionError. The main window is hidden until the vault is unlocked
+        again, this time in this process.
+
+        Args:
+            agent (AgentClient): client whose connection was closed by the agent
+
+        Returns:
+            None
+        """
+        if agent is not self.agent:
+            # Another request already noticed it
+            return
+        self.agent.close()
+        self.agent = None
+        self.vault = Vault()
+        if self.mainframe is not None:
+            self.suggestion_list.place_forget()
+        self.withdraw()
+        messagebox.showinfo(title="Vault locked", message="The vault was locked after a period of inactivity. "
+                                                          "Please enter the encryption key again.")
+        self.show_login_window()
+
+    def _build_main_window(self) -> None:
+        """Create the widgets of the main window"""
+
         # Make a frame and having it fill the whole window using pack
         self.mainframe = Frame(self, bg=BLACK)
         self.mainframe.pack(fill="both", expand=True)
 
         # Canvas with a logo
         self.canvas = Canvas(self.mainframe, width=200, height=200, highlightthickness=0, bg=BLACK)
-        image_png = PhotoImage(file="logo.png")
-        self.canvas.create_image(100, 100, image=image_png)
+        self.canvas.create_image(100, 100, image=load_image(LOGO_FILE))
         self.canvas.grid(row=0, column=1)
 
         # Labels
@@ -91,6 +252,11 @@ class ManagerInterface(Tk):
         self.web_entry = Entry(self.mainframe, font=ENTRY_FONT)
         self.web_entry.grid(row=1, column=1, sticky="EW", pady=(10, 10), padx=(0, 10))
         self.web_entry.focus()
+        self.web_entry.bind("<KeyRelease>", self.suggest_websites)
+
+        # Dropdown with the websites matching the text typed so far, placed under the website entry when needed
+        self.suggestion_list = Listbox(self.mainframe, font=ENTRY_FONT, height=6, activestyle="none")
+        self.suggestion_list.bind("<<ListboxSelect>>", self.select_suggestion)
 
         self.email_entry = Entry(self.mainframe, font=ENTRY_FONT)
         self.email_entry.grid(row=2, column=1, columnspan=2, sticky="EW", pady=(10, 10))
@@ -109,6 +275,16 @@ class ManagerInterface(Tk):
         self.search_button = Button(self.mainframe, text="Search", command=self.search_password)
         self.search_button.grid(row=1, column=2, sticky="EW")
 
+        self.stats_button = Button(self.mainframe, text="Stats", command=lambda: StatsInterface(self))
+        self.stats_button.grid(row=4, column=0, sticky="EW", padx=(0, 10))
+
+        self.audit_button = Button(self.mainframe, text="Audit", command=self.audit_passwords)
+        self.audit_button.grid(row=5, column=0, sticky="EW", padx=(0, 10))
+
+        # Busy indicator shown while a background task is running
+        self.status_label = Label(self.mainframe, text="", font=ENTRY_FONT, bg=BLACK, fg="white")
+        self.status_label.grid(row=6, column=0, columnspan=3)
+
         # Add weights to the grid rows and columns
         # Changing the weights will change the size of the rows/columns relative to each other
         self.mainframe.grid_rowconfigure(0, weight=1)
@@ -120,166 +296,232 @@ class ManagerInterface(Tk):
         self.mainframe.grid_columnconfigure(1, weight=1)
         self.mainframe.grid_columnconfigure(2, weight=1)
 
-        try:
-        # Try to open the file 'hashed_key.txt' for reading
-            open('hashed_key.txt', mode='r')
-        except FileNotFoundError:
-        # If the file doesn't exist, prompt the user to create a new encryption key
-            NewEncryptionInterface(self)
-        else:
-        # If the file does exist, prompt the user to enter the encryption key
-            CheckEncryptionInterface(self)
+    def run_in_background(self, work, on_done=None, widgets=(), on_error=None) -> None:
+        """Run slow work on the worker thread without freezing the window
 
-        # Hide the main window
-        self.withdraw()
+        The given widgets are disabled and a busy indicator is shown while the work is in
+        flight. The Tk loop checks the result every POLL_INTERVAL milliseconds with after(),
+        so the callbacks, which may touch the widgets, always run on the Tk thread.
 
-        # Start the main event loop to display the GUI
-        self.mainloop()
+        Args:
+            work (function): function without arguments run on the worker thread
+            on_done (function): called with the result of work
+            widgets (tuple): widgets disabled while the work is running
+            on_error (function): called with the exception raised by work, an error box is shown if None
 
-        # Save the password data to the file
-        self.save_password()
+        Returns:
+            None
+        """
+        if self.executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            self.executor = ThreadPoolExecutor(max_workers=1)
+
+        for widget in widgets:
+            widget.config(state="disabled")
+        self.set_busy(1)
+        future = self.executor.submit(work)
+        self.after(POLL_INTERVAL, self._check_background_task, future, on_done, widgets, on_error, self.agent)
+
+    def _check_background_task(self, future, on_done, widgets, on_error, agent=None) -> None:
+        """Hand the result of a finished background task to its callback, or check again later"""
+        if not future.done():
+            self.after(POLL_INTERVAL, self._check_background_task, future, on_done, widgets, on_error, agent)
+            return
+
+        self.set_busy(-1)
+        for widget in widgets:
+            if widget.winfo_exists():
+                widget.config(state="normal")
+
+        try:
+            result = future.result()
+        except Exception as error:
+            if isinstance(error, ConnectionError) and agent is not None:
+                # The task was sent to an agent that has locked itself in the meantime
+                self.agent_lost(agent)
+            elif on_error is not None:
+                on_error(error)
+            else:
+                messagebox.showerror(title="Error", message=str(error))
+        else:
+            if on_done is not None:
+                on_done(result)
+
+    def set_busy(self, change: int) -> None:
+        """Update the number of running background tasks and the busy indicator of all the windows"""
+        self.busy_tasks += change
+        cursor = "watch" if self.busy_tasks else ""
+        if self.status_label is not None:
+            self.status_label.config(text="Working..." if self.busy_tasks else "")
+        self.config(cursor=cursor)
+        for window in self.winfo_children():
+            if isinstance(window, Toplevel):
+                window.config(cursor=cursor)
 
     def search_password(self) -> None:
         """Check if there is a password saved for a given website
 
         This method gets the website name from the web_entry field in the GUI.
-        It then reads from a file called "data.txt" in the current directory,
-        and attempts to find the saved details for the given website. If found,
-        it shows a message box displaying the saved username and password.
+        It then looks up the accounts of the website, and of the websites sharing its
+        domain ("github" also finds "Github.com"), in the account index of the vault,
+        which answers from memory and reads the data file only when it changed on disk.
+        If any are found, it shows a message box listing every saved username and password.
         If not found, it shows a message box saying no details have been saved.
 
         Returns:
             None
         """
 
-        # Get website name from GUI entry field
+        # Get website name from GUI entry field, then clear it and hide the suggestions
         website = self.web_entry.get()
-
-        try:
-            # Read encrypted data from file
-            with open("data.txt", "rb") as file:
-                data = file.read()
-        except FileNotFoundError:
-            # Show message if file not found
-            messagebox.showinfo(title="File not found", message="No Data File Found")
-        else:
-            # Decrypt the data
-            data = self.decrypt_data(data)
-
-            # Check if website is in the decrypted data
-            if website.capitalize() in data:
-                # Get the stored username and password
-                user_name = data[website.capitalize()]["email"]
-                stored_pass = data[website.capitalize()]["password"]
-
-                # Show the username and password in a message box
-                messagebox.showinfo(title=website, message=f"Username: {user_name} \n"
-                                                           f"Password: {stored_pass} \n")
+        self.web_entry.delete(0, END)
+        self.suggestion_list.place_forget()
+
+        def show_accounts(accounts):
+            # Check if any account matches the website in the decrypted data
+            if accounts:
+                # Show the username and password of every account in a message box
+                messagebox.showinfo(title=website, message="\n".join(
+                    f"{name}\nUsername: {entry['email']} \nPassword: {entry['password']} \n"
+                    for name, entry in accounts))
             else:
                 # Show message if website not found in data
                 messagebox.showinfo(title=website, message="There are no details for this Website yet")
 
-        finally:
-            # Clear the GUI entry field and delete the data variable
+        def show_error(error):
+            if isinstance(error, FileNotFoundError):
+                # Show message if file not found
+                messagebox.showinfo(title="File not found", message="No Data File Found")
+            else:
+                messagebox.showerror(title="Error", message=str(error))
+
+        # Get the stored details from the vault on the worker thread, the file is read only if it changed on disk
+        self.run_in_background(lambda: self.vault.matching_accounts(website), show_accounts,
+                               (self.search_button, self.add_button), show_error)
+
+    def suggest_websites(self, event=None) -> None:
+        """Show the stored websites matching the text typed in the web_entry field
+
+        The matches come from the in-memory search index of the vault as it is, so the
+        data file is not read and the Tk thread never waits for the vault while typing. If
+        the index has to be loaded first, because the file changed on disk or a compaction
+        holds the vault, the vault is loaded on the worker thread and the suggestions are
+        shown once it is ready. The dropdown is hidden when nothing matches and no
+        suggestions are made while a background task holds the vault.
+
+        Returns:
+            None
+        """
+        if self.busy_tasks or (event is not None and event.keysym in ("Return", "Escape")):
+            self.suggestion_list.place_forget()
+            return
+
+        try:
+            matches = self.vault.suggest(self.web_entry.get(), limit=6)
+        except ConnectionError:
+            self.agent_lost(self.agent)
+            return
+        if matches is None:
+            # Suggest again once the worker has loaded the vault, with what has been typed by then
+            self.run_in_background(self.vault.websites,
+                                   lambda _: self.show_suggestions(self.vault.suggest(self.web_entry.get(), limit=6)))
+            return
+        self.show_suggestions(matches)
+
+    def show_suggestions(self, matches) -> None:
+        """Show the given website names in the dropdown under the web_entry field, hide it if there are none"""
+        if not matches:
+            self.suggestion_list.place_forget()
+            return
+
+        self.suggestion_list.delete(0, END)
+        for website in matches:
+            self.suggestion_list.insert(END, website)
+        self.suggestion_list.config(height=len(matches))
+        self.suggestion_list.place(in_=self.web_entry, x=0, rely=1, relwidth=1)
+        self.suggestion_list.lift()
+
+    def select_suggestion(self, event=None) -> None:
+        """Put the website chosen in the dropdown into the web_entry field and hide the dropdown"""
+        selection = self.suggestion_list.curselection()
+        if selection:
             self.web_entry.delete(0, END)
-            del data
+            self.web_entry.insert(0, self.suggestion_list.get(selection[0]))
+        self.suggestion_list.place_forget()
+        self.web_entry.focus()
 
     def generate_password(self) -> None:
         """Generate a random password using letters, numbers and symbols
 
-        This method generates a random password of length between 8 and 10, with
-        2 to 4 symbols and 2 to 4 numbers included. It then shuffles the characters
-        and shows the generated password in the password_entry field in the GUI.
+        This method generates a 16 character password with at least 2 symbols and
+        2 numbers, using the default policy of the generator module, and shows it
+        in the password_entry field in the GUI.
         It also copies the password to the clipboard using pyperclip.
 
         Returns:
             None
         """
 
-        # Generate a list of random characters for the password
-        password_list = [choice(LETTERS_LOWER + LETTERS_UPPER) for _ in range(randint(8, 10))] + \
-                        [choice(SYMBOLS) for _ in range(randint(2, 4))] + \
-                        [choice(NUMBERS) for _ in range(randint(2, 4))]
+        import pyperclip
 
-        # Shuffle the characters and join them into a string
-        shuffle(password_list)
-        password = "".join(password_list)
+        password = generate_passwords(1)[0]
 
         # Clear the password entry field in the GUI, insert the generated password, and copy to clipboard
         self.password_entry.delete(0, END)
         self.password_entry.insert(0, password)
         pyperclip.copy(password)
 
+    def audit_passwords(self) -> None:
+        """Look for reused and breached passwords and show the flagged accounts
+
+        The breach list is a local copy of the Have I Been Pwned SHA-1 list "ordered by hash",
+        taken from the PASSWORD_MANAGER_BREACH_FILE environment variable or chosen once per
+        session. Without it only reused passwords are looked for. The audit runs on the worker
+        thread and its report is shown in an AuditInterface window.
+
+        Returns:
+            None
+        """
+        if self.breach_file is None:
+            self.breach_file = os.environ.get(BREACH_FILE_VARIABLE)
+        if self.breach_file is None:
+            from tkinter import filedialog
+
+            self.breach_file = filedialog.askopenfilename(
+                title="Breach list ordered by hash (cancel to only look for reuse)") or None
+
+        def show_error(error):
+            if isinstance(error, FileNotFoundError):
+                self.breach_file = None
+            messagebox.showerror(title="Audit failed", message=str(error))
+
+        self.run_in_background(lambda: self.vault.audit(self.breach_file), lambda report: AuditInterface(self, report),
+                               (self.audit_button,), show_error)
+
     def save_password(self) -> None:
         """
-        Prepare dictionary containing the username and the password for a given website and save it to json file
+        Save the username and the password for a given website to the vault
         """
         website = self.web_entry.get()
         email = self.email_entry.get()
         password = self.password_entry.get()
 
-        # Create a new dictionary with website, email, and password and format it correctly for the JSON file
-        new_data = {
-            website.capitalize(): {
-                "email": email.lower(),
-                "password": password,
-            }
-        }
-
         # Check if any of the fields are empty, if so, show an error message
         if website == "" or email == "" or password == "":
             messagebox.showinfo(title="Empty Fields", message="One or more of the fields remain empty. Please fill all the fields")
         else:
-            try:
-                # Try to open the data file, and load the existing data
-                with open("data.txt", "rb") as file:
-                    # load old data
-                    data = file.read()
-                # Decrypt the existing data file
-                data = self.decrypt_data(data)
-            except FileNotFoundError:
-                # If no existing data file found, encrypt the new data, save it to a new file, and create that file
-                new_data = self.encrypt_data(new_data)
-                save_file("data.txt", new_data)
-            else:
-                # If there is an existing data file, update the data with the new data and save it to the file
-                data.update(new_data)
-                data = self.encrypt_data(data)
-                save_file("data.txt", data)
-                # Delete the data object
-                del data
-            finally:
-                # Clear all the fields after everything is done
-                self.web_entry.delete(0, END)
-                self.email_entry.delete(0, END)
-                self.email_entry.insert(0, "example@email.com")
-                self.password_entry.delete(0, END)
-
-    def encrypt_data(self, data_file: dict) -> object:
-        """
-        Encrypt data using the authorization key
-        :param data_file: json data
-        :return: encrypted data as an object of Fernet class
-        """
-        # Convert the data_file dictionary into bytes and encrypt it using Fernet with the authorization key
-        data_file = base64.b64encode(str(data_file).encode('utf-8'))
-        data_file = Fernet(base64.b64encode(self.authorization_key)).encrypt(data_file)
-        return data_file
+            # Clear all the fields, the entry is saved in the background
+            self.web_entry.delete(0, END)
+            self.email_entry.delete(0, END)
+            self.email_entry.insert(0, "example@email.com")
+            self.password_entry.delete(0, END)
+
+            # Encrypt only the new entry and append it to the record log on the worker thread
+            self.run_in_background(lambda: self.vault.add(website, email, password),
+                                   widgets=(self.search_button, self.add_button))
+
 
-    def decrypt_data(self, data_file: object) -> dict:
-        """
-        Decrypt given data
-        :param data_file: an encrypted data as a Fernet class object
-        :return: decrypted data as a JSON
-        """
-        # Decrypt the data_file object using Fernet with the authorization key, then convert it back to JSON format
-        data_file = Fernet(base64.b64encode(self.authorization_key)).decrypt(data_file)
-        data_file = base64.b64decode(data_file)
-        data_file = data_file.decode("utf-8").replace("'", "\"")
-        data_file = json.loads(data_file)
-        return data_file
-
-    
 class NewEncryptionInterface:
     """
     Class that creates interface for setting up an encryption key if the user opens the program for the first time.
@@ -302,9 +544,7 @@ class NewEncryptionInterface:
 
         # Logo
         self.top_canvas = Canvas(self.top, height=200, width=200, highlightthickness=0, bg=BLACK)
-        logo_image = PhotoImage(file="logo.png")
-        self.top_canvas.create_image(100, 100, image=logo_image)
-        self.top_canvas.image = logo_image  # added this reference to prevent garbage image collection bug
+        self.top_canvas.create_image(100, 100, image=load_image(LOGO_FILE))
         self.top_canvas.grid(column=0, row=0)
 
         # Request text
@@ -352,8 +592,9 @@ class NewEncryptionInterface:
         self.enter_button.grid(row=7, column=0, pady=(0, 10))
 
     def encryption_key_setup(self):
-        """Check if the entered key matches the confirmatory key and check if the key is 32 bytes long.
-        If it matches the criteria, hash the key and save it to a text file. Finally open the main window"""
+        """Check if the entered key matches the confirmatory key and is not empty.
+        If it matches the criteria, create the key header with a key derivation cost calibrated
+        for this machine. Finally open the main window"""
 
         key_1 = self.password_input.get().encode('utf-8')
         key_2 = self.confirmation_input.get().encode('utf-8')
@@ -363,23 +604,24 @@ class NewEncryptionInterface:
             messagebox.showerror(title='Non-matching keys',
                                  message='The two encryption keys entered do not match. Please enter matching keys.')
 
-        # Check if the entered key is 32 bytes long and raise error if it is not
-        elif len(key_1) != 32:
-            messagebox.showerror(title="Key length error",
-                                 message="The encryption key entered is not 32 bytes long. "
-                                         "Please enter a key comprising 32 alphanumeric characters and simple symbols")
+        # Check if the entered key is empty and raise error if it is
+        elif not key_1:
+            messagebox.showerror(title="Empty key", message="Please enter an encryption key.")
 
-        # If the two keys match and are the right length then we will save a hash of the key and open main window
+        # If the two keys match then we will create the key header and open main window
         else:
-            hashed_key = bcrypt.hashpw(password=key_1, salt=bcrypt.gensalt())  # Create hashed key
-            hashed_key = hashed_key.decode('utf-8')
-            with open('hashed_key.txt', mode='w') as key_file:
-                key_file.write(hashed_key)
+            def set_up_key():
+                parameters, _ = calibrate(UNLOCK_TIME)
+                self.manager.vault.create_key(key_1, parameters)
+                self.manager.vault.open(key_1)
+
+            def open_main_window(result):
+                # Close the key entry window and open the main window
+                self.top.destroy()
+                self.manager.show_main_window()
 
-            self.manager.authorization_key = key_1
-            # Close the key entry window and open the main window
-            self.top.destroy()
-            self.manager.deiconify()
+            # Calibrate and derive the key on the worker thread, the key derivation is slow on purpose
+            self.manager.run_in_background(set_up_key, open_main_window, (self.enter_button,))
 
 
 class CheckEncryptionInterface:
@@ -403,9 +645,7 @@ class CheckEncryptionInterface:
 
         # Logo
         self.top_canvas = Canvas(self.top, height=200, width=200, highlightthickness=0, bg=BLACK)
-        logo_image = PhotoImage(file="logo.png")
-        self.top_canvas.create_image(100, 100, image=logo_image)
-        self.top_canvas.image = logo_image  # added this reference to prevent garbage image collection bug
+        self.top_canvas.create_image(100, 100, image=load_image(LOGO_FILE))
         self.top_canvas.grid(column=0, row=0)
 
         self.welcome_label = Label(self.top,
@@ -427,30 +667,191 @@ class CheckEncryptionInterface:
         self.login_button.grid(row=4, column=0)
 
     def encryption_key_check(self):
-        """Check if the encryption key entered by the user is correct by comparing it to a saved hashed key"""
+        """Check if the encryption key entered by the user is correct: KeyManager.unlock derives the key with the
+        salt and cost parameters of key_header.json and decrypts the check token stored there (vaults of older
+        versions without the header are checked against the bcrypt hash of hashed_key.txt once, then migrated)"""
 
         key_1 = self.password_input.get().encode('utf-8')
-        with open('hashed_key.txt', mode='r') as key_file:
-            hashed_key = key_file.read()
-            hashed_key = hashed_key.encode('utf-8')
-
-        # Check if the key matches the saved key and if correct then open the main window
-        if bcrypt.checkpw(key_1, hashed_key):
-            self.manager.authorization_key = key_1
-            self.top.destroy()
-            self.manager.deiconify()
-        # If key is incorrect then raise error
-        else:
-            messagebox.showerror(title='Incorrect key', message='The encryption key entered is incorrect. '
-                                                                'Please try again.')
 
+        def unlock():
+            # Check if the key matches the saved key and if correct then open the vault and load it once,
+            # so that the following searches are answered from memory
+            if not self.manager.vault.check_key(key_1):
+                return False
+            self.manager.vault.open(key_1)
+            self.manager.vault.websites()
+            return True
+
+        def open_main_window(unlocked):
+            # If the key is correct then open the main window
+            if unlocked:
+                self.top.destroy()
+                self.manager.show_main_window()
+            # If key is incorrect then raise error
+            else:
+                messagebox.showerror(title='Incorrect key', message='The encryption key entered is incorrect. '
+                                                                    'Please try again.')
+
+        # The key check and the decryption run on the worker thread so that the window stays responsive
+        self.manager.run_in_background(unlock, open_main_window, (self.login_button,))
+
+
+class StatsInterface:
+    """Class that creates the window showing where the time of the session goes
+
+    The table lists, for every instrumented stage of the vault (key derivation, decryption,
+    decoding, file reads, journal appends...), the number of calls, the cumulative time,
+    the p50 and p99 durations and the bytes processed. It is refreshed every STATS_INTERVAL
+    milliseconds while the window is open.
 
-def save_file(file_name: str, data_file: object) -> None:
+    Attributes:
+        manager (object)
+            object of the main window class
     """
-    Function that saves data to a file
-    :param file_name: string containing name of the file to be saved
-    :param data_file: object containing encrypted data
+
+    def __init__(self, mng_interface: ManagerInterface):
+        """
+        Constructor of the class
+        :param mng_interface: object of the main window class
+        """
+
+        self.manager = mng_interface
+        self.top = Toplevel()
+        self.top.title("Stats")
+        self.top.config(padx=20, pady=20, bg=BLACK)
+        self.top.protocol("WM_DELETE_WINDOW", self.close)
+        self.refresh_job = None
+
+        self.table_label = Label(self.top, text="", font=STATS_FONT, bg=BLACK, fg="white", justify="left")
+        self.table_label.grid(row=0, column=0, columnspan=3, sticky="W", pady=(0, 10))
+
+        self.toggle_button = Button(self.top, text="", command=self.toggle)
+        self.toggle_button.grid(row=1, column=0, sticky="EW")
+
+        self.reset_button = Button(self.top, text="Reset", command=metrics.METRICS.reset)
+        self.reset_button.grid(row=1, column=1, sticky="EW")
+
+        self.copy_button = Button(self.top, text="Copy as JSON", command=self.copy_profile)
+        self.copy_button.grid(row=1, column=2, sticky="EW")
+
+        self.refresh()
+
+    def profile(self) -> dict:
+        """Collect the timings of the stages with the cache statistics and the journal recovery of the vault"""
+        cache = self.manager.vault.cache
+        return {
+            "stages": metrics.snapshot(),
+            "cache": dict(cache.stats) if cache is not None else None,
+            "recovery": self.manager.vault.recovery,
+        }
+
+    def refresh(self) -> None:
+        """Update the table of timings and schedule the next refresh"""
+        lines = metrics.table_lines()
+        if len(lines) == 1:
+            lines.append("No measurements yet" if metrics.METRICS.enabled else "Timings are disabled")
+
+        profile = self.profile()
+        if profile["cache"] is not None:
+            cache = profile["cache"]
+            lines.append("")
+            lines.append(f"cache: {cache['hits']} hits, {cache['misses']} loads, {cache['reloads']} reloads, "
+                         f"last load {cache['load_seconds'] * 1000:.1f} ms")
+        if profile["recovery"] is not None:
+            recovery = profile["recovery"]
+            lines.append(f"journal: {recovery['records']} records replayed in {recovery['seconds'] * 1000:.1f} ms")
+
+        self.table_label.config(text="\n".join(lines))
+        self.toggle_button.config(text="Disable timings" if metrics.METRICS.enabled else "Enable timings")
+        self.refresh_job = self.top.after(STATS_INTERVAL, self.refresh)
+
+    def toggle(self) -> None:
+        """Enable or disable the collection of the timings"""
+        if metrics.METRICS.enabled:
+            metrics.METRICS.disable()
+        else:
+            metrics.METRICS.enable()
+        self.top.after_cancel(self.refresh_job)
+        self.refresh()
+
+    def copy_profile(self) -> None:
+        """Copy the timings and the cache statistics to the clipboard as JSON"""
+        import pyperclip
+
+        pyperclip.copy(json.dumps(self.profile(), indent=4))
+        messagebox.showinfo(title="Stats", message="The profile has been copied to the clipboard")
+
+    def close(self) -> None:
+        """Stop the refreshes and close the window"""
+        if self.refresh_job is not None:
+            self.top.after_cancel(self.refresh_job)
+        self.top.destroy()
+
+
+class AuditInterface:
+    """Class that creates the window listing the accounts flagged by the password audit
+
+    Passwords used by more than one account are listed by group, then the accounts whose
+    password was found in the breach list, most seen first. The passwords themselves are
+    not shown.
+
+    Attributes:
+        manager (object)
+            object of the main window class
+        report (dict)
+            report of Vault.audit
     """
 
-    with open(f"{file_name}", "wb") as file:
-        file.write(data_file)
+    def __init__(self, mng_interface: ManagerInterface, report: dict):
+        """
+        Constructor of the class
+        :param mng_interface: object of the main window class
+        :param report: report of Vault.audit
+        """
+
+        self.manager = mng_interface
+        self.report = report
+        self.top = Toplevel()
+        self.top.title("Audit")
+        self.top.config(padx=20, pady=20, bg=BLACK)
+
+        self.summary_label = Label(self.top, font=ENTRY_FONT, bg=BLACK, fg="white", justify="left",
+                                   text=report_summary(report, self.manager.breach_file))
+        self.summary_label.grid(row=0, column=0, columnspan=2, sticky="W", pady=(0, 10))
+
+        self.flagged_list = Listbox(self.top, font=STATS_FONT, width=70, height=20, activestyle="none")
+        self.flagged_list.grid(row=1, column=0, sticky="NSEW")
+        self.scrollbar = Scrollbar(self.top, command=self.flagged_list.yview)
+        self.scrollbar.grid(row=1, column=1, sticky="NS")
+        self.flagged_list.config(yscrollcommand=self.scrollbar.set)
+
+        for line in self.lines():
+            self.flagged_list.insert(END, line)
+
+        self.close_button = Button(self.top, text="Close", command=self.top.destroy)
+        self.close_button.grid(row=2, column=0, columnspan=2, sticky="EW", pady=(10, 0))
+
+    def lines(self) -> list:
+        """Turn the report into the lines of the list of flagged accounts"""
+        return report_lines(self.report) or ["No reused or breached passwords found"]
+
+
+_IMAGES = {}
+
+
+def load_image(file_name: str) -> PhotoImage:
+    """Decode an image file the first time it is needed and share it between all the windows
+
+    The cache also keeps a reference to every image, so Tk does not lose an image
+    that is still shown when the PhotoImage object would otherwise be garbage collected.
+
+    Args:
+        file_name (str): name of the image file
+
+    Returns:
+        PhotoImage: decoded image
+    """
+    image = _IMAGES.get(file_name)
+    if image is None:
+        image = _IMAGES[file_name] = PhotoImage(file=file_name)
+    return image
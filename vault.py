@@ -0,0 +1,827 @@
+"""
+This module contains the headless vault engine of the password manager. It does not import tkinter, so it can be
+used from the GUI, the command line interface, scripts and benchmarks alike.
+
+Classes:
+
+Vault:
+    This class checks the passphrase, opens the data files and answers lookups from memory.
+VaultCache:
+    This class keeps the decrypted vault in memory for the session and reloads it only if the data files change on disk.
+Methods:
+
+Vault.create_key():
+    This method creates the key header for a new passphrase.
+Vault.check_key():
+    This method checks if an entered passphrase is correct, deriving the session cipher on the way.
+Vault.open():
+    This method opens the chunked snapshot and the record log, migrating the data of older versions the first time.
+Vault.compact():
+    This method folds the record log into a new chunked snapshot.
+Vault.close():
+    This method syncs the record log and waits for a running compaction.
+Vault.change_key_parameters():
+    This method re-encrypts the vault with a new salt and new key derivation cost parameters.
+Vault.get():
+    This method returns the email and password of one account of a website, decrypting one chunk if the vault is not
+    loaded.
+Vault.accounts():
+    This method returns all the accounts stored for a website.
+Vault.matching_accounts():
+    This method returns the accounts of all the websites sharing the domain of a website name.
+Vault.accounts_for_email():
+    This method returns the accounts using an email, on every website.
+Vault.add():
+    This method saves an email and password for a website, next to the other accounts of the website.
+Vault.delete():
+    This method deletes one account of a website.
+Vault.add_many():
+    This method saves many already normalised entries with a single write.
+Vault.entries():
+    This method iterates over all the stored entries sorted by website.
+Vault.websites():
+    This method returns the names of all the stored websites.
+Vault.search():
+    This method returns the stored website names matching a prefix.
+Vault.suggest():
+    This method returns the stored website names matching a prefix without waiting for the vault, for the GUI thread.
+Vault.audit():
+    This method finds the passwords used by more than one account and the ones found in a breach list.
+Vault.warnings():
+    This method describes the damage found in the record log, to be shown to the user.
+Vault.decrypt_data():
+    This method decrypts the data with the session cipher and reads it in the versioned or legacy format.
+VaultCache.get():
+    This method returns the decrypted vault, loading it again only if the data files were changed by something else.
+VaultCache.lookup():
+    This method finds the accounts of one website, from memory if the vault is loaded or else from the record log and
+    one chunk.
+VaultCache.accounts_for_email():
+    This method finds the accounts using an email with the account index.
+VaultCache.accounts_for_domain():
+    This method finds the accounts of the websites sharing a domain with the account index.
+VaultCache.websites():
+    This method returns the names of all the stored websites.
+VaultCache.items():
+    This method returns a copy of all the entries, made under the lock.
+VaultCache.put():
+    This method appends a single entry, or the deletion of an account, to the record log and updates the cached copy.
+VaultCache.put_many():
+    This method appends many entries to the record log in a single write and updates the cached copy.
+VaultCache.search():
+    This method returns the stored website names matching a prefix, using the in-memory search index.
+VaultCache.suggest():
+    This method searches the in-memory index as it is, without taking the lock if it is held or reading the files.
+VaultCache.compact():
+    This method writes the whole vault to a new chunked snapshot and drops the folded records from the record log.
+VaultCache.compact_in_background():
+    This method starts a compaction on a background thread, unless one is already running.
+VaultCache.wait_for_compaction():
+    This method waits for the compaction running in the background, if any, to finish.
+VaultCache.needs_compaction():
+    This method checks if the record log has grown enough to be folded into the snapshot.
+VaultCache.close():
+    This method waits for a running compaction and syncs and closes the data files.
+
+Constants:
+
+KEY_FILE: Name of the file with the bcrypt hash of the key, written by older versions.
+HEADER_FILE: Name of the key header with the salt and the key derivation parameters.
+DATA_FILE: Name of the record log with the entries changed since the last snapshot.
+SNAPSHOT_FILE: Name of the chunked snapshot of the vault.
+COMPACTION_BYTES: Size of the record log from which it is folded into the snapshot in the background.
+LEGACY_DATA_FILE: Name of the single-blob data file written by older versions.
+"""
+
+import os
+import threading
+import time
+
+from account_index import AccountIndex
+from audit import audit_entries
+from chunked_store import ChunkedVaultFile
+from codec import decode_vault
+from entry import Entry
+from key_manager import KeyManager, LEGACY_PARAMETERS
+from metrics import METRICS, measure
+from record_store import RecordStore
+from search_index import SearchIndex
+
+KEY_FILE = "hashed_key.txt"
+HEADER_FILE = "key_header.json"
+DATA_FILE = "data.log"
+SNAPSHOT_FILE = "data.pmv"
+COMPACTION_BYTES = 64 * 1024
+LEGACY_DATA_FILE = "data.txt"
+
+
+class Vault:
+    """Class with the password manager logic, independent of any user interface
+
+    Attributes:
+        directory (string)
+            directory holding the key file and the data files
+        keys (KeyManager)
+            key manager deriving the session cipher from the passphrase
+        cipher (Fernet)
+            session cipher, derived once by check_key or open
+        cache (VaultCache)
+            decrypted vault kept in memory for the session, created by open
+        recovery (dict)
+            records found in the record log when it was opened, bytes dropped after a crash and seconds taken
+    """
+
+    def __init__(self, directory: str = "."):
+        """
+        Constructor of the Vault class
+        :param directory: directory holding the key file and the data files
+        """
+        self.directory = directory
+        self.keys = KeyManager(self._path(HEADER_FILE))
+        self.cipher = None
+        self.cache = None
+        self.recovery = None
+
+    def has_key(self) -> bool:
+        """
+        Check if an encryption key has already been set up
+        :return: True if the key header or the key file of an older version exists
+        """
+        return self.keys.exists() or os.path.exists(self._path(KEY_FILE))
+
+    def create_key(self, key: bytes, parameters: dict = None) -> None:
+        """
+        Create the key header for a new passphrase
+        :param key: passphrase entered by the user, of any length
+        :param parameters: key derivation cost parameters, for example from key_manager.calibrate
+        """
+        self.cipher = self.keys.create(key, parameters)
+
+    def check_key(self, key: bytes) -> bool:
+        """
+        Check if the passphrase is correct. The session cipher is derived on the way and reused by open.
+        :param key: passphrase entered by the user
+        :return: True if the passphrase is correct
+        """
+        if self.keys.exists():
+            return self.keys.unlock(key) is not None
+
+        # Vaults set up by older versions only have a bcrypt hash of the key
+        import bcrypt
+
+        with open(self._path(KEY_FILE), mode="r") as key_file:
+            hashed_key = key_file.read().encode("utf-8")
+        with measure("bcrypt_check"):
+            correct = bcrypt.checkpw(key, hashed_key)
+        if correct:
+            # open checks the key again before it writes the key header, bcrypt is slow on purpose
+            self.keys.remember(key)
+        return correct
+
+    def open(self, key: bytes) -> None:
+        """
+        Open the chunked snapshot and the record log of the changes made since, and create the vault cache for them.
+        Data of older versions, encrypted with the raw key, is re-encrypted with the derived key the first time, and
+        if only the old single-blob data file exists its entries are migrated. A record log that grew large is
+        folded into a new snapshot.
+        :param key: passphrase, already checked with check_key
+        :raises ValueError: if the passphrase is wrong
+        """
+        if not self.keys.exists():
+            # The key header of an older vault is written only once the passphrase matched its bcrypt hash, a header
+            # derived from a wrong passphrase would lock the right one out
+            if os.path.exists(self._path(KEY_FILE)) and not (self.keys.remembers(key) or self.check_key(key)):
+                raise ValueError("The encryption key entered is incorrect")
+            self.keys.create(key, previous=LEGACY_PARAMETERS)
+        self.cipher = self.keys.unlock(key)
+        if self.cipher is None:
+            raise ValueError("The encryption key entered is incorrect")
+
+        store = RecordStore(self._path(DATA_FILE), self.cipher)
+        store.migrate(self._path(LEGACY_DATA_FILE), self.decrypt_data)
+        self.recovery = store.recover()
+        self.cache = VaultCache(store, ChunkedVaultFile(self._path(SNAPSHOT_FILE), self.cipher))
+
+        if self.keys.migrating:
+            # Some data may still be encrypted with the previous key material, the snapshot is written with the new one
+            self.cache.compact()
+            self.keys.finish_migration()
+            self._use_cipher(self.keys.cipher)
+        elif self.cache.needs_compaction():
+            self.cache.compact_in_background()
+
+    def change_key_parameters(self, key: bytes, parameters: dict) -> None:
+        """
+        Re-encrypt the vault with a new salt and new key derivation cost parameters
+        :param key: passphrase of the opened vault
+        :param parameters: key derivation cost parameters, for example from key_manager.calibrate
+        """
+        self.cache.wait_for_compaction()
+        try:
+            self.cache.get()
+        except FileNotFoundError:
+            pass
+        self._use_cipher(self.keys.create(key, parameters, previous=self.keys.parameters()))
+        self.cache.compact()
+        self.keys.finish_migration()
+        self._use_cipher(self.keys.cipher)
+
+    def compact(self) -> None:
+        """
+        Fold the record log into a new chunked snapshot
+        """
+        self.cache.compact()
+
+    def close(self) -> None:
+        """
+        Sync the records still waiting for fsync and wait for a running compaction, before the program exits
+        """
+        if self.cache is not None:
+            self.cache.close()
+
+    def _use_cipher(self, cipher) -> None:
+        """
+        Make the vault, the record log and the snapshot use a new session cipher
+        :param cipher: session cipher
+        """
+        self.cipher = self.cache.store.cipher = self.cache.snapshot.cipher = cipher
+
+    def get(self, website: str, email: str = None):
+        """
+        Find the details of one account of a website. If the vault has not been loaded into memory, only the record
+        log and the snapshot chunk of the website are decrypted.
+        :param website: website name as typed by the user
+        :param email: email or username of the account, in any case. If None, the first account by email is returned.
+        :return: Entry with the email and password, or None if no such account is stored for the website
+        :raises FileNotFoundError: if there is no data file yet
+        """
+        for entry in self.accounts(website):
+            if email is None or entry.email.lower() == email.lower():
+                return entry
+        return None
+
+    def accounts(self, website: str) -> list:
+        """
+        Find all the accounts stored for a website, decrypting at most one chunk if the vault is not loaded
+        :param website: website name as typed by the user
+        :return: list of Entry sorted by email, empty if nothing is stored for the website
+        :raises FileNotFoundError: if there is no data file yet
+        """
+        return self.cache.lookup(website.capitalize())
+
+    def matching_accounts(self, website: str) -> list:
+        """
+        Find the accounts of all the websites sharing the domain of a website name, so that "github", "Github.com"
+        and "Www.github.com" are shown together
+        :param website: website name or address as typed by the user
+        :return: list of tuples (website, Entry), the accounts of the website as typed first
+        :raises FileNotFoundError: if there is no data file yet
+        """
+        return self.cache.accounts_for_domain(website.capitalize())
+
+    def accounts_for_email(self, email: str) -> list:
+        """
+        Find the accounts using an email, on every website
+        :param email: email or username, in any case
+        :return: list of tuples (website, Entry) sorted by website
+        :raises FileNotFoundError: if there is no data file yet
+        """
+        return self.cache.accounts_for_email(email)
+
+    def add(self, website: str, email: str, password: str) -> None:
+        """
+        Save the email and password of an account of a website, replacing the password stored before for the same
+        email. The other accounts of the website are kept.
+        :param website: website name, stored capitalized
+        :param email: email or username, stored lower-cased
+        :param password: password
+        :raises ValueError: if one of the fields is empty
+        """
+        if not website or not email or not password:
+            raise ValueError("The website, the email and the password cannot be empty")
+        entry = Entry(email.lower(), password)
+        self.cache.put((website.capitalize(), entry.email), entry)
+
+    def delete(self, website: str, email: str) -> bool:
+        """
+        Delete one account of a website. A tombstone is appended to the record log, the account is dropped from the
+        snapshot by the next compaction.
+        :param website: website name as typed by the user
+        :param email: email or username of the account, in any case
+        :return: True if the account was deleted, False if it is not stored
+        :raises FileNotFoundError: if there is no data file yet
+        """
+        website = website.capitalize()
+        entry = self.get(website, email)
+        if entry is None:
+            return False
+        self.cache.put((website, entry.email), None)
+        return True
+
+    def add_many(self, entries) -> None:
+        """
+        Save many entries at once, with a single write to the record log
+        :param entries: iterable of tuples (website, Entry or {"email": ..., "password": ...}), or a dictionary
+                        {website: details} with one account per website, already normalised
+        """
+        if isinstance(entries, dict):
+            entries = entries.items()
+        accounts = {}
+        for website, details in entries:
+            entry = Entry.from_dict(details)
+            accounts[(website, entry.email)] = entry
+        self.cache.put_many(accounts)
+
+    def entries(self):
+        """
+        Iterate over all the stored entries
+        :return: iterator of tuples (website, Entry) sorted by website and email,
+                 empty if there is no data file yet
+        """
+        try:
+            data = self.cache.get()
+        except FileNotFoundError:
+            return iter(())
+        return ((account[0], data[account]) for account in sorted(data))
+
+    def websites(self) -> list:
+        """
+        Get the names of all the stored websites
+        :return: sorted list of website names, empty if there is no data file yet
+        """
+        try:
+            return self.cache.websites()
+        except FileNotFoundError:
+            return []
+
+    def search(self, prefix: str, limit: int = 10) -> list:
+        """
+        Find the stored website names matching the typed text
+        :param prefix: text typed by the user
+        :param limit: maximum number of names returned
+        :return: list of website names, best matches first
+        """
+        try:
+            return self.cache.search(prefix, limit)
+        except FileNotFoundError:
+            return []
+
+    def suggest(self, prefix: str, limit: int = 10):
+        """
+        Find the stored website names matching the typed text from the search index as it is, without loading the
+        vault or waiting for a compaction, so it can be called from the GUI thread on every keystroke
+        :param prefix: text typed by the user
+        :param limit: maximum number of names returned
+        :return: list of website names, best matches first, or None if the index has to be loaded first
+        """
+        try:
+            return self.cache.suggest(prefix, limit)
+        except FileNotFoundError:
+            return []
+
+    def audit(self, breach_file: str = None) -> dict:
+        """
+        Find the passwords used by more than one account in one pass over the vault and, if a breach list is given,
+        the passwords found in it
+        :param breach_file: name of a local breach list in the Have I Been Pwned "ordered by hash" format, None to
+                            only look for reuse
+        :return: report of audit.audit_entries, with the reused and breached accounts and the passwords per second
+        :raises FileNotFoundError: if the breach list does not exist
+        """
+        try:
+            items = self.cache.items()
+        except FileNotFoundError:
+            items = []
+        return audit_entries(((website, entry) for (website, _), entry in items), breach_file)
+
+    def warnings(self) -> list:
+        """
+        Describe the damage found in the record log: a tail dropped by the recovery after a crash, and records that
+        did not decrypt and were skipped when the log was read
+        :return: list of messages, empty if the record log is intact
+        """
+        messages = []
+        if self.recovery is not None and self.recovery["dropped_bytes"]:
+            messages.append(f"{self.recovery['dropped_bytes']} bytes left damaged at the end of the journal by a crash "
+                            f"were dropped, the last changes made before it may be lost.")
+        if self.cache is not None and self.cache.store.invalid_records:
+            messages.append(f"Records of the journal that could not be decrypted were skipped: "
+                            f"{self.cache.store.invalid_records}.")
+        return messages
+
+    def decrypt_data(self, data_file: bytes) -> dict:
+        """
+        Decrypt given data
+        :param data_file: encrypted data as a Fernet token
+        :return: decrypted data as a dictionary
+        """
+        # Decrypt the data_file object with the cipher derived at login, then deserialize it
+        # (files written by older versions are recognised and read in the legacy format)
+        return decode_vault(self.cipher.decrypt(data_file))
+
+    def _path(self, file_name: str) -> str:
+        """
+        Get the path of a file in the vault directory
+        :param file_name: name of the file
+        :return: path of the file
+        """
+        return os.path.join(self.directory, file_name)
+
+
+class VaultCache:
+    """Class keeping the decrypted vault in memory for the session
+
+    The vault is made of a chunked snapshot and a record log of the entries changed since
+    the snapshot was written. Entries are keyed by account, a tuple (website, email), and
+    the account index finds the accounts of a website, of an email or of a domain without
+    scanning the vault. It is decrypted once and then served from memory. Before
+    every use the modification times and sizes of both files are compared with the ones
+    seen at the last load, so they are read again only if something else changed them.
+    Until the vault is loaded, single lookups decrypt only one chunk of the snapshot and
+    the records of the log they have not seen yet: the decrypted records are kept by
+    website, and as the log only grows by appends until a compaction replaces it, the next
+    lookups read only the records appended since. All the methods hold a lock, so the cache can be used from a worker
+    thread.
+
+    When the record log grows past COMPACTION_BYTES it is folded into a new snapshot on a
+    background thread. The threshold does not grow with the vault, as every cold lookup of a
+    new process decrypts the whole log. The lock is only held to copy the
+    vault and to swap the files in, not while the snapshot is encrypted and written.
+
+    Attributes:
+        store (RecordStore)
+            record log holding the entries changed since the snapshot
+        snapshot (ChunkedVaultFile)
+            chunked snapshot of the vault
+        stats (dict)
+            number of cache hits, misses (first loads), reloads, lookups made without loading the vault and
+            compactions, with the seconds taken by the last load (snapshot and record log replay) and compaction
+        index (SearchIndex)
+            prefix and trigram index over the website names, rebuilt on every load
+        accounts (AccountIndex)
+            index of the accounts by website, email and domain, rebuilt on every load and updated on every put
+    """
+
+    def __init__(self, store: RecordStore, snapshot: ChunkedVaultFile):
+        """
+        Constructor of the VaultCache class
+        :param store: record log holding the entries changed since the snapshot
+        :param snapshot: chunked snapshot of the vault
+        """
+        self.store = store
+        self.snapshot = snapshot
+        self.stats = {"hits": 0, "misses": 0, "reloads": 0, "point_lookups": 0, "compactions": 0,
+                      "load_seconds": 0.0, "compaction_seconds": 0.0}
+        self.index = None
+        self.accounts = None
+        self._data = None
+        self._signature = None
+        self._journal = None
+        self._journal_position = None
+        self._journal_snapshot = None
+        self._compactor = None
+        self._lock = threading.RLock()
+
+    def get(self) -> dict:
+        """
+        Return the decrypted vault, reading the data files only if they changed since the last load
+        :return: decrypted data as a dictionary {(website, email): Entry}
+        :raises FileNotFoundError: if there is no data file yet
+        """
+        with self._lock:
+            signature = self._file_signature()
+            if self._data is not None and signature == self._signature:
+                self.stats["hits"] += 1
+                return self._data
+
+            if self._data is None:
+                self.stats["misses"] += 1
+            else:
+                self.stats["reloads"] += 1
+
+            start = time.perf_counter()
+            with measure("vault_load"):
+                data = self.snapshot.load() if signature[0] is not None else {}
+                accounts = AccountIndex(data)
+                if signature[1] is not None:
+                    # Entries in the record log are newer than the ones in the snapshot
+                    for account, entry in self.store.load().items():
+                        _apply(data, accounts, account, entry)
+            self.stats["load_seconds"] = time.perf_counter() - start
+            self._data = data
+            # Lookups are answered from memory from now on
+            self._journal = self._journal_position = None
+            self.accounts = accounts
+            self.index = SearchIndex(accounts.sites)
+            self._signature = signature
+            return self._data
+
+    def lookup(self, website: str) -> list:
+        """
+        Find the accounts of one website. They come from memory if the vault has been loaded, otherwise from the
+        snapshot chunk holding the website and the record log.
+        :param website: website name as stored in the vault
+        :return: list of Entry sorted by email, empty if the website is not stored
+        :raises FileNotFoundError: if there is no data file yet
+        """
+        with self._lock, measure("lookup"):
+            if self._data is not None:
+                data = self.get()
+                return [data[(website, email)] for email in self.accounts.emails(website)]
+
+            snapshot_signature, log_signature = self._file_signature()
+            self.stats["point_lookups"] += 1
+            found = self.snapshot.lookup(website) if snapshot_signature is not None else {}
+            records = self._journal_records(website, snapshot_signature) if log_signature is not None else {}
+            for account, entry in records.items():
+                if isinstance(account, str):
+                    # Records of older versions replace every account of their website
+                    found = {(website, entry.email): entry}
+                elif entry is None:
+                    found.pop(account, None)
+                else:
+                    found[account] = entry
+            return [found[account] for account in sorted(found)]
+
+    def accounts_for_email(self, email: str) -> list:
+        """
+        Find the accounts using an email with the account index, loading the vault if needed
+        :param email: email or username, in any case
+        :return: list of tuples (website, Entry) sorted by website
+        :raises FileNotFoundError: if there is no data file yet
+        """
+        with self._lock, measure("index_lookup"):
+            data = self.get()
+            email = email.lower()
+            return [(website, data[(website, stored)]) for website in self.accounts.websites_for_email(email)
+                    for stored in self.accounts.emails(website) if stored.lower() == email]
+
+    def accounts_for_domain(self, website: str) -> list:
+        """
+        Find the accounts of the websites sharing the normalised domain of a website name with the account index,
+        loading the vault if needed
+        :param website: website name or address
+        :return: list of tuples (website, Entry), the accounts of the website itself first
+        :raises FileNotFoundError: if there is no data file yet
+        """
+        with self._lock, measure("index_lookup"):
+            data = self.get()
+            websites = self.accounts.websites_for_domain(website)
+            if website in websites:
+                websites.remove(website)
+                websites.insert(0, website)
+            return [(name, data[(name, email)]) for name in websites for email in self.accounts.emails(name)]
+
+    def websites(self) -> list:
+        """
+        Get the names of all the stored websites
+        :return: sorted list of website names
+        :raises FileNotFoundError: if there is no data file yet
+        """
+        with self._lock:
+            self.get()
+            return sorted(self.accounts.sites)
+
+    def items(self) -> list:
+        """
+        Get a copy of all the entries, made under the lock so that puts from other threads do not change it while
+        it is read
+        :return: list of tuples ((website, email), Entry)
+        :raises FileNotFoundError: if there is no data file yet
+        """
+        with self._lock:
+            return list(self.get().items())
+
+    def put(self, account: tuple, entry) -> None:
+        """
+        Append a single entry to the record log and update the cached copy
+        :param account: tuple (website, email) used as the key of the entry
+        :param entry: Entry, or None to delete the account
+        """
+        self.put_many({account: entry})
+
+    def put_many(self, entries: dict) -> None:
+        """
+        Append many entries to the record log in a single write and update the cached copy and the indexes, if the
+        vault is loaded
+        :param entries: dictionary {(website, email): Entry, or None to delete the account}
+        """
+        with self._lock:
+            if self._data is None:
+                # Nothing is cached yet, so the entries only have to reach the record log
+                self._append(entries)
+            else:
+                try:
+                    # Make sure the cached copy includes changes made by something else before adding to it
+                    data = self.get()
+                except FileNotFoundError:
+                    data = {}
+                    self.accounts = AccountIndex()
+                    self.index = SearchIndex()
+                self._append(entries)
+                for account, entry in entries.items():
+                    _apply(data, self.accounts, account, entry)
+                    if entry is not None:
+                        self.index.add(account[0])
+                    elif account[0] not in self.accounts:
+                        self.index.remove(account[0])
+                self._data = data
+                self._signature = self._file_signature()
+        if self.needs_compaction():
+            self.compact_in_background()
+
+    def search(self, prefix: str, limit: int = 10) -> list:
+        """
+        Find the stored website names matching the typed text without reading the data files
+        (unless they were changed by something else)
+        :param prefix: text typed by the user
+        :param limit: maximum number of names returned
+        :return: list of website names, best matches first
+        :raises FileNotFoundError: if there is no data file yet
+        """
+        with self._lock, measure("search"):
+            self.get()
+            return self.index.search(prefix, limit)
+
+    def suggest(self, prefix: str, limit: int = 10):
+        """
+        Find the stored website names matching the typed text in the search index as it is. The lock is not waited
+        for and the data files are not read: if another thread holds the lock, or if the index is missing or older
+        than the files, the caller has to load the vault (with search or websites) off its own thread first.
+        :param prefix: text typed by the user
+        :param limit: maximum number of names returned
+        :return: list of website names, best matches first, or None if the index cannot be used right now
+        :raises FileNotFoundError: if there is no data file yet
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            # Without any data file there is nothing to load, FileNotFoundError tells the caller so
+            signature = self._file_signature()
+            if self.index is None or signature != self._signature:
+                return None
+            with measure("search"):
+                return self.index.search(prefix, limit)
+        finally:
+            self._lock.release()
+
+    def compact(self) -> None:
+        """
+        Write the whole vault to a new chunked snapshot, encrypted with the current cipher, and drop the folded
+        records from the record log. The snapshot is renamed into place before the record log is cut, so after a
+        crash in between the records are only replayed twice, which gives the same vault.
+        """
+        self.wait_for_compaction()
+        self._compact()
+
+    def compact_in_background(self) -> bool:
+        """
+        Start a compaction on a background thread. The thread is not a daemon, so the program waits for it to finish
+        before exiting.
+        :return: True if a compaction was started, False if one is already running
+        """
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return False
+            self._compactor = threading.Thread(target=self._compact, name="vault-compactor")
+            self._compactor.start()
+            return True
+
+    def needs_compaction(self) -> bool:
+        """
+        Check if the record log has grown enough to be folded into the snapshot
+        :return: True if the record log is larger than COMPACTION_BYTES
+        """
+        return self.store.size() > COMPACTION_BYTES
+
+    def wait_for_compaction(self) -> None:
+        """
+        Wait for a compaction running on the background thread to finish
+        """
+        compactor = self._compactor
+        if compactor is not None and compactor is not threading.current_thread():
+            compactor.join()
+
+    def close(self) -> None:
+        """
+        Wait for a running compaction, then sync and close the record log and release the snapshot
+        """
+        self.wait_for_compaction()
+        with self._lock:
+            self.store.close()
+            self.snapshot.close()
+
+    def _compact(self) -> None:
+        """
+        Fold the record log into a new snapshot. The vault is copied under the lock, the snapshot is encrypted and
+        written without it, and the lock is taken again to swap the files in.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            try:
+                # Entries are replaced and never changed in place, so a shallow copy is enough
+                data = dict(self.get())
+            except FileNotFoundError:
+                return
+            offset = self.store.size()
+
+        temp_file_name = self.snapshot.write_temp(data)
+
+        with self._lock:
+            current = self._file_signature() == self._signature
+            self.snapshot.install(temp_file_name)
+            # Records appended while the snapshot was written are kept
+            self.store.drop_head(offset)
+            if current:
+                self._signature = self._file_signature()
+            self.stats["compactions"] += 1
+            self.stats["compaction_seconds"] = time.perf_counter() - start
+        if METRICS.enabled:
+            METRICS.record("compaction", self.stats["compaction_seconds"])
+
+    def _append(self, entries: dict) -> None:
+        """
+        Append entries to the record log, with a single write
+        :param entries: dictionary {(website, email): Entry, or None to delete the account}
+        """
+        if len(entries) == 1:
+            self.store.put(*next(iter(entries.items())))
+        else:
+            self.store.put_many(entries)
+
+    def _journal_records(self, website: str, snapshot_signature) -> dict:
+        """
+        Get the records of the log for one website, decrypting only the records appended since the last call. The
+        whole log is read again if it was replaced or cut, by a compaction or a recovery. A compaction also replaces
+        the snapshot, which tells it apart from appends even when the new log got the inode of the old one back.
+        :param website: website name as stored in the vault
+        :param snapshot_signature: signature of the snapshot the records are applied to, None if there is none
+        :return: dictionary {(website, email): Entry or None, or website: Entry for records of older versions}, in
+                 the order the records were written
+        """
+        try:
+            stat = os.stat(self.store.file_name)
+        except FileNotFoundError:
+            self._journal = self._journal_position = None
+            return {}
+
+        position = self._journal_position
+        if (position is None or snapshot_signature != self._journal_snapshot
+                or (stat.st_dev, stat.st_ino) != position[:2] or stat.st_size < position[2]):
+            records, self._journal_position = self.store.read_from(0)
+            self._journal = {}
+            self._journal_snapshot = snapshot_signature
+        elif stat.st_size > position[2]:
+            records, self._journal_position = self.store.read_from(position[2])
+        else:
+            records = {}
+
+        for account, entry in records.items():
+            site = self._journal.setdefault(account if isinstance(account, str) else account[0], {})
+            if isinstance(account, str):
+                site.clear()
+            # Moved to the end, the records of a website are kept in the order they were last written
+            site.pop(account, None)
+            site[account] = entry
+        return self._journal.get(website, {})
+
+    def _file_signature(self) -> tuple:
+        """
+        Get the modification times and sizes of the snapshot and the record log
+        :return: tuple (snapshot signature, record log signature), each (mtime in nanoseconds, size in bytes) or
+                 None if the file does not exist
+        :raises FileNotFoundError: if neither file exists yet
+        """
+        signatures = []
+        for file_name in (self.snapshot.file_name, self.store.file_name):
+            try:
+                stat = os.stat(file_name)
+            except FileNotFoundError:
+                signatures.append(None)
+            else:
+                signatures.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        if signatures == [None, None]:
+            raise FileNotFoundError(f"No data file found in {os.path.dirname(self.store.file_name) or '.'}")
+        return tuple(signatures)
+
+
+def _apply(data: dict, accounts: AccountIndex, account, entry) -> None:
+    """
+    Apply one entry of the record log to the vault and its account index
+    :param data: dictionary {(website, email): Entry}
+    :param accounts: account index of the vault
+    :param account: tuple (website, email), or the website name for records of older versions, which replace
+                    every account of their website
+    :param entry: Entry, or None to delete the account
+    """
+    if isinstance(account, str):
+        for email in accounts.emails(account):
+            del data[(account, email)]
+            accounts.remove(account, email)
+        account = (account, entry.email)
+    if entry is None:
+        if data.pop(account, None) is not None:
+            accounts.remove(*account)
+    else:
+        data[account] = entry
+        accounts.add(*account)